@@ -0,0 +1,130 @@
+import argparse
+import os
+import sys
+import time
+
+import repository
+import helper_profile
+from helper_cache import (load_data, to_columnar)
+from helper_consolidation import load_parent_cube
+from helper_exposition import (roll_up, set_cube)
+
+# Ce module n'importe ni streamlit ni plotly: il demarre vite sur les noeuds de calcul
+SCALES = {'country': False, 'company': True, 'parent': 'Parent'}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Calcul des expositions GLEIF sans Streamlit')
+    parser.add_argument('--config', help='chemin du fichier config.toml')
+    parser.add_argument('--data-dir', help='dossier contenant les Trade Repositories et la nomenclature GLEIF')
+    parser.add_argument('--output', help='dossier de sortie (par defaut [batch].output du config)')
+    parser.add_argument('--format', choices=['parquet', 'csv'], help='format des fichiers ecrits')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), help='echelles a calculer')
+    parser.add_argument('--rates', nargs='+', help='indices a calculer (par defaut [rates].names du config)')
+    parser.add_argument('--backend', choices=['pandas', 'sql'],
+                        help='sql: pipeline hors memoire sous DuckDB (par defaut [sql].enabled du config)')
+    parser.add_argument('--jobs', type=int,
+                        help='processus pour construire le cube, par partition (0 = tous les coeurs, par defaut '
+                             '[batch].jobs puis [aggregation].workers)')
+    parser.add_argument('--workers', type=int,
+                        help='processus pour lire les Trade Repositories (0 = tous les coeurs, par defaut '
+                             '[ingestion].workers)')
+    parser.add_argument('--profile', action='store_true', help='ecrire les mesures de chaque etape en JSON')
+    return parser.parse_args()
+
+
+def write_exposition(cube, index: str, scale: str, path: str, file_format: str):
+    """
+    Cette fonction calcule et ecrit une exposition:
+    - Son but: Etre une tache independante pour une combinaison indice/echelle: un simple sous-total du cube
+
+    - Parametres: il faut renseigne le cube (le cube consolide pour l'echelle parent), l'indice, l'echelle
+                  (country, company ou parent), le chemin et le format
+
+    -Resultat : un tuple avec le chemin du fichier ecrit et son nombre de lignes
+    """
+    return write(roll_up(cube, [index], SCALES[scale] is not False), path, file_format)
+
+
+def write(result, path: str, file_format: str):
+    if file_format == 'csv':
+        result.to_csv(path, index=False)
+    else:
+        to_columnar(result).to_parquet(path, index=False)
+    return path, len(result)
+
+
+def run_batch(config: dict, data_dir: str = None):
+    """
+    Cette fonction est le point d'entree du mode batch:
+    - Son but: Charger les donnees une seule fois, construire le cube (l'etape couteuse, eventuellement en
+               parallele par partition de LEI ou de pays) puis ecrire l'une apres l'autre les expositions de chaque
+               indice et de chaque echelle demandes: ce ne sont que des sous-totaux du cube
+
+    - Parametres: il faut renseigne la config (section [batch]) et eventuellement le dossier des fichiers data
+
+    -Resultat : la liste des fichiers ecrits avec leur nombre de lignes
+    """
+    settings = config['batch']
+    directories = repository.get_directories(config['files']['names'], config['discovery'], data_dir)
+
+    os.makedirs(settings['output'], exist_ok=True)
+    tasks = [(index, scale, os.path.join(settings['output'], f"{scale}_{index}.{settings['format']}"))
+             for scale in settings['scales'] for index in settings['rates']]
+
+    if config['sql']['enabled']:
+        if 'parent' in settings['scales']:
+            raise ValueError("L'echelle parent n'est pas disponible avec le backend SQL")
+        # DuckDB parallelise deja chaque requete: les combinaisons sont calculees l'une apres l'autre
+        from helper_sql import (exposition_sql, set_data_sql)
+
+        connection = set_data_sql(directories, config)
+        return [write(exposition_sql(connection, [index], SCALES[scale]), path, settings['format'])
+                for index, scale, path in tasks]
+
+    # Les processus vont au groupby du cube: un pool pour les ecritures transmettrait le cube a chaque tache pour
+    # des sous-totaux de quelques millisecondes
+    data = load_data(directories, config)
+    workers = config['aggregation']['workers'] if settings.get('jobs') is None else settings['jobs']
+    cube = set_cube(data, workers, config['aggregation']['partition'])
+    cubes = {'country': cube, 'company': cube}
+    if 'parent' in settings['scales']:
+        cubes['parent'] = load_parent_cube(data, directories, config)
+
+    return [write_exposition(cubes[scale], index, scale, path, settings['format']) for index, scale, path in tasks]
+
+
+def main():
+    arguments = get_arguments()
+    config = repository.get_config(arguments.config)
+
+    # Les arguments de ligne de commande passent avant la config
+    settings = config['batch']
+    settings['rates'] = arguments.rates or config['rates']['names']
+    for key in ['output', 'format', 'scales', 'jobs']:
+        if getattr(arguments, key) is not None:
+            settings[key] = getattr(arguments, key)
+    if arguments.workers is not None:
+        config['ingestion']['workers'] = arguments.workers
+    if arguments.backend is not None:
+        config['sql']['enabled'] = arguments.backend == 'sql'
+    unknown = set(settings['rates']).difference(config['rates']['names'])
+    if unknown:
+        raise ValueError(f"Indices inconnus: {', '.join(sorted(unknown))}")
+
+    if arguments.profile:
+        helper_profile.enable(config['profile']['memory'])
+
+    start = time.perf_counter()
+    written = run_batch(config, arguments.data_dir)
+    for path, rows in written:
+        print(f'{path}: {rows} rows')
+    print(f'{len(written)} files written in {time.perf_counter() - start:.2f}s')
+
+    if arguments.profile:
+        helper_profile.to_json(os.path.join(settings['output'], config['profile']['output']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
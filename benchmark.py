@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import platform
+import time
+import numpy as np
+import pandas as pd
+
+from repository import set_data
+from helper_exposition import (get_countries, get_top_bottom, roll_up, set_cube, set_rank_index)
+from helper_profile import (disable, enable, get_records, reset, stage)
+
+ALPHANUMERIC = np.frombuffer(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ', dtype=np.uint8)
+UTI_CHARACTERS = np.frombuffer(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', dtype=np.uint8)
+COUNTRIES = ['FR', 'DE', 'IT', 'ES', 'NL', 'BE', 'GB', 'US', 'IE', 'LU', 'CH', 'JP', 'AT', 'PT', 'SE', 'DK']
+CHUNK_ROWS = 1_000_000
+
+
+def random_strings(rng: np.random.Generator, size: int, length: int, characters: np.ndarray):
+    # Tirage vectorise de chaines: une matrice d'octets vue comme des chaines de longueur fixe
+    matrix = characters[rng.integers(0, len(characters), size=(size, length))]
+    return matrix.view(f'S{length}').ravel().astype(str).astype(object)
+
+
+def make_leis(rng: np.random.Generator, size: int):
+    """
+    Cette fonction genere des LEI synthetiques:
+    - Son but: Produire des LEI au format ISO 17442 (18 caracteres alphanumeriques et 2 chiffres de controle
+               mod 97) sans boucle par LEI
+
+    - Parametres: il faut renseigne le generateur aleatoire et le nombre de LEI
+
+    -Resultat : un tableau de LEI uniques
+    """
+    body = ALPHANUMERIC[rng.integers(0, len(ALPHANUMERIC), size=(size, 18))]
+    # Chaque lettre vaut deux chiffres (A=10 ... Z=35): le reste mod 97 est calcule caractere par caractere
+    values = np.where(body >= ord('A'), body - ord('A') + 10, body - ord('0')).astype(np.int64)
+    remainder = np.zeros(size, dtype=np.int64)
+    for position in range(18):
+        value = values[:, position]
+        remainder = (remainder * np.where(value >= 10, 100, 10) + value) % 97
+    check = 98 - (remainder * 100) % 97
+    digits = np.stack([check // 10, check % 10], axis=1).astype(np.uint8) + ord('0')
+    leis = np.concatenate([body, digits], axis=1).view('S20').ravel().astype(str).astype(object)
+    return pd.unique(leis)
+
+
+def make_gleif(rng: np.random.Generator, entities: int):
+    leis = make_leis(rng, entities)
+    # Quelques pays concentrent la majorite des entites, comme dans la nomenclature reelle
+    weights = 1 / np.arange(1, len(COUNTRIES) + 1)
+    return pd.DataFrame({
+        'lei': leis,
+        'name': [f'ENTITY {i}' for i in range(len(leis))],
+        'country': rng.choice(COUNTRIES, size=len(leis), p=weights / weights.sum())
+    })
+
+
+def make_trades(rng: np.random.Generator, leis: np.ndarray, size: int, duplicates: float, mix: dict, previous=None):
+    """
+    Cette fonction genere un morceau de Trade Repository synthetique:
+    - Son but: Reproduire le schema des TR (lei_rptg, lei_othr, notional, side, fxd, flt, uti) avec un taux
+               de transactions declarees deux fois et une repartition des indices parametrables
+
+    - Parametres: il faut renseigne le generateur, les LEI, le nombre de lignes, le taux de doublons, la repartition
+                  des indices et eventuellement le morceau precedent (doublons entre fichiers)
+
+    -Resultat : une dataframe au format d'un Trade Repository
+    """
+    rptg = rng.integers(0, len(leis), size=size)
+    othr = (rptg + rng.integers(1, len(leis), size=size)) % len(leis)  # jamais la meme entite des deux cotes
+    indices = list(mix)
+    weights = np.array([mix[index] for index in indices], dtype=float)
+    trades = pd.DataFrame({
+        'lei_rptg': leis[rptg],
+        'lei_othr': leis[othr],
+        'notional': rng.integers(1_000, 1_000_000, size=size),
+        'side': rng.choice(['B', 'S'], size=size),
+        'fxd': np.round(rng.normal(0.3, 0.5, size=size), 3),
+        'flt': rng.choice(indices, size=size, p=weights / weights.sum()),
+        'uti': random_strings(rng, size, 15, UTI_CHARACTERS)
+    })
+
+    # Les doublons reprennent une transaction deja generee, dans ce morceau ou dans le precedent
+    count = int(size * duplicates)
+    if count:
+        pool = trades if previous is None else pd.concat([previous, trades], ignore_index=True)
+        rows = pool.iloc[rng.integers(0, len(pool), size=count)]
+        positions = rng.choice(size, size=count, replace=False)
+        for column in trades.columns:
+            trades.loc[positions, column] = rows[column].to_numpy()
+    return trades
+
+
+def generate(directory: str, trades: int, entities: int, duplicates: float, mix: dict, files: int = 2,
+             file_format: str = 'parquet', seed: int = 0):
+    """
+    Cette fonction ecrit un jeu de donnees synthetique complet:
+    - Son but: Produire des Trade Repositories et une nomenclature GLEIF de n'importe quelle taille, en ecrivant
+               par morceaux pour ne jamais garder tout le jeu en memoire
+
+    - Parametres: il faut renseigne le dossier, le nombre de transactions et d'entites, le taux de doublons,
+                  la repartition des indices, le nombre de fichiers TR, leur format et la graine
+
+    -Resultat : le dictionnaire des chemins d'acces, au format de get_directories
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Un jeu deja genere avec les memes parametres est reutilise tel quel
+    manifest = os.path.join(directory, 'directories.json')
+    if os.path.exists(manifest):
+        with open(manifest) as file:
+            return json.load(file)
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    gleif = make_gleif(rng, entities)
+    leis = gleif['lei'].to_numpy()
+    gleif_path = os.path.join(directory, 'GLEIF.xlsx' if file_format == 'xlsx' else f'GLEIF.{file_format}')
+    if file_format == 'xlsx':
+        gleif.to_excel(gleif_path, index=False)
+    elif file_format == 'csv':
+        gleif.to_csv(gleif_path, index=False)
+    else:
+        gleif.to_parquet(gleif_path, index=False)
+
+    directories = {'TR': [], 'GLEIF': [gleif_path]}
+    previous = None
+    for number, rows in enumerate(np.array_split(np.arange(trades), files), start=1):
+        path = os.path.join(directory, f'TR{number}.{file_format}')
+        writer = None
+        parts = []
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = make_trades(rng, leis, min(CHUNK_ROWS, len(rows) - start), duplicates, mix, previous)
+            previous = chunk.iloc[-min(len(chunk), 10_000):]
+            if file_format == 'parquet':
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            elif file_format == 'csv':
+                chunk.to_csv(path, index=False, mode='a' if start else 'w', header=not start)
+            else:
+                parts.append(chunk)
+        if writer is not None:
+            writer.close()
+        if parts:
+            # Excel est limite a environ un million de lignes par feuille
+            pd.concat(parts, ignore_index=True).to_excel(path, index=False)
+        directories['TR'].append(path)
+
+    with open(manifest, 'w') as file:
+        json.dump(directories, file, indent=2)
+    return directories
+
+
+def run(directories: dict, indices: list, memory: bool = False, workers: int = 1):
+    """
+    Cette fonction mesure chaque etape du pipeline sur un jeu de donnees:
+    - Son but: Chronometrer (et profiler en memoire) set_data tel qu'il tourne en production, validation et
+               controle qualite compris, puis les expositions et les filtres de la vue. Les temps par etape sont
+               ceux de l'instrumentation de helper_profile, les sous-etapes etant rattachees a leur parent
+
+    - Parametres: il faut renseigne les chemins d'acces, les indices, l'option memoire et le nombre de processus
+
+    -Resultat : la liste des mesures, une par etape, dans leur ordre d'appel
+    """
+    enable(memory)
+    reset()
+    try:
+        data = set_data(directories, workers)
+        cube = set_cube(data, workers)
+        with stage('exposition_country') as section:
+            country = roll_up(cube, indices, False)
+            section['rows'] = len(country)
+        with stage('exposition_company') as section:
+            section['rows'] = len(roll_up(cube, indices, True))
+        rank_index = set_rank_index(country, ['Ratio', 'Cash_Flow'])
+        for index in indices:
+            with stage(f'filter_top_{index}') as section:
+                section['rows'] = len(get_top_bottom(rank_index, index, 'Top', 10, 'Ratio'))
+            with stage(f'filter_countries_{index}') as section:
+                section['rows'] = len(get_countries(rank_index, rank_index['countries'][:10], index))
+        return [dict(record) for record in get_records()]
+    finally:
+        disable()
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark du pipeline GLEIF sur des donnees synthetiques')
+    parser.add_argument('--trades', type=int, nargs='+', default=[10_000, 100_000],
+                        help='nombre(s) de transactions, de 10k a 50M')
+    parser.add_argument('--entities', type=int, default=5_000, help="nombre d'entites dans la nomenclature GLEIF")
+    parser.add_argument('--duplicates', type=float, default=0.3, help='taux de transactions declarees deux fois')
+    parser.add_argument('--mix', nargs='+', default=['LIBOR=0.5', 'EONIA=0.5'], help='repartition des indices')
+    parser.add_argument('--files', type=int, default=2, help='nombre de Trade Repositories')
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'csv', 'xlsx'])
+    parser.add_argument('--workers', type=int, default=1, help='processus pour lire les Trade Repositories et agreger le cube')
+    parser.add_argument('--memory', action='store_true', help='mesurer le pic memoire de chaque etape (plus lent)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', default='.gleif_bench', help='dossier des jeux de donnees generes')
+    parser.add_argument('--output', default='bench_results.json', help='fichier JSON des resultats')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = get_arguments()
+    mix = {index: float(weight) for index, weight in (item.split('=') for item in arguments.mix)}
+
+    report = {
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'cpus': os.cpu_count(), 'machine': platform.machine()},
+        'parameters': {key: value for key, value in vars(arguments).items() if key not in ['data', 'output']},
+        'runs': []
+    }
+    for trades in arguments.trades:
+        directory = os.path.join(arguments.data, f'{trades}_{arguments.entities}_{arguments.duplicates}_'
+                                                 f'{arguments.files}_{"_".join(arguments.mix)}_{arguments.seed}.'
+                                                 f'{arguments.format}')
+        start = time.perf_counter()
+        directories = generate(directory, trades, arguments.entities, arguments.duplicates, mix, arguments.files,
+                               arguments.format, arguments.seed)
+        generation = time.perf_counter() - start
+        stages = run(directories, list(mix), arguments.memory, arguments.workers)
+        report['runs'].append({'trades': trades, 'generation_seconds': round(generation, 3), 'stages': stages})
+        print(f'{trades} trades: ' + ', '.join(f"{record['stage']} {record['seconds']:.3f}s" for record in stages
+                                               if record['depth'] == 0))
+
+    with open(arguments.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Test succesfully done !!!')
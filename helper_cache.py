@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from helper_profile import profiled
+from repository import (FRAMES, set_data)
+
+CACHE_VERSION = 6
+MANIFEST = 'manifest.json'
+SCHEMA = 'schema.json'
+# Colonne compagnon qui garde le type d'origine des valeurs d'une colonne mixte: 1 int, 2 float, 3 None
+KIND = '.kind'
+
+
+def file_signature(path: str, known: dict = None):
+    """
+    Cette fonction calcule la signature d'un fichier source:
+    - Son but: Identifier un fichier par sa taille, sa date de modification et le hash de son contenu.
+               Le hash n'est recalculé que si la taille ou la date ont changé depuis la dernière signature
+
+    - Parametres: il faut renseigne le chemin du fichier et eventuellement sa derniere signature connue
+
+    -Resultat : un dictionnaire avec la taille, le mtime et le sha256 du fichier
+    """
+    stat = os.stat(path)
+    if known is not None and known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime_ns:
+        return known
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+
+
+def to_columnar(df: pd.DataFrame):
+    # Excel lit certains LEI purement numériques comme des entiers: on stocke ces colonnes mixtes en texte,
+    # y compris dans les dictionnaires des colonnes categorielles. Les valeurs manquantes restent nulles
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype('string')
+        elif isinstance(df[column].dtype, pd.CategoricalDtype) and df[column].cat.categories.dtype == object:
+            df[column] = df[column].cat.rename_categories(df[column].cat.categories.astype('string'))
+    return df
+
+
+def encode(values):
+    # Texte nul-preservant et, seulement si la colonne n'est pas que du texte, le type d'origine de chaque valeur
+    values = pd.Series(values, dtype=object, copy=False)
+    kinds = np.array([0 if isinstance(value, str) or (isinstance(value, float) and value != value)
+                      else 1 if isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+                      else 2 if isinstance(value, (float, np.floating))
+                      else 3 if value is None else 0 for value in values], dtype=np.int8)
+    return values.astype('string').array, kinds if kinds.any() else None
+
+
+def decode(text: pd.Series, kinds: pd.Series = None):
+    values = text.to_numpy(dtype=object, na_value=np.nan)
+    if kinds is not None:
+        kinds = kinds.to_numpy()
+        for kind, cast in [(1, int), (2, float)]:
+            values[kinds == kind] = [cast(value) for value in values[kinds == kind]]
+        values[kinds == 3] = None
+    return values
+
+
+def write_frames(frames: dict, directory: str):
+    """
+    Cette fonction ecrit les dataframes de set_data dans une entree du cache:
+    - Son but: Garder la disposition memoire de set_data. Chaque dictionnaire de categories partage (LEI, noms,
+               pays, indices...) n'est ecrit qu'une fois et les colonnes categorielles ne stockent que leurs codes.
+               Les colonnes mixtes (LEI lus comme entiers par Excel) sont stockees en texte avec le type d'origine
+
+    - Parametres: il faut renseigne le dictionnaire de set_data et le dossier de l'entree
+
+    -Resultat : rien, le dossier contient un Parquet par dataframe, les dictionnaires et le schema
+    """
+    indexes = {id(df.index): name for name, df in frames.items()}
+    dictionaries, schema = {}, {'frames': {}, 'dictionaries': {}}
+
+    def store(stored: pd.DataFrame, column: str, values):
+        # Les colonnes object passent en texte, avec leur colonne compagnon si elles ne sont pas que du texte
+        if values.dtype != object:
+            stored[column] = values
+            return False
+        stored[column], kinds = encode(values)
+        if kinds is not None:
+            stored[column + KIND] = kinds
+        return True
+
+    for name, df in frames.items():
+        stored, columns = pd.DataFrame(index=df.index), {}
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Categories partagees: la meme instance donne le meme dictionnaire (ou l'index d'une dataframe)
+                categories = values.cat.categories
+                if id(categories) in indexes:
+                    columns[column] = {'index': indexes[id(categories)]}
+                else:
+                    key = dictionaries.setdefault(id(categories), (str(len(dictionaries)), categories))[0]
+                    columns[column] = {'dictionary': key}
+                columns[column]['ordered'] = bool(values.cat.ordered)
+                stored[column] = values.cat.codes
+            elif store(stored, column, values.to_numpy() if values.dtype == object else values):
+                columns[column] = {'object': True}
+        stored.to_parquet(os.path.join(directory, f'{name}.parquet'))
+        schema['frames'][name] = columns
+
+    for key, categories in dictionaries.values():
+        stored = pd.DataFrame(index=pd.RangeIndex(len(categories)))
+        schema['dictionaries'][key] = {'object': store(stored, 'value', categories), 'name': categories.name}
+        stored.to_parquet(os.path.join(directory, f'dictionary-{key}.parquet'))
+    with open(os.path.join(directory, SCHEMA), 'w') as file:
+        json.dump(schema, file, indent=2)
+
+
+def read_frames(directory: str):
+    # Relecture d'une entree: les colonnes categorielles sont reconstruites par from_codes sur des dictionnaires
+    # partages, comme dans set_data, au lieu d'un dictionnaire par colonne
+    with open(os.path.join(directory, SCHEMA)) as file:
+        schema = json.load(file)
+
+    def column(stored: pd.DataFrame, name: str):
+        return decode(stored[name], stored.get(name + KIND))
+
+    categories = {}
+    for key, settings in schema['dictionaries'].items():
+        stored = pd.read_parquet(os.path.join(directory, f'dictionary-{key}.parquet'))
+        values = column(stored, 'value') if settings['object'] else stored['value'].array
+        categories[key] = pd.Index(values, dtype=object if settings['object'] else None, name=settings['name'])
+    stored = {name: pd.read_parquet(os.path.join(directory, f'{name}.parquet')) for name in schema['frames']}
+
+    dtypes, result = {}, {}
+    for name, columns in schema['frames'].items():
+        frame = {}
+        for label in stored[name].columns:
+            settings = columns.get(label, {})
+            if label.endswith(KIND) and columns.get(label[:-len(KIND)], {}).get('object'):
+                continue
+            elif 'object' in settings:
+                frame[label] = column(stored[name], label)
+            elif 'ordered' in settings:
+                # Une seule instance de CategoricalDtype par dictionnaire: toutes les colonnes le partagent
+                source = settings.get('index') or settings['dictionary']
+                if (source, settings['ordered']) not in dtypes:
+                    values = stored[source].index if 'index' in settings else categories[source]
+                    dtypes[(source, settings['ordered'])] = pd.CategoricalDtype(values, settings['ordered'])
+                frame[label] = pd.Categorical.from_codes(stored[name][label].to_numpy(),
+                                                         dtype=dtypes[(source, settings['ordered'])])
+            else:
+                frame[label] = stored[name][label]
+        result[name] = pd.DataFrame(frame, index=stored[name].index)
+    return result
+
+
+def get_cache_key(directories: dict, config: dict, known: dict = None):
+    """
+    Cette fonction calcule la clé du cache:
+    - Son but: Combiner les signatures de tous les fichiers sources et la partie de la config qui influe
+               sur set_data, de tel façon que la moindre modification d'un input change la clé
+
+    - Parametres: il faut renseigne les chemins d'acces, la config et les signatures deja connues
+
+    -Resultat : un tuple avec la clé et les signatures des fichiers
+    """
+    known = known or {}
+    signatures = {}
+    # Les relations GLEIF niveau 2 (RR) ne sont presentes que pour les expositions consolidees par groupe
+    sources = [key for key in ['TR', 'GLEIF', 'RR'] if key in directories]
+    for key in sources:
+        for path in directories[key]:
+            path = os.path.abspath(path)
+            signatures[path] = file_signature(path, known.get(path))
+
+    payload = {
+        'version': CACHE_VERSION,
+        'sources': {key: [signatures[os.path.abspath(path)]['sha256'] for path in directories[key]]
+                    for key in sources},
+        'config': {section: config.get(section) for section in config['cache']['sections']}
+    }
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return digest, signatures
+
+
+@profiled
+def load_data(directories: dict, config: dict):
+    """
+    Cette fonction remplace set_data par une version persistée sur disque:
+    - Son but: Relire en quelques millisecondes les dataframes Buyer, Seller et Repository au format Parquet
+               et ne relancer set_data que si un fichier source ou la config a changé
+
+    - Parametres: il faut renseigne les chemins d'acces de nos fichiers et la config
+
+    -Resultat : le meme dictionnaire que set_data
+    """
+    settings = config.get('cache', {})
+    if not settings.get('enabled', False):
+        return set_data(directories, config['ingestion']['workers'], config['quality']['quarantine'],
+                        config['gleif'])
+
+    cache_dir = settings['directory']
+    manifest_path = os.path.join(cache_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    key, signatures = get_cache_key(directories, config, manifest.get('files'))
+    entry_dir = os.path.join(cache_dir, key)
+
+    if manifest.get('key') == key and os.path.exists(os.path.join(entry_dir, SCHEMA)):
+        if signatures != manifest.get('files'):
+            # Fichier touché mais contenu identique: on garde le hash pour ne pas le recalculer
+            with open(manifest_path, 'w') as file:
+                json.dump({'key': key, 'files': signatures}, file, indent=2)
+        return read_frames(entry_dir)
+
+    # Un input a changé: on reconstruit puis on remplace l'ancienne entrée
+    result = set_data(directories, config['ingestion']['workers'], config['quality']['quarantine'],
+                      config['gleif'])
+    tmp_dir = entry_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    write_frames({frame: result[frame] for frame in FRAMES}, tmp_dir)
+    if manifest.get('key'):
+        shutil.rmtree(os.path.join(cache_dir, manifest['key']), ignore_errors=True)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+    with open(manifest_path, 'w') as file:
+        json.dump({'key': key, 'files': signatures}, file, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    import time
+    from repository import (get_config, get_directories)
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    for attempt in ['cold', 'warm']:
+        start = time.perf_counter()
+        data = load_data(directoires, config_file)
+        print(f'{attempt}: {time.perf_counter() - start:.3f}s')
+
+    print(data['Buyer'])
+    print('Test succesfully done !!!')
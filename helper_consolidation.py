@@ -0,0 +1,253 @@
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from helper_exposition import MEASURES
+from helper_gleif import (get_lookup, is_golden_copy, open_golden_copy)
+from helper_profile import profiled
+
+# Golden copy niveau 2 (<date>-gleif-goldencopy-rr-golden-copy.csv[.zip]): une relation par ligne, de l'enfant
+# (StartNode) vers le parent (EndNode). Seules les relations de consolidation directe actives sont gardees
+RR_FIELDS = {'Relationship.StartNode.NodeID': 'child', 'Relationship.EndNode.NodeID': 'parent',
+             'Relationship.RelationshipType': 'type', 'Relationship.RelationshipStatus': 'status'}
+RELATIONSHIP_TYPE = 'IS_DIRECTLY_CONSOLIDATED_BY'
+RELATIONSHIP_STATUS = 'ACTIVE'
+
+
+def get_relationships_path(directories: dict, settings: dict):
+    # Le fichier des relations est cherche a cote de la nomenclature GLEIF, sauf chemin absolu
+    path = settings['relationships']
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(directories['GLEIF'][0]), path)
+    return path if os.path.isfile(path) else None
+
+
+@profiled
+def read_relationships(path: str, batch_rows: int = 500000):
+    """
+    Cette fonction lit les relations parent/enfant de GLEIF niveau 2:
+    - Son but: Lire la golden copy des relations par blocs (seuls les LEI enfant et parent des relations de
+               consolidation directe actives sont gardes), ou une table reduite avec les colonnes child et parent
+
+    - Parametres: il faut renseigne le chemin du fichier et le nombre de lignes par bloc
+
+    -Resultat : une dataframe child, parent (LEI en texte)
+    """
+    if is_golden_copy(path):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pv
+
+        file, extension = open_golden_copy(path)
+        if extension != '.csv':
+            raise ValueError('Seule la golden copy des relations au format CSV est prise en charge')
+        with file:
+            reader = pv.open_csv(file, read_options=pv.ReadOptions(block_size=1 << 24),
+                                 convert_options=pv.ConvertOptions(include_columns=list(RR_FIELDS),
+                                                                   column_types={f: pa.string() for f in RR_FIELDS}))
+            batches = [batch.filter(pc.and_(pc.equal(batch.column(2), RELATIONSHIP_TYPE),
+                                            pc.equal(batch.column(3), RELATIONSHIP_STATUS))).select([0, 1])
+                       for batch in reader]
+        table = pa.Table.from_batches(batches) if batches else pa.table({f: pa.array([], pa.string())
+                                                                           for f in list(RR_FIELDS)[:2]})
+        return table.rename_columns(['child', 'parent']).to_pandas()
+
+    from repository import read_source
+
+    relationships = read_source(path)[['child', 'parent']].dropna()
+    return relationships.astype(str)
+
+
+@profiled
+def set_closure(relationships: pd.DataFrame):
+    """
+    Cette fonction precalcule la fermeture de la hierarchie des groupes, une seule fois:
+    - Son but: Donner a chaque LEI son parent ultime et la liste aplatie de ses ancetres, par sauts de pointeurs
+               vectorises (chaque passe double la distance parcourue) au lieu d'un parcours du graphe par requete.
+               Un cycle (donnees incoherentes) est rompu sur son plus petit LEI, qui devient la tete du groupe
+
+    - Parametres: il faut renseigne les relations child, parent
+
+    -Resultat : un dictionnaire avec l'index des LEI, le parent direct et ultime (en codes), les ancetres au
+                format CSR (indptr, ancestors, du parent direct au parent ultime) et le nombre de cycles rompus
+    """
+    relationships = relationships[relationships['child'] != relationships['parent']]
+    # Un enfant declare avec plusieurs parents directs garde le premier
+    relationships = relationships.drop_duplicates(subset='child', keep='first')
+    codes, nodes = pd.factorize(pd.concat([relationships['child'], relationships['parent']], ignore_index=True),
+                                sort=True)
+    size = len(nodes)
+    parent = np.arange(size)
+    parent[codes[:len(relationships)]] = codes[len(relationships):]
+    jumps = max(1, int(np.ceil(np.log2(max(size, 2)))) + 1)
+
+    def ultimate(parent: np.ndarray):
+        # Apres jumps doublements, chaque LEI a parcouru plus de size relations: il est sur sa tete ou sur un cycle
+        jump = parent
+        for _ in range(jumps):
+            jump = jump[jump]
+        return jump
+
+    jump = ultimate(parent)
+    on_cycle = parent[jump] != jump
+    cycles = 0
+    if on_cycle.any():
+        # Plus petit code de chaque cycle: le minimum sur les 2^jumps successeurs couvre tout le cycle
+        minimum, step = np.arange(size), parent
+        for _ in range(jumps):
+            minimum = np.minimum(minimum, minimum[step])
+            step = step[step]
+        heads = np.unique(minimum[np.unique(jump[on_cycle])])
+        parent = parent.copy()
+        parent[heads] = heads
+        cycles = len(heads)
+        jump = ultimate(parent)
+
+    # Ancetres aplatis: une passe par niveau de profondeur, vectorisee sur tous les LEI
+    steps, current = [], np.arange(size)
+    while True:
+        following = parent[current]
+        if (following == current).all():
+            break
+        steps.append(np.where(following != current, following, -1))
+        current = following
+    steps = np.array(steps, dtype=np.int64).reshape(len(steps), size).T
+    depth = (steps >= 0).sum(axis=1)
+    return {'lei': pd.Index(nodes), 'parent': parent, 'ultimate': jump, 'cycles': cycles,
+            'indptr': np.concatenate([[0], np.cumsum(depth)]), 'ancestors': steps[steps >= 0]}
+
+
+def get_ancestors(closure: dict, lei: str):
+    # Chaine des parents d'un LEI, du parent direct au parent ultime (vide si le LEI n'a pas de parent)
+    position = closure['lei'].get_indexer([str(lei)])[0]
+    if position < 0:
+        return []
+    return closure['lei'][closure['ancestors'][closure['indptr'][position]:closure['indptr'][position + 1]]].tolist()
+
+
+def get_parents(closure: dict, leis: pd.Index, known: pd.Index = None):
+    """
+    Cette fonction rend le parent de consolidation de chaque LEI:
+    - Son but: Remonter au parent ultime, ou, si une nomenclature est donnee, a l'ancetre le plus haut qu'elle
+               connait (un parent sans nom ni pays ferait disparaitre l'exposition du groupe). Un LEI sans parent
+               est sa propre tete de groupe
+
+    - Parametres: il faut renseigne la fermeture, les LEI (texte) et eventuellement les LEI de la nomenclature
+
+    -Resultat : un tableau des LEI parents, aligne sur leis
+    """
+    leis = pd.Index(leis.astype(str), dtype=object)
+    position = closure['lei'].get_indexer(leis)
+    parents = leis.to_numpy(dtype=object).copy()
+    if len(closure['ancestors']) == 0:
+        return parents
+
+    ancestors = closure['ancestors']
+    usable = np.ones(len(ancestors), dtype=bool) if known is None \
+        else pd.Index(known.astype(str), dtype=object).get_indexer(closure['lei'][ancestors]) >= 0
+    # Pour chaque LEI, la derniere position utilisable de sa tranche d'ancetres
+    last = np.maximum.accumulate(np.where(usable, np.arange(len(ancestors)), -1))
+    start, stop = closure['indptr'][:-1], closure['indptr'][1:]
+    best = np.where(stop > start, last[np.maximum(stop - 1, 0)], -1)
+    best = np.where(best >= start, best, -1)
+
+    found = position >= 0
+    chosen = best[position[found]]
+    values = parents[found]
+    values[chosen >= 0] = closure['lei'][ancestors[chosen[chosen >= 0]]].to_numpy(dtype=object)
+    parents[found] = values
+    return parents
+
+
+def get_group_leis(closure: dict, leis: pd.Index):
+    # LEI des entites et de tous leurs ancetres: ceux dont il faut connaitre le nom et le pays
+    leis = pd.Index(leis.astype(str), dtype=object)
+    position = closure['lei'].get_indexer(leis)
+    selected = np.zeros(len(closure['lei']), dtype=bool)
+    selected[position[position >= 0]] = True
+    ancestors = closure['ancestors'][np.repeat(selected, np.diff(closure['indptr']))]
+    return leis.union(closure['lei'][ancestors])
+
+
+def read_nomenclature(directories: dict, leis: pd.Index, settings: dict = None):
+    # Noms et pays des tetes de groupe: avec la golden copy, la table de correspondance est etendue a leurs LEI
+    path = directories['GLEIF'][0]
+    if is_golden_copy(path):
+        return pd.read_parquet(get_lookup(path, pd.Index(leis.astype(str)), settings))
+    from repository import read_source
+
+    return read_source(path)
+
+
+@profiled
+def set_parent_cube(data: dict, closure: dict, nomenclature: pd.DataFrame):
+    """
+    Cette fonction construit le cube consolide par groupe:
+    - Son but: Re-indexer en une passe les jambes buyer et seller sur le LEI de leur tete de groupe (le parent
+               est calcule une fois par LEI distinct, pas par transaction) puis agreger par (groupe, indice)
+
+    - Parametres: il faut renseigne le dictionnaire de set_data, la fermeture et la nomenclature GLEIF
+
+    -Resultat : une dataframe avec le LEI, le nom et le pays de la tete de groupe, l'indice, le nombre d'entites
+                consolidees et les expositions brute, nette et le cash flow
+    """
+    buyer, seller = data['Buyer'], data['Seller']
+    lei = union_categoricals([buyer['Lei'].array.astype('category'), seller['Lei'].array.astype('category')])
+    nomenclature = nomenclature.assign(lei=nomenclature['lei'].astype(str)).drop_duplicates('lei')
+    nomenclature = nomenclature.set_index('lei')
+    parents = pd.Categorical(get_parents(closure, pd.Index(lei.categories), pd.Index(nomenclature.index)))
+
+    # La jambe seller compte positivement dans l'exposition nette, la jambe buyer negativement
+    notional = np.concatenate([buyer['Notional'].to_numpy(dtype=float), seller['Notional'].to_numpy(dtype=float)])
+    codes = np.asarray(lei.codes)
+    legs = pd.DataFrame({
+        'Lei': pd.Categorical.from_codes(np.where(codes >= 0, parents.codes[codes], -1), dtype=parents.dtype),
+        'Index': np.concatenate([buyer['Index'].to_numpy(dtype=object), seller['Index'].to_numpy(dtype=object)]),
+        'Entity': codes,
+        'Gross_Exposure': notional,
+        'Net_Exposure': np.concatenate([-notional[:len(buyer)], notional[len(buyer):]]),
+        'Cash_Flow': np.concatenate([buyer['Cash_Flow'].to_numpy(dtype=float),
+                                     seller['Cash_Flow'].to_numpy(dtype=float)])
+    })
+    groups = legs.groupby(['Lei', 'Index'], observed=True)
+    cube = groups[MEASURES].sum().join(groups['Entity'].nunique().rename('Entities')).reset_index()
+
+    names = nomenclature.reindex(cube['Lei'].astype(str))
+    cube.insert(1, 'Name', pd.Categorical(names['name'].to_numpy(dtype=object)))
+    cube.insert(2, 'Country', pd.Categorical(names['country'].to_numpy(dtype=object)))
+    cube['Index'] = pd.Categorical(cube['Index'])
+    return cube
+
+
+def load_parent_cube(data: dict, directories: dict, config: dict):
+    """
+    Cette fonction enchaine les etapes de la consolidation par groupe:
+    - Son but: Lire les relations, precalculer leur fermeture, lire le nom et le pays des tetes de groupe puis
+               construire le cube consolide. Sans fichier de relations, chaque entite est sa propre tete de groupe
+
+    - Parametres: il faut renseigne le dictionnaire de set_data, les chemins d'acces (cle RR pour les relations,
+                  par defaut cherchees selon la section [consolidation]) et la config
+
+    -Resultat : le cube consolide par groupe
+    """
+    relationships = directories.get('RR') or [get_relationships_path(directories, config['consolidation'])]
+    closure = set_closure(read_relationships(relationships[0], config['gleif']['batch_rows']) if relationships[0]
+                          else pd.DataFrame({'child': [], 'parent': []}, dtype=object))
+    if closure['cycles']:
+        print(f" We have {closure['cycles']} cycles in the GLEIF relationships, broken on their smallest LEI\n\n")
+    leis = get_group_leis(closure, pd.Index(data['Entities']['Lei']))
+    return set_parent_cube(data, closure, read_nomenclature(directories, leis, config['gleif']))
+
+
+if __name__ == '__main__':
+    from repository import (get_config, get_directories, set_data)
+    from helper_exposition import exposition
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    data = set_data(directoires)
+
+    data['Parent_Cube'] = load_parent_cube(data, directoires, config_file)
+    print(exposition(d=data, i=config_file['rates']['names'], scl=['Parent']).head())
+    print('Test succesfully done !!!')
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from helper_profile import profiled
+
+MEASURES = ['Gross', 'Net']
+UNKNOWN = 'Unknown'
+
+
+def set_matrix(rows: np.ndarray, columns: np.ndarray, values: np.ndarray, size: int):
+    """
+    Cette fonction construit une matrice creuse carree au format CSR:
+    - Son but: Sommer les doublons (row, column) et ranger les valeurs ligne par ligne, pour qu'une ligne
+               ne soit plus qu'une tranche des tableaux indices et data
+
+    - Parametres: il faut renseigne les lignes, les colonnes, les valeurs et la taille de la matrice
+
+    -Resultat : un dictionnaire avec indptr, indices, data et la taille
+    """
+    keys, inverse = np.unique(rows.astype(np.int64) * size + columns, return_inverse=True)
+    data = np.bincount(inverse, weights=values, minlength=len(keys))
+    counts = np.bincount(keys // size, minlength=size)
+    return {'indptr': np.concatenate([[0], np.cumsum(counts)]), 'indices': keys % size, 'data': data, 'size': size}
+
+
+def get_row(matrix: dict, row: int):
+    # Une ligne est une tranche: les colonnes non nulles et leurs valeurs
+    start, stop = matrix['indptr'][row], matrix['indptr'][row + 1]
+    return matrix['indices'][start:stop], matrix['data'][start:stop]
+
+
+def get_labels(data: dict, level: str):
+    # Libelles des lignes: le nom de l'entite (son LEI a defaut, ou en cas d'homonyme) ou le pays
+    buyer = data['Buyer']
+    leis = pd.Index(buyer['Lei'].cat.categories)
+    entities = data['Entities'].assign(Lei=data['Entities']['Lei'].astype(str)).drop_duplicates('Lei')
+    entities = entities.set_index('Lei').reindex(leis.astype(str))
+    if level == 'Country':
+        country = pd.Categorical(entities['Country'].astype(object))
+        codes = country.codes.astype(np.int64)
+        labels = np.append(np.asarray(country.categories, dtype=object), UNKNOWN)
+        return np.where(codes < 0, len(labels) - 1, codes), labels
+
+    names = entities['Name'].astype(object).where(entities['Name'].notna(), leis.astype(str).to_numpy())
+    duplicated = names.duplicated(keep=False).to_numpy()
+    labels = np.where(duplicated, names.astype(str) + ' [' + leis.astype(str) + ']', names.astype(str))
+    return np.arange(len(leis)), np.asarray(labels, dtype=object)
+
+
+@profiled
+def set_counterparty(data: dict, level: str = 'Lei'):
+    """
+    Cette fonction construit les matrices bilaterales d'exposition, par indice:
+    - Son but: Voir qui est expose a qui. Pour chaque transaction, le buyer et le seller sont relies par le
+               notionnel: la matrice brute est symetrique, la matrice nette est antisymetrique (le seller est
+               expose positivement au buyer, comme dans le cube). Les matrices sont creuses, seules les paires
+               qui ont traite ensemble sont stockees
+
+    - Parametres: il faut renseigne le dictionnaire de set_data et le niveau (Lei pour entite par entite,
+                  Country pour pays par pays)
+
+    -Resultat : un dictionnaire avec les libelles des lignes et, pour chaque indice, les matrices Gross et Net
+    """
+    buyer, seller = data['Buyer'], data['Seller']
+    codes, labels = get_labels(data, level)
+
+    # Les deux jambes d'une meme transaction sont a la meme position, sur le meme dictionnaire de LEI
+    seller_lei = seller['Lei'].array
+    if seller_lei.dtype != buyer['Lei'].dtype:
+        seller_lei = pd.Categorical(seller_lei.astype(object), dtype=buyer['Lei'].dtype)
+    known = (buyer['Lei'].cat.codes.to_numpy() >= 0) & (seller_lei.codes >= 0)
+    rows = codes[buyer['Lei'].cat.codes.to_numpy()[known]]
+    columns = codes[seller_lei.codes[known]]
+    notional = np.nan_to_num(buyer['Notional'].to_numpy(dtype=float)[known])
+    index = buyer['Index'].to_numpy(dtype=object)[known]
+
+    counterparty = {'level': level, 'labels': labels, 'position': pd.Index(labels)}
+    for name in pd.unique(index[pd.notna(index)]):
+        mask = index == name
+        b, s, n = rows[mask], columns[mask], notional[mask]
+        # Une transaction interne a une ligne (meme pays par exemple) ne compte qu'une fois sur la diagonale
+        other = b != s
+        counterparty[name] = {
+            'Gross': set_matrix(np.concatenate([b, s[other]]), np.concatenate([s, b[other]]),
+                                np.concatenate([n, n[other]]), len(labels)),
+            'Net': set_matrix(np.concatenate([s, b]), np.concatenate([b, s]), np.concatenate([n, -n]), len(labels))
+        }
+    return counterparty
+
+
+def get_exposures(counterparty: dict, index: str, label: str):
+    # Expositions brute et nette d'une entite (ou d'un pays) envers chacune de ses contreparties
+    row = counterparty['position'].get_loc(label)
+    columns, gross = get_row(counterparty[index]['Gross'], row)
+    net_columns, net = get_row(counterparty[index]['Net'], row)
+    return pd.DataFrame({'Counterparty': counterparty['labels'][columns], 'Gross': gross,
+                         'Net': pd.Series(net, index=net_columns).reindex(columns, fill_value=0).to_numpy()})
+
+
+def get_top_counterparties(counterparty: dict, index: str, label: str, k: int, measure: str = 'Gross'):
+    """
+    Cette fonction classe les contreparties d'une entite ou d'un pays:
+    - Son but: Rendre les k plus grosses expositions (en valeur absolue) sans parcourir la matrice entiere
+
+    - Parametres: il faut renseigne les matrices, l'indice, le libelle de la ligne, k et la mesure (Gross ou Net)
+
+    -Resultat : une dataframe d'au plus k lignes avec la contrepartie, les expositions brute et nette
+    """
+    exposures = get_exposures(counterparty, index, label)
+    if len(exposures) > k:
+        top = np.argpartition(-exposures[measure].abs().to_numpy(), k - 1)[:k]
+        exposures = exposures.iloc[top]
+    return exposures.reindex(exposures[measure].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+
+def get_block(counterparty: dict, index: str, rows: list, columns: list, measure: str = 'Gross'):
+    """
+    Cette fonction extrait un bloc dense de la matrice pour la heatmap:
+    - Son but: Ne lire que les lignes demandees et n'en garder que les colonnes demandees, quelle que soit
+               la taille de la matrice
+
+    - Parametres: il faut renseigne les matrices, l'indice, les libelles des lignes et des colonnes et la mesure
+
+    -Resultat : une dataframe len(rows) x len(columns)
+    """
+    matrix = counterparty[index][measure]
+    position = counterparty['position']
+    targets = position.get_indexer(columns)
+    block = np.zeros((len(rows), len(columns)))
+    for i, row in enumerate(position.get_indexer(rows)):
+        row_columns, values = get_row(matrix, row) if row >= 0 else ([], [])
+        if len(row_columns) == 0:
+            continue
+        # Les colonnes d'une ligne CSR sont triees: recherche dichotomique des colonnes demandees
+        found = np.searchsorted(row_columns, targets).clip(max=len(row_columns) - 1)
+        hit = row_columns[found] == targets
+        block[i, hit] = values[found[hit]]
+    return pd.DataFrame(block, index=rows, columns=columns)
+
+
+@profiled
+def get_concentration(counterparty: dict, index: str, measure: str = 'Gross'):
+    """
+    Cette fonction calcule la concentration des expositions de chaque ligne:
+    - Son but: Mesurer la dependance a quelques contreparties: nombre de contreparties, total, part de la
+               premiere contrepartie et indice de Herfindahl (somme des parts au carre), en une passe vectorisee
+
+    - Parametres: il faut renseigne les matrices, l'indice et la mesure (Gross ou Net)
+
+    -Resultat : une dataframe par entite ou pays ayant au moins une contrepartie, triee par total decroissant
+    """
+    matrix = counterparty[index][measure]
+    counts = np.diff(matrix['indptr'])
+    rows = np.repeat(np.arange(matrix['size']), counts)
+    values = np.abs(matrix['data'])
+    total = np.bincount(rows, weights=values, minlength=matrix['size'])
+    share = np.divide(values, total[rows], out=np.zeros_like(values), where=total[rows] != 0)
+    present = counts > 0
+    top = np.zeros(matrix['size'])
+    top[present] = np.maximum.reduceat(share, matrix['indptr'][:-1][present])
+
+    concentration = pd.DataFrame({
+        'Entity': counterparty['labels'],
+        'Counterparties': counts,
+        'Total': total,
+        'Top_Share': top,
+        'HHI': np.bincount(rows, weights=share ** 2, minlength=matrix['size'])
+    })[present]
+    return concentration.sort_values('Total', ascending=False, kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    from repository import (get_config, get_directories, set_data)
+
+    config_file = get_config()
+    data = set_data(get_directories(config_file['files']['names'], config_file['discovery']))
+    for niveau in ['Lei', 'Country']:
+        matrices = set_counterparty(data, niveau)
+        indice = config_file['rates']['names'][0]
+        concentration = get_concentration(matrices, indice)
+        print(concentration.head())
+        print(get_top_counterparties(matrices, indice, concentration['Entity'].iloc[0], 5))
+
+    print('Test succesfully done !!!')
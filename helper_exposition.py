@@ -1,6 +1,238 @@
+import os
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
+from helper_profile import profiled
 
+KEYS = ['Name', 'Country', 'Index']
+MEASURES = ['Gross_Exposure', 'Net_Exposure', 'Cash_Flow']
+
+
+def aggregate_partition(blocks: list, start: int, stop: int):
+    """
+    Cette fonction agrege une partition des jambes dans un processus du pool:
+    - Son but: Lire sa tranche [start, stop) directement dans la memoire partagee, sans copie, et sommer
+               les expositions par cle
+
+    - Parametres: il faut renseigne les blocs de memoire partagee (nom, dtype) de la cle et des mesures,
+                  et les bornes de la partition
+
+    -Resultat : un tuple avec les cles de la partition et la liste des sommes partielles de chaque mesure
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    memories = [SharedMemory(name=name) for name, _ in blocks]
+    try:
+        arrays = [np.ndarray((stop,), dtype=dtype, buffer=memory.buf)[start:] for memory, (_, dtype) in
+                  zip(memories, blocks)]
+        inverse, keys = pd.factorize(arrays[0])
+        sums = [np.bincount(inverse, weights=measure, minlength=len(keys)) for measure in arrays[1:]]
+        del arrays
+    finally:
+        for memory in memories:
+            memory.close()
+    return keys, sums
+
+
+def set_cube_partitioned(legs: pd.DataFrame, partition: np.ndarray, workers: int):
+    """
+    Cette fonction est la version multi-coeurs du groupby de set_cube:
+    - Son but: Repartir les jambes en partitions selon un hash (le code du LEI ou du pays), les agreger dans un
+               pool de processus puis combiner les sommes partielles. Les colonnes sont placees une seule fois
+               en memoire partagee, triees par partition, et chaque processus n'en lit que sa tranche
+
+    - Parametres: il faut renseigne les jambes empilees (cles categorielles), le code de partition de chaque
+                  jambe et le nombre de processus
+
+    -Resultat : la meme dataframe que le groupby de set_cube
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing.shared_memory import SharedMemory
+
+    # Une seule cle entiere par (Name, Country, Index). Les valeurs manquantes prennent le dernier code pour
+    # etre classees en fin, comme avec groupby(dropna=False)
+    sizes = [len(legs[key].cat.categories) + 1 for key in KEYS]
+    key = np.zeros(len(legs), dtype=np.int64)
+    for column, size in zip(KEYS, sizes):
+        codes = legs[column].cat.codes.to_numpy().astype(np.int64)
+        key = key * size + np.where(codes < 0, size - 1, codes)
+
+    partitions = workers * 2
+    partition = np.asarray(partition, dtype=np.int64) % partitions
+    order = np.argsort(partition, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(partition, minlength=partitions))])
+
+    columns = [key] + [np.nan_to_num(legs[measure].to_numpy(dtype=float)) for measure in MEASURES]
+    memories = []
+    try:
+        for column in columns:
+            memory = SharedMemory(create=True, size=max(column.nbytes, 1))
+            memories.append(memory)
+            np.ndarray(column.shape, dtype=column.dtype, buffer=memory.buf)[:] = column[order]
+        blocks = [(memory.name, column.dtype.str) for memory, column in zip(memories, columns)]
+        del columns, order
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(aggregate_partition, blocks, bounds[i], bounds[i + 1])
+                       for i in range(partitions) if bounds[i] < bounds[i + 1]]
+            results = [future.result() for future in futures]
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    # Combine: une meme cle peut apparaitre dans plusieurs partitions (plusieurs LEI sous un meme nom)
+    inverse, keys = pd.factorize(np.concatenate([keys for keys, _ in results]))
+    sums = [np.bincount(inverse, weights=np.concatenate([partial[i] for _, partial in results]),
+                        minlength=len(keys)) for i in range(len(MEASURES))]
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    cube = {}
+    for column, size in reversed(list(zip(KEYS, sizes))):
+        codes = keys % size
+        cube[column] = pd.Categorical.from_codes(np.where(codes == size - 1, -1, codes),
+                                                 dtype=legs[column].dtype)
+        keys = keys // size
+    cube = pd.DataFrame({column: cube[column] for column in KEYS})
+    for measure, total in zip(MEASURES, sums):
+        cube[measure] = total[order]
+    return cube
+
+
+@profiled
+def set_cube(data: dict, workers: int = 1, partition: str = 'Lei'):
+    """
+    Cette fonction construit le cube des expositions:
+    - Son but: Agreger en une seule passe les jambes buyer et seller par (Name, Country, Index), pour que
+               toutes les expositions (pays, entreprises, un ou plusieurs indices) soient des sous-totaux du cube
+
+    - Parametres: il faut renseigne le dictionnaire de la base de données traitée, et eventuellement le nombre
+                  de processus (0 pour tous les coeurs) et la colonne de partition (Lei ou Country)
+
+    -Resultat : une dataframe avec les expositions brute, net et le cash flow par (Name, Country, Index)
+    """
+    buyer, seller = data["Buyer"], data["Seller"]
+
+    def stack(column: str):
+        # Les colonnes categorielles sont empilees sur leurs codes, sans repasser par les chaines. Les categories
+        # sont triees pour que le groupby rende les cles dans l'ordre alphabetique
+        if all(isinstance(leg[column].dtype, pd.CategoricalDtype) for leg in [buyer, seller]):
+            return union_categoricals([buyer[column].array, seller[column].array], sort_categories=True)
+        return np.concatenate([buyer[column].to_numpy(), seller[column].to_numpy()])
+
+    # La jambe seller compte positivement dans l'exposition nette, la jambe buyer negativement
+    notional = stack('Notional').astype(float)
+    legs = pd.DataFrame({
+        'Name': stack('Name'),
+        'Country': stack('Country'),
+        'Index': stack('Index'),
+        'Gross_Exposure': notional,
+        'Net_Exposure': np.concatenate([-notional[:len(buyer)], notional[len(buyer):]]),
+        'Cash_Flow': stack('Cash_Flow').astype(float)
+    })
+
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers <= 1:
+        return legs.groupby(KEYS, dropna=False, observed=True).sum().reset_index()
+
+    for column in KEYS:
+        if not isinstance(legs[column].dtype, pd.CategoricalDtype):
+            legs[column] = pd.Categorical(legs[column])
+    # Le hash d'une jambe est le code de son LEI (ou de son pays): il suffit que ce code soit commun aux deux jambes
+    if partition == 'Lei':
+        codes = union_categoricals([buyer['Lei'].array, seller['Lei'].array]).codes
+    else:
+        codes = legs[partition].cat.codes
+    return set_cube_partitioned(legs, np.asarray(codes), workers)
+
+
+@profiled
+def roll_up(cube: pd.DataFrame, index: list, scale: bool):
+    """
+    Cette fonction calcule l'exposition a partir du cube:
+    - Son but: Filtrer le cube sur l'indice ou les indices et sommer a l'echelle nationale si besoin
+
+    - Parametres: il faut renseigne le cube, la liste des indices et un booleen pour l'echelle individuelle
+
+    -Resultat : une dataframe avec les expositions brute, net et ratio brute net selon nos parametres
+    """
+    repository = cube[cube['Index'].isin(index)]
+    if scale:
+        # Le cube est deja a l'echelle des entreprises: il suffit d'ecarter les entites sans nomenclature
+        repository = repository.dropna(subset=KEYS).reset_index(drop=True)
+    else:
+        repository = repository.groupby(['Country', 'Index'], observed=True)[MEASURES].sum().reset_index()
+
+    # Les filtres de la vue travaillent sur les codes: on ne garde que les categories encore presentes
+    for key in repository.columns.intersection(KEYS):
+        if isinstance(repository[key].dtype, pd.CategoricalDtype):
+            repository[key] = repository[key].cat.remove_unused_categories()
+
+    gross = repository['Gross_Exposure'].to_numpy()
+    net = repository['Net_Exposure'].to_numpy()
+    repository['Ratio'] = np.divide(net, gross, out=np.zeros_like(net), where=gross != 0)
+    return repository
+
+
+@profiled
+def set_rank_index(data: pd.DataFrame, columns: list):
+    """
+    Cette fonction construit l'index des rangs d'une exposition, une seule fois par jeu de donnees:
+    - Son but: Pre-trier les lignes de chaque indice (et de l'ensemble des indices) par colonne, dans l'ordre
+               decroissant et croissant, et garder les positions des lignes de chaque pays, pour que les Top/Bottom N
+               et les selections de pays soient des tranches de k lignes, sans parcourir ni copier la dataframe
+
+    - Parametres: il faut renseigne les expositions et la liste des colonnes a classer
+
+    -Resultat : un dictionnaire avec les expositions, les positions triees par (indice, colonne, Top/Bottom),
+                les positions de chaque pays et la liste des pays
+    """
+    partitions = {None: np.arange(len(data))}
+    partitions.update(data.groupby('Index', observed=True, sort=False).indices)
+
+    rank = {}
+    for column in columns:
+        values = data[column].to_numpy(dtype=float)
+        for index, positions in partitions.items():
+            # Comme nlargest et nsmallest: les NaN sont ecartes et les ex aequo gardent l'ordre des lignes
+            positions = positions[~np.isnan(values[positions])]
+            rank[(index, column, 'Top')] = positions[np.argsort(-values[positions], kind='stable')]
+            rank[(index, column, 'Bottom')] = positions[np.argsort(values[positions], kind='stable')]
+
+    countries = data.groupby('Country', observed=True, sort=False).indices
+    return {'data': data, 'rank': rank, 'country': countries, 'index': data['Index'].to_numpy(dtype=object),
+            'countries': list(countries)}
+
+
+def get_top_bottom(rank_index: dict, index, top_bottom: str, num: int, column: str):
+    """
+    Cette fonction selectionne les expositions extremes a partir de l'index des rangs:
+    - Son but: Garder les num lignes les plus hautes (Top) ou les plus basses (Bottom) d'un indice selon une colonne
+
+    - Parametres: il faut renseigne l'index des rangs, l'indice (None pour tous les indices), "Top" ou "Bottom",
+                  le nombre de lignes et la colonne
+
+    -Resultat : une dataframe avec au plus num lignes, vide si l'indice n'a pas de donnees
+    """
+    positions = rank_index['rank'].get((index, column, top_bottom))
+    if positions is None or len(positions) == 0:
+        return pd.DataFrame()
+    return rank_index['data'].iloc[positions[:num]]
+
+
+def get_countries(rank_index: dict, countries, index=None):
+    # Lignes des pays selectionnes (pour un indice ou pour tous), dans l'ordre de la dataframe comme avec isin
+    positions = [rank_index['country'][country] for country in countries if country in rank_index['country']]
+    positions = np.sort(np.concatenate(positions)) if positions else np.array([], dtype=np.intp)
+    if index is not None:
+        positions = positions[rank_index['index'][positions] == index]
+    return rank_index['data'].iloc[positions]
+
+
+@profiled
 def exposition(**kwargs):
     """
         Cette fonction est modulaire selon les arguments qu'on lui transmet:
@@ -8,7 +240,8 @@ def exposition(**kwargs):
                    souhaitée
 
         - Parametres: il faut renseigne un dictionnaire contenant la base de données traitée, une liste avec l'indice ou
-                      les indices et un booleen si on veut à l'echelle individuelle des entreprises
+                      les indices et un booleen si on veut à l'echelle individuelle des entreprises (ou 'Parent'
+                      pour l'echelle des groupes, a partir du cube consolide Parent_Cube)
 
         -Resultat : une dataframe avec les expositions brute, net et ratio brute net selon nos parametres
     """
@@ -25,42 +258,25 @@ def exposition(**kwargs):
             scale = kwargs[parametres[2]]
     index = list(kwargs[parametres[1]])
 
-    def filtering(idx: list, scl: bool):
-
-        buyer = kwargs[parametres[0]]["Buyer"]
-        seller = kwargs[parametres[0]]["Seller"]
-
-        buyer = buyer[buyer['Index'].isin(idx)]
-        seller = seller[seller['Index'].isin(idx)]
-
-        if scl is False:
-            buyer = buyer.groupby(['Country', 'Index'])
-            seller = seller.groupby(['Country', 'Index'])
-        else:
-            buyer = buyer.groupby(['Name', 'Country', 'Index'])
-            seller = seller.groupby(['Name', 'Country', 'Index'])
-
-        repository = pd.DataFrame({
-            'Gross_Exposure': buyer['Notional'].sum().add(seller['Notional'].sum(), fill_value=0),
-            'Net_Exposure': seller['Notional'].sum().subtract(buyer['Notional'].sum(), fill_value=0),
-            'Cash_Flow': seller['Cash_Flow'].sum().add(buyer['Cash_Flow'].sum(), fill_value=0)
-        }).reset_index()
-
-        repository['Ratio'] = repository.apply(
-            lambda row: (row['Net_Exposure'] / row['Gross_Exposure']) if row['Gross_Exposure'] != 0 else 0,
-            axis=1
-        )
-        result = repository
-        return result
+    # Le cube precalcule par l'appelant (data['Cube']) est reutilise, sinon il est construit pour cet appel sans
+    # modifier le dictionnaire recu
+    data = kwargs[parametres[0]]
+    if scale == ['Parent']:
+        if 'Parent_Cube' not in data:
+            raise ValueError("Le cube consolide par groupe n'a pas été calculé")
+        return roll_up(data['Parent_Cube'], index, True)
+    cube = data['Cube'] if 'Cube' in data else set_cube(data)
 
-    return filtering(index, scale)
+    return roll_up(cube, index, scale is not False)
 
 
 if __name__ == '__main__':
     from repository import (get_config, set_data, get_directories)
 
     config_file = get_config()
-    data = set_data(get_directories(config_file['files']['names']))
+    data = set_data(get_directories(config_file['files']['names'], config_file['discovery']))
+    # Le cube est construit une fois ici, puis partage par les quatre expositions
+    data['Cube'] = set_cube(data)
     eonia_exposition = exposition(d=data, i=['EONIA'])
     libor_exposition = exposition(d=data, i=['LIBOR'])
     eonia_libor_expo = exposition(d=data, i=['EONIA', 'LIBOR'])
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+
+from helper_profile import profiled
+
+# Les fichiers de la golden copy officielle s'appellent <date>-gleif-goldencopy-lei2-golden-copy.<csv|xml>[.zip]
+GOLDEN_COPY = 'goldencopy'
+# Champs de la golden copy niveau 1 (format LEI-CDF) projetes vers les colonnes de la nomenclature
+CSV_FIELDS = {'LEI': 'lei', 'Entity.LegalName': 'name', 'Entity.LegalAddress.Country': 'country'}
+# En XML, un champ est reconnu a son nom et a celui de son parent (le pays du siege social est ignore)
+XML_FIELDS = {('LEIRecord', 'LEI'): 'lei', ('Entity', 'LegalName'): 'name', ('LegalAddress', 'Country'): 'country'}
+LOOKUP = {'directory': '.gleif_lookup', 'batch_rows': 500000}
+
+
+def is_golden_copy(path: str):
+    return GOLDEN_COPY in os.path.basename(path).lower().replace('-', '').replace('_', '')
+
+
+def open_golden_copy(path: str):
+    # Les golden copies sont publiees zippees: on lit l'unique fichier de l'archive en flux, sans le decompresser
+    if path.lower().endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        member = archive.namelist()[0]
+        return archive.open(member), os.path.splitext(member)[1].lower()
+    return open(path, 'rb'), os.path.splitext(path)[1].lower()
+
+
+def iter_csv(file, leis: pd.Index, batch_rows: int):
+    # pyarrow lit le CSV par blocs, ne convertit que les trois champs utiles et filtre chaque bloc d'un coup
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pv
+
+    reader = pv.open_csv(file, read_options=pv.ReadOptions(block_size=1 << 24),
+                         convert_options=pv.ConvertOptions(include_columns=list(CSV_FIELDS),
+                                                           column_types={field: pa.string() for field in CSV_FIELDS}))
+    value_set = None if leis is None else pa.array(leis.astype(str).to_numpy(dtype=object), type=pa.string())
+    batches, rows = [], 0
+    for batch in reader:
+        if value_set is not None:
+            batch = batch.filter(pc.is_in(batch.column(0), value_set=value_set))
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_rows:
+            yield pa.Table.from_batches(batches).rename_columns(list(CSV_FIELDS.values())).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).rename_columns(list(CSV_FIELDS.values())).to_pandas()
+
+
+class RecordTarget:
+    # Cible du parseur XML: aucun arbre n'est construit, seuls les champs utiles du LEIRecord courant sont gardes
+    def __init__(self, needed: set):
+        self.needed = needed
+        self.path, self.text, self.record, self.names = ['LEIData'], [], {}, {}
+        self.columns = {column: [] for column in XML_FIELDS.values()}
+
+    def start(self, tag, attrib):
+        # Les balises sont prefixees par l'espace de noms: on ne garde que le nom local, une fois par balise
+        name = self.names.get(tag)
+        if name is None:
+            name = self.names[tag] = tag.rpartition('}')[2]
+        self.path.append(name)
+        self.text = []
+
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, tag):
+        name = self.path.pop()
+        field = XML_FIELDS.get((self.path[-1], name))
+        if field is not None:
+            self.record[field] = ''.join(self.text).strip()
+        elif name == 'LEIRecord':
+            if self.needed is None or self.record.get('lei') in self.needed:
+                for column, values in self.columns.items():
+                    values.append(self.record.get(column))
+            self.record = {}
+
+    def close(self):
+        return None
+
+
+def iter_xml(file, leis: pd.Index, batch_rows: int):
+    # Lecture par blocs d'1 Mo: la memoire ne depend que du nombre de LEI gardes, jamais de la taille du fichier
+    from xml.etree.ElementTree import XMLParser
+
+    target = RecordTarget(None if leis is None else set(leis.astype(str)))
+    parser = XMLParser(target=target)
+    for block in iter(lambda: file.read(1 << 20), b''):
+        parser.feed(block)
+        if len(target.columns['lei']) >= batch_rows:
+            yield pd.DataFrame(target.columns)
+            target.columns = {column: [] for column in target.columns}
+    parser.close()
+    if target.columns['lei']:
+        yield pd.DataFrame(target.columns)
+
+
+@profiled
+def read_golden_copy(path: str, leis: pd.Index = None, batch_rows: int = LOOKUP['batch_rows']):
+    """
+    Cette fonction lit la golden copy GLEIF niveau 1 en flux:
+    - Son but: Parcourir un fichier de plusieurs Go (CSV ou XML, zippe ou non) par blocs, en ne gardant que
+               le LEI, la raison sociale et le pays, et seulement pour les LEI presents dans nos Trade Repositories
+               (semi-jointure), pour que la memoire depende du nombre de contreparties et non de la taille du fichier
+
+    - Parametres: il faut renseigne le chemin de la golden copy, les LEI recherches (None pour tous) et le nombre
+                  de lignes par bloc
+
+    -Resultat : une dataframe lei, name, country au format de la nomenclature GLEIF, dans l'ordre du fichier
+    """
+    file, extension = open_golden_copy(path)
+    with file:
+        iterator = iter_xml if extension == '.xml' else iter_csv
+        chunks = list(iterator(file, leis, batch_rows))
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in CSV_FIELDS.values()})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def get_trade_leis(trade_repositories: list):
+    # LEI distincts des deux contreparties, sous forme de texte comme dans la golden copy
+    leis = [df[column].dropna().astype(str).unique()
+            for df in trade_repositories for column in ['lei_rptg', 'lei_othr']]
+    return pd.Index(np.unique(np.concatenate(leis))) if leis else pd.Index([], dtype=object)
+
+
+@profiled
+def get_lookup(path: str, leis: pd.Index, settings: dict = None):
+    """
+    Cette fonction rend la table de correspondance compacte extraite de la golden copy:
+    - Son but: Ne parcourir la golden copy qu'une fois par version du fichier. La table (Parquet) et la liste des
+               LEI deja recherches sont gardees sur disque: tant que la golden copy n'a pas change et que les LEI
+               demandes ont deja ete recherches, la table est relue telle quelle. Sinon la golden copy est relue
+               pour l'union des LEI, la table ne fait que grossir avec les nouvelles contreparties
+
+    - Parametres: il faut renseigne le chemin de la golden copy, les LEI des Trade Repositories et la section
+                  [gleif] de la config
+
+    -Resultat : le chemin du fichier Parquet lei, name, country
+    """
+    settings = {**LOOKUP, **(settings or {})}
+    stat = os.stat(path)
+    entry = os.path.join(settings['directory'], hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16])
+    manifest = {}
+    if os.path.exists(entry + '.json'):
+        with open(entry + '.json') as file:
+            manifest = json.load(file)
+
+    if manifest.get('size') == stat.st_size and manifest.get('mtime') == stat.st_mtime_ns:
+        searched = pd.Index(pd.read_parquet(entry + '-leis.parquet')['lei'])
+        if (searched.get_indexer(leis) >= 0).all():
+            return entry + '.parquet'
+        leis = searched.union(leis)
+
+    os.makedirs(settings['directory'], exist_ok=True)
+    lookup = read_golden_copy(path, leis, settings['batch_rows'])
+    lookup.to_parquet(entry + '.parquet.tmp', index=False)
+    pd.DataFrame({'lei': leis.astype(str)}).to_parquet(entry + '-leis.parquet.tmp', index=False)
+    os.replace(entry + '.parquet.tmp', entry + '.parquet')
+    os.replace(entry + '-leis.parquet.tmp', entry + '-leis.parquet')
+    with open(entry + '.json', 'w') as file:
+        json.dump({'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                   'leis': len(leis), 'records': len(lookup)}, file, indent=2)
+    return entry + '.parquet'
+
+
+def collect_leis(chunks):
+    # Union des LEI distincts chunk par chunk: seules les valeurs uniques restent en memoire, jamais les colonnes
+    leis = pd.Index([], dtype=object)
+    for chunk in chunks:
+        leis = leis.union(get_trade_leis([chunk]))
+    return leis
+
+
+def read_lookup(path: str, trade_repositories: list, settings: dict = None, leis: pd.Index = None):
+    # Nomenclature tiree de la golden copy, limitee aux contreparties des Trade Repositories (ou aux LEI transmis)
+    leis = get_trade_leis(trade_repositories) if leis is None else leis
+    return pd.read_parquet(get_lookup(path, leis, settings))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from repository import (get_config, get_directories, read_gleif, read_trade_repositories)
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    golden_copy = sys.argv[1] if len(sys.argv) > 1 else directoires['GLEIF'][0]
+    repositories = read_trade_repositories(directoires['TR'])
+    for attempt in ['cold', 'warm']:
+        start = time.perf_counter()
+        nomenclature = read_gleif(golden_copy, repositories, config_file['gleif'])
+        print(f'{attempt}: {len(nomenclature)} LEI, {time.perf_counter() - start:.3f}s')
+
+    print(nomenclature.head())
+    print('Test succesfully done !!!')
@@ -0,0 +1,172 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from repository import (read_gleif, read_trade_repository, set_gleif, set_legs, set_lei_index)
+from helper_exposition import (KEYS, MEASURES)
+from helper_uti import (drop_duplicates, print_report, save, set_uti_index)
+
+GROUP = ['Lei', 'Index']
+
+
+def get_state(config: dict):
+    """
+    Cette fonction relit l'etat incremental persiste sur disque:
+    - Son but: Retrouver les agregats par (Lei, Index), les UTI deja vus et les fichiers deja integres
+
+    - Parametres: il faut renseigne la config
+
+    -Resultat : un dictionnaire avec les agregats, l'index des UTI (hash 64 bits) et la liste des sources
+    """
+    directory = config['incremental']['directory']
+    if not os.path.exists(os.path.join(directory, 'sources.json')):
+        aggregates = pd.DataFrame(columns=GROUP + ['Name', 'Country'] + MEASURES + ['Ratio']).set_index(GROUP)
+        return {'Aggregates': aggregates, 'Uti': set_uti_index(), 'Sources': []}
+
+    with open(os.path.join(directory, 'sources.json')) as file:
+        sources = json.load(file)
+    return {
+        'Aggregates': pd.read_parquet(os.path.join(directory, 'aggregates.parquet')),
+        'Uti': set_uti_index(os.path.join(directory, 'uti.npy')),
+        'Sources': sources
+    }
+
+
+def set_state(state: dict, config: dict):
+    # Ecrit l'etat dans un dossier temporaire puis le remplace, pour ne jamais laisser un etat a moitie ecrit
+    directory = config['incremental']['directory']
+    tmp_dir = directory + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    state['Aggregates'].to_parquet(os.path.join(tmp_dir, 'aggregates.parquet'))
+    save(state['Uti'], os.path.join(tmp_dir, 'uti.npy'))
+    with open(os.path.join(tmp_dir, 'sources.json'), 'w') as file:
+        json.dump(state['Sources'], file, indent=2)
+    if os.path.exists(directory):
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    os.replace(tmp_dir, directory)
+
+
+def set_ratio(aggregates: pd.DataFrame):
+    gross = aggregates['Gross_Exposure'].to_numpy(dtype=float)
+    net = aggregates['Net_Exposure'].to_numpy(dtype=float)
+    return np.divide(net, gross, out=np.zeros_like(net), where=gross != 0)
+
+
+def set_group_index(index: pd.MultiIndex):
+    # Une cle manquante a le code -1, qu'elle sorte du groupby ou de la relecture Parquet: un groupe sans LEI ou
+    # sans indice deja persiste est ainsi retrouve dans une nouvelle livraison
+    return pd.MultiIndex.from_frame(index.to_frame(index=False).astype('string'))
+
+
+def append_repository(state: dict, path: str, lei_index: dict, trade_repository: pd.DataFrame = None):
+    """
+    Cette fonction integre un nouveau Trade Repository dans l'etat incremental:
+    - Son but: Ne traiter que le delta. Les UTI deja vus sont ecartes, seules les nouvelles jambes sont agregees
+               puis ajoutees aux agregats, et le ratio n'est recalcule que pour les groupes touches
+
+    - Parametres: il faut renseigne l'etat, le chemin du nouveau fichier, l'index des LEI de GLEIF et
+                  eventuellement le fichier deja lu
+
+    -Resultat : l'etat mis a jour et le nombre de transactions deja connues pour ce fichier
+    """
+    if trade_repository is None:
+        trade_repository = read_trade_repository(path)
+
+    # Garde la premiere occurrence, dans le fichier comme par rapport aux livraisons precedentes
+    trade_repository, duplicates = drop_duplicates(trade_repository, state['Uti'], [path], [len(trade_repository)])
+
+    gleif_trade, _, _ = set_gleif(trade_repository, lei_index)
+    buyer, seller = set_legs(gleif_trade)
+    legs = pd.concat([buyer, seller], ignore_index=True)
+    notional = legs['Notional'].to_numpy(dtype=float)
+    # Les LEI numeriques lus par Excel sont ranges en texte, un LEI ou un indice manquant reste manquant comme
+    # dans set_data: il forme son propre groupe au lieu d'un groupe 'nan'
+    legs = pd.DataFrame({
+        'Lei': legs['Lei'].astype('string'),
+        'Index': legs['Index'].astype('string'),
+        'Name': legs['Name'].astype(object),
+        'Country': legs['Country'].astype(object),
+        'Gross_Exposure': notional,
+        'Net_Exposure': np.where((legs['Position'] == 'Seller').to_numpy(), notional, -notional),
+        'Cash_Flow': legs['Cash_Flow'].to_numpy(dtype=float)
+    })
+    delta = legs.groupby(GROUP, dropna=False).agg({'Name': 'first', 'Country': 'first', 'Gross_Exposure': 'sum',
+                                                   'Net_Exposure': 'sum', 'Cash_Flow': 'sum'})
+    delta.index = set_group_index(delta.index)
+
+    # Les groupes deja connus sont incrementes, les nouveaux sont ajoutes
+    aggregates = state['Aggregates'].set_axis(set_group_index(state['Aggregates'].index))
+    known = delta.index.isin(aggregates.index)
+    touched = delta.index[known]
+    aggregates.loc[touched, MEASURES] = aggregates.loc[touched, MEASURES].to_numpy(dtype=float) \
+        + delta.loc[touched, MEASURES].to_numpy()
+    aggregates.loc[touched, 'Ratio'] = set_ratio(aggregates.loc[touched])
+
+    added = delta[~known].copy()
+    added['Ratio'] = set_ratio(added)
+    aggregates = added if aggregates.empty else pd.concat([aggregates, added])
+
+    state = {
+        'Aggregates': aggregates,
+        'Uti': state['Uti'],
+        'Sources': state['Sources'] + [os.path.abspath(path)]
+    }
+    return state, duplicates
+
+
+def update(paths: list, gleif_path: str, config: dict):
+    """
+    Cette fonction est le point d'entree du mode incremental:
+    - Son but: Integrer une ou plusieurs nouvelles livraisons et persister l'etat sans repartir de zero. Une
+               livraison deja integree (meme chemin absolu) est ignoree et signalee
+
+    - Parametres: il faut renseigne les chemins des nouveaux Trade Repositories, celui de GLEIF et la config
+
+    -Resultat : l'etat mis a jour
+    """
+    state = get_state(config)
+    # Une livraison deja presente dans les sources n'est pas relue: ses chemins ne seraient sinon ajoutes une
+    # seconde fois
+    known, new_paths = set(state['Sources']), []
+    for path in paths:
+        if os.path.abspath(path) in known:
+            print(f" We have {path} that has already been integrated, it is skipped\n\n")
+        else:
+            known.add(os.path.abspath(path))
+            new_paths.append(path)
+    if not new_paths:
+        return state
+    paths = new_paths
+
+    # Chaque livraison n'est lue qu'une fois: ses LEI sont recherches dans la golden copy puis elle est integree
+    repositories = [read_trade_repository(path) for path in paths]
+    lei_index = set_lei_index(read_gleif(gleif_path, repositories, config['gleif']))
+    for path, trade_repository in zip(paths, repositories):
+        state, duplicates = append_repository(state, path, lei_index, trade_repository)
+        print_report(duplicates)
+    set_state(state, config)
+    return state
+
+
+def to_cube(state: dict):
+    # Passe des agregats par LEI au cube (Name, Country, Index) utilise par exposition
+    aggregates = state['Aggregates'].reset_index()
+    return aggregates.groupby(KEYS, dropna=False)[MEASURES].sum().reset_index()
+
+
+if __name__ == '__main__':
+    import sys
+    from repository import (get_config, get_directories)
+    from helper_exposition import exposition
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    new_files = sys.argv[1:] or directoires['TR']
+    etat = update(new_files, directoires['GLEIF'][0], config_file)
+
+    country_expo = exposition(data={'Cube': to_cube(etat)}, indice=config_file['rates']['names'])
+    print(country_expo.head())
+    print('Test succesfully done !!!')
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from helper_exposition import MEASURES
+
+
+def get_render_mode(data: pd.DataFrame, plots: dict):
+    # Au dela du seuil, les points sont dessines en WebGL par le navigateur plutot qu'en SVG
+    return 'webgl' if len(data) > plots['webgl_threshold'] else 'svg'
+
+
+def downsample(data: pd.DataFrame, max_rows: int, by: str, group: str = None, label: str = 'Others'):
+    """
+    Cette fonction borne le nombre de lignes envoyees a un graphique:
+    - Son but: Garder exactes les plus grosses expositions et regrouper la longue traine en une ligne "Others"
+               (une par groupe, par exemple par pays pour garder la couleur), dont le ratio est recalcule
+               sur les sommes
+
+    - Parametres: il faut renseigne les expositions, le nombre maximum de lignes, la colonne qui classe les lignes,
+                  eventuellement la colonne de groupe et le libelle de la traine
+
+    -Resultat : une dataframe d'au plus max_rows lignes (plus une ligne "Others" par groupe)
+    """
+    if len(data) <= max_rows:
+        return data
+
+    order = np.argsort(-data[by].abs().to_numpy(), kind='stable')
+    head, tail = data.iloc[order[:max_rows]], data.iloc[order[max_rows:]]
+
+    groups = [group] if group is not None else []
+    others = tail.groupby(groups, observed=True)[MEASURES].sum().reset_index() if groups \
+        else tail[MEASURES].sum().to_frame().T
+    counts = tail.groupby(groups, observed=True).size().to_numpy() if groups else [len(tail)]
+    others['Name'] = [f'{label} ({count})' for count in counts]
+    gross = others['Gross_Exposure'].to_numpy(dtype=float)
+    net = others['Net_Exposure'].to_numpy(dtype=float)
+    others['Ratio'] = np.divide(net, gross, out=np.zeros_like(net), where=gross != 0)
+    for column in data.columns.difference(others.columns):
+        others[column] = tail[column].iloc[0] if tail[column].nunique(dropna=False) == 1 else label
+
+    # Les colonnes categorielles ne connaissent pas le libelle "Others": le resultat, petit, repasse en texte
+    head = head.astype({column: object for column in head.columns
+                        if isinstance(head[column].dtype, pd.CategoricalDtype)})
+    return pd.concat([head, others[data.columns]], ignore_index=True)
@@ -0,0 +1,159 @@
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+# Desactive par defaut: une etape non mesuree ne coute qu'un test sur ce dictionnaire
+PROFILE = {'enabled': False, 'memory': False}
+# Chaque session Streamlit tourne dans son propre thread: les mesures et la pile des etapes lui sont propres
+LOCAL = threading.local()
+
+
+def enable(memory: bool = False):
+    """
+    Cette fonction active l'instrumentation du pipeline:
+    - Son but: Mesurer le temps, le nombre de lignes et eventuellement le pic memoire de chaque etape
+
+    - Parametres: un booleen si on veut aussi mesurer la memoire avec tracemalloc (nettement plus lent)
+
+    -Resultat : aucun, les mesures sont accumulees jusqu'au prochain reset
+    """
+    PROFILE['enabled'] = True
+    PROFILE['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    PROFILE['enabled'] = False
+    if PROFILE['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    PROFILE['memory'] = False
+
+
+def get_records():
+    if not hasattr(LOCAL, 'records'):
+        LOCAL.records = []
+        LOCAL.stack = []
+    return LOCAL.records
+
+
+def reset():
+    get_records().clear()
+    LOCAL.stack = []
+
+
+def count_rows(value):
+    # Le nombre de lignes est celui de la premiere dataframe rendue (set_gleif, drop_duplicates rendent des tuples)
+    first = value[0] if isinstance(value, tuple) and value else value
+    if isinstance(first, list):
+        return sum(len(df) for df in first) if all(isinstance(df, pd.DataFrame) for df in first) else None
+    if isinstance(first, dict):
+        return None
+    return len(first) if hasattr(first, '__len__') else None
+
+
+@contextmanager
+def measure(name: str):
+    records = get_records()
+    stack = LOCAL.stack
+    record = {'stage': name, 'depth': len(stack), 'seconds': None, 'rows': None, 'peak_mb': None}
+    records.append(record)
+
+    memory = PROFILE['memory'] and tracemalloc.is_tracing()
+    if memory:
+        # Le pic de l'etape parente est conserve avant de remettre le compteur a zero pour l'etape courante
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_start'] = record['_peak'] = current
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        stack.pop()
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak'))
+            record['peak_mb'] = round((peak - record.pop('_start')) / 2 ** 20, 3)
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+
+
+def stage(name: str):
+    """
+    Cette fonction delimite une etape a mesurer dans un bloc with:
+    - Son but: Instrumenter une portion de code (une section de la vue, une concatenation...) sans la deplacer
+               dans une fonction. Le nombre de lignes peut etre renseigne sur l'objet rendu: section['rows'] = n
+
+    - Parametres: il faut renseigne le nom de l'etape
+
+    -Resultat : un context manager, qui ne fait rien si l'instrumentation est desactivee
+    """
+    if not PROFILE['enabled']:
+        return nullcontext({})
+    return measure(name)
+
+
+def profiled(function):
+    # Decorateur: mesure chaque appel de la fonction sous son nom, le nombre de lignes est deduit du resultat
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not PROFILE['enabled']:
+            return function(*args, **kwargs)
+        with measure(function.__name__) as record:
+            value = function(*args, **kwargs)
+            record['rows'] = count_rows(value)
+            return value
+    return wrapper
+
+
+def get_report():
+    """
+    Cette fonction rassemble les mesures de la session:
+    - Son but: Presenter les etapes dans leur ordre d'appel, les sous-etapes etant indentees sous leur parent
+
+    - Parametres: aucun
+
+    -Resultat : une dataframe avec le nom, la profondeur, le temps, le nombre de lignes et le pic memoire de chaque
+                etape
+    """
+    report = pd.DataFrame(get_records(), columns=['stage', 'depth', 'seconds', 'rows', 'peak_mb'])
+    report['stage'] = ['  ' * depth + name for name, depth in zip(report['stage'], report['depth'])]
+    report['rows'] = report['rows'].astype('Int64')
+    return report.drop(columns='depth')
+
+
+def to_json(path: str = None):
+    # Export JSON des mesures, ecrit dans un fichier si un chemin est donne
+    payload = json.dumps({'memory': PROFILE['memory'], 'stages': get_records()}, indent=2)
+    if path is not None:
+        with open(path, 'w') as file:
+            file.write(payload)
+    return payload
+
+
+if __name__ == '__main__':
+    # Lance en script, ce module est charge une seconde fois sous son nom par les modules instrumentes
+    import helper_profile
+    from repository import (get_config, get_directories, set_data)
+    from helper_exposition import (exposition, set_cube)
+
+    config_file = get_config()
+    helper_profile.enable(memory=True)
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    data = set_data(directoires)
+    data['Cube'] = set_cube(data)
+    exposition(data=data, indice=config_file['rates']['names'])
+    exposition(data=data, indice=config_file['rates']['names'], scale=[True])
+
+    print(helper_profile.get_report().to_string(index=False))
+    helper_profile.to_json(config_file['profile']['output'])
+    print('Test succesfully done !!!')
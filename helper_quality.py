@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from helper_profile import profiled
+
+LEI_COLUMNS = ['lei_rptg', 'lei_othr']
+SIDES = ['B', 'S']
+CHECKS = ['lei_missing', 'lei_format', 'lei_checksum', 'lei_unknown', 'side_invalid', 'flt_missing', 'fxd_missing']
+
+
+def check_lei(leis: np.ndarray):
+    """
+    Cette fonction verifie des LEI selon la norme ISO 17442:
+    - Son but: Controler en une passe vectorisee le format (18 caracteres alphanumeriques majuscules puis 2 chiffres)
+               et la cle mod 97 (le LEI converti en nombre, A=10 ... Z=35, doit valoir 1 modulo 97). Seules les
+               20 positions sont parcourues, jamais les lignes
+
+    - Parametres: il faut renseigne le tableau des LEI
+
+    -Resultat : un tuple de trois tableaux booleens: LEI manquant, format invalide, cle de controle invalide
+    """
+    missing = pd.isna(leis)
+    # Excel lit certains LEI purement numeriques comme des entiers: ils sont controles sous forme de texte
+    text = pd.Series(leis, dtype=object).where(~missing, '').astype(str)
+    candidate = (text.str.len().to_numpy() == 20) & text.str.isascii().to_numpy()
+
+    chars = np.zeros((len(text), 20), dtype=np.uint8)
+    chars[candidate] = text[candidate].to_numpy(dtype='S20').view(np.uint8).reshape(-1, 20)
+    digit = (chars >= ord('0')) & (chars <= ord('9'))
+    upper = (chars >= ord('A')) & (chars <= ord('Z'))
+    valid_format = candidate & (digit | upper)[:, :18].all(axis=1) & digit[:, 18:].all(axis=1)
+
+    values = np.where(upper, chars.astype(np.int64) - ord('A') + 10, chars.astype(np.int64) - ord('0'))
+    remainder = np.zeros(len(text), dtype=np.int64)
+    for position in range(20):
+        value = values[:, position]
+        remainder = (remainder * np.where(value >= 10, 100, 10) + value) % 97
+
+    return missing, ~missing & ~valid_format, valid_format & (remainder != 1)
+
+
+@profiled
+def validate(trade_repository: pd.DataFrame, lei_index: dict):
+    """
+    Cette fonction controle la qualite d'un trade repository avant l'enrichissement GLEIF:
+    - Son but: Reperer sans boucle par ligne les LEI manquants, mal formes, a la cle invalide ou absents de GLEIF,
+               les side autres que B/S et les flt/fxd manquants. Aucune ligne n'est supprimee ici: les anomalies
+               sont rangees dans une table de quarantaine
+
+    - Parametres: il faut renseigne le trade repository (dedoublonne) et l'index des LEI de GLEIF
+
+    -Resultat : un tuple avec la table de quarantaine (une ligne par anomalie), le nombre d'anomalies par controle
+                et le masque des transactions concernees
+    """
+    size = len(trade_repository)
+    flags = {}
+    for column in LEI_COLUMNS:
+        # Un meme LEI revient sur des milliers de transactions: on ne controle que les valeurs distinctes
+        codes, leis = pd.factorize(trade_repository[column].to_numpy(dtype=object))
+        missing = codes < 0
+        _, bad_format, bad_checksum = check_lei(leis)
+        unknown = lei_index['lei'].get_indexer(leis) < 0
+        # Un LEI manquant (code -1) lit une derniere case toujours fausse, y compris quand la colonne est vide
+        bad_format, bad_checksum, unknown = (np.append(flag, False) for flag in [bad_format, bad_checksum, unknown])
+        flags[('lei_missing', column)] = missing
+        flags[('lei_format', column)] = ~missing & bad_format[codes]
+        flags[('lei_checksum', column)] = ~missing & bad_checksum[codes]
+        flags[('lei_unknown', column)] = ~missing & unknown[codes]
+    flags[('side_invalid', 'side')] = ~trade_repository['side'].isin(SIDES).to_numpy()
+    flags[('flt_missing', 'flt')] = trade_repository['flt'].isna().to_numpy()
+    flags[('fxd_missing', 'fxd')] = trade_repository['fxd'].isna().to_numpy()
+
+    # Table de quarantaine compacte: l'UTI, le controle et la valeur fautive, seulement pour les anomalies
+    positions = [np.flatnonzero(flag) for flag in flags.values()]
+    position = np.concatenate(positions) if positions else np.array([], dtype=np.intp)
+    checks = np.repeat([check for check, _ in flags], [len(p) for p in positions])
+    columns = np.repeat([column for _, column in flags], [len(p) for p in positions])
+    values = np.empty(len(position), dtype=object)
+    for column in set(columns):
+        mask = columns == column
+        values[mask] = trade_repository[column].to_numpy(dtype=object)[position[mask]]
+    quarantine = pd.DataFrame({
+        'Uti': trade_repository['uti'].to_numpy(dtype=object)[position],
+        'Check': pd.Categorical(checks, categories=CHECKS),
+        'Column': pd.Categorical(columns),
+        'Value': values
+    })
+
+    summary = pd.DataFrame({'Check': [check for check, _ in flags], 'Column': [column for _, column in flags],
+                            'Rows': [len(p) for p in positions]})
+    flagged = np.zeros(size, dtype=bool)
+    flagged[position] = True
+    return quarantine, summary, flagged
+
+
+def print_quality(summary: pd.DataFrame):
+    for row in summary[summary['Rows'] != 0].itertuples():
+        print(f" We have {row.Rows} transactions failing the {row.Check} check on {row.Column}\n\n")
+
+
+if __name__ == '__main__':
+    from repository import (get_config, get_directories, read_source, read_trade_repository, set_lei_index)
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    repository = pd.concat([read_trade_repository(path) for path in directoires['TR']], ignore_index=True)
+    table, counts, _ = validate(repository, set_lei_index(read_source(directoires['GLEIF'][0])))
+
+    print_quality(counts)
+    print(table.head())
+    print('Test succesfully done !!!')
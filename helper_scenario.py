@@ -0,0 +1,178 @@
+import itertools
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from helper_profile import profiled
+
+SCALES = {'Country': ['Country', 'Index'], 'Company': ['Name', 'Country', 'Index']}
+STATISTICS = ['Base', 'Mean', 'Std', 'Min', 'P5', 'P95', 'Max']
+BASE = 'Base'
+
+
+def set_scenarios(settings: dict, indices: list):
+    """
+    Cette fonction construit les scenarios de chocs de taux:
+    - Son but: Decrire chaque scenario par un choc sur le taux fixe et un choc par indice variable, soit en
+               grille (toutes les combinaisons des chocs de la config), soit par tirages gaussiens independants.
+               Le premier scenario est toujours le scenario central, sans choc
+
+    - Parametres: il faut renseigne la section [scenarios] de la config et la liste des indices
+
+    -Resultat : une dataframe avec le nom du scenario puis une colonne de choc pour Fxd et pour chaque indice
+    """
+    factors = ['Fxd'] + list(indices)
+    if settings['mode'] == 'grid':
+        shocks = np.array(list(itertools.product(settings['shocks'], repeat=len(factors))), dtype=float)
+        # Le scenario central figure deja dans la grille si 0 fait partie des chocs: on ne le garde qu'une fois
+        shocks = shocks[np.any(shocks != 0, axis=1)]
+    else:
+        rng = np.random.default_rng(settings['seed'])
+        shocks = rng.normal(0.0, settings['volatility'], size=(settings['count'], len(factors)))
+    shocks = np.vstack([np.zeros((1, len(factors))), shocks])
+    scenarios = pd.DataFrame(shocks, columns=factors)
+    scenarios.insert(0, 'Scenario', [BASE] + [f'S{number}' for number in range(1, len(scenarios))])
+    return scenarios
+
+
+def get_key_codes(buyer: pd.Series, seller: pd.Series):
+    # Codes des deux jambes sur un meme dictionnaire, numerotes dans l'ordre trie des valeurs comme le groupby.
+    # Des jambes categorielles de meme dictionnaire ne sont pas recodees, seul le dictionnaire est trie
+    values = [column.array if isinstance(column.dtype, pd.CategoricalDtype) else pd.Categorical(column)
+              for column in [buyer, seller]]
+    stacked = union_categoricals(values)
+    rank = np.empty(len(stacked.categories), dtype=np.int64)
+    rank[stacked.categories.argsort()] = np.arange(len(rank))
+    codes = np.asarray(stacked.codes, dtype=np.int64)
+    return np.where(codes >= 0, rank[np.maximum(codes, 0)], -1), stacked.categories.sort_values()
+
+
+def set_scenario_legs(data: dict, keys: list):
+    """
+    Cette fonction prepare, une seule fois, ce qui ne depend pas des scenarios:
+    - Son but: Retrouver pour chaque transaction le notionnel signe, le taux fixe (corrige comme dans set_legs)
+               et l'indice, et pour chaque jambe le code de son groupe (les cles d'exposition). Les jambes
+               buyer et seller sont alignees sur les lignes de la Data Frame recapitulative
+
+    - Parametres: il faut renseigne le dictionnaire de set_data et les cles d'agregation
+
+    -Resultat : un dictionnaire avec les tableaux par transaction, les codes de groupe et la table des groupes
+    """
+    buyer, seller, repository = data['Buyer'], data['Seller'], data['Repository']
+    is_buyer = (repository['Side'] == 'B').to_numpy()
+    fxd = repository['Fxd'].to_numpy(dtype=float)
+    fxd = np.where(is_buyer & (fxd < 0), np.abs(fxd), fxd)
+
+    # Les cles des deux jambes sont empilees pour partager la meme numerotation des groupes. Le groupement se fait
+    # sur les codes: chaque combinaison de cles devient un entier, la premiere cle etant la plus significative
+    combined, known, categories = np.zeros(2 * len(buyer), dtype=np.int64), True, []
+    for key in keys:
+        codes, values = get_key_codes(buyer[key], seller[key])
+        combined = combined * len(values) + codes
+        known &= codes >= 0
+        categories.append(values)
+    unique, inverse = np.unique(combined[known], return_inverse=True)
+    codes = np.full(len(combined), -1, dtype=np.int64)
+    codes[known] = inverse
+
+    # Table des groupes: chaque entier est redecoupe en ses codes, de la derniere cle a la premiere
+    groups = {}
+    for key, values in zip(reversed(keys), reversed(categories)):
+        groups[key] = values[unique % len(values)].to_numpy(dtype=object)
+        unique = unique // len(values)
+    index = buyer['Index'].array if isinstance(buyer['Index'].dtype, pd.CategoricalDtype) else \
+        pd.Categorical(buyer['Index'])
+    index = index.remove_unused_categories()
+    return {
+        'notional': buyer['Notional'].to_numpy(dtype=float) * np.where(is_buyer, 1.0, -1.0),
+        'fxd': np.nan_to_num(fxd),
+        'index': np.asarray(index.codes),
+        'indices': list(index.categories),
+        'buyer': codes[:len(buyer)],
+        'seller': codes[len(buyer):],
+        'groups': pd.DataFrame({key: groups[key] for key in keys})
+    }
+
+
+def aggregate(result: np.ndarray, codes: np.ndarray, cash_flow: np.ndarray):
+    # Les jambes du chunk sont deja triees par groupe: une somme par segment contigu, sans boucle par groupe
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+    starts = starts[codes[starts] >= 0]
+    if len(starts):
+        result[:, codes[starts]] += np.add.reduceat(cash_flow, starts, axis=1)
+
+
+@profiled
+def run_scenarios(data: dict, scenarios: pd.DataFrame, scale: str, settings: dict):
+    """
+    Cette fonction evalue tous les scenarios en une passe:
+    - Son but: Calculer le Cash_Flow de chaque jambe sous chaque scenario comme une matrice jambes x scenarios
+               (diffusion NumPy des chocs sur le taux fixe et sur le taux variable de l'indice de la jambe, avec un
+               plancher eventuel sur le taux variable), par chunks de jambes pour borner la memoire, puis l'agreger
+               aux cles d'exposition. Sans choc, le Cash_Flow du scenario central est celui de set_legs
+
+    - Parametres: il faut renseigne le dictionnaire de set_data, les scenarios, l'echelle (Country ou Company)
+                  et la section [scenarios] de la config
+
+    -Resultat : un tuple avec la table des groupes et la matrice groupes x scenarios des Cash_Flow
+    """
+    legs = set_scenario_legs(data, SCALES[scale])
+    size, count = len(legs['notional']), len(scenarios)
+
+    # Taux variable de chaque indice sous chaque scenario: niveau de base plus choc, eventuellement plancher.
+    # Une transaction sans indice connu (code -1) lit la derniere colonne, a taux variable nul
+    base = np.array([settings['base_rates'].get(index, 0.0) for index in legs['indices']], dtype=float)
+    shocks = scenarios[legs['indices']].to_numpy(dtype=float) if legs['indices'] else np.zeros((count, 0))
+    floating = np.hstack([np.maximum(base[None, :] + shocks, settings['floor']), np.zeros((count, 1))])
+    fixed = scenarios['Fxd'].to_numpy(dtype=float)[:, None]
+
+    # La matrice est tenue scenarios x jambes: chaque somme par groupe porte sur des lignes contigues. Un chunk
+    # occupe environ deux matrices (Cash_Flow et ses sommes par groupe)
+    chunk_rows = max(1, int(settings['memory_mb'] * 2 ** 20 / (count * 8 * 2)))
+    result = np.zeros((count, len(legs['groups'])))
+    for side, sign in [('buyer', 1.0), ('seller', -1.0)]:
+        # Les jambes sont triees une fois par groupe: aucun chunk n'est recopie pour l'agregation
+        order = np.argsort(legs[side], kind='stable')
+        codes, index = legs[side][order], legs['index'][order]
+        fxd, notional = legs['fxd'][order], sign * legs['notional'][order]
+        for start in range(0, size, chunk_rows):
+            stop = min(start + chunk_rows, size)
+            # Cash_Flow = Notional * signe * (Fxd + choc - taux variable), calcule en place
+            cash_flow = floating[:, index[start:stop]]
+            np.subtract(fixed, cash_flow, out=cash_flow)
+            cash_flow += fxd[None, start:stop]
+            cash_flow *= notional[None, start:stop]
+            aggregate(result, codes[start:stop], cash_flow)
+    return legs['groups'], np.ascontiguousarray(result.T)
+
+
+def summarize(groups: pd.DataFrame, result: np.ndarray):
+    # Distribution des Cash_Flow de chaque groupe sur l'ensemble des scenarios, le scenario central en premier
+    summary = groups.copy()
+    summary['Base'] = result[:, 0]
+    summary['Mean'] = result.mean(axis=1)
+    summary['Std'] = result.std(axis=1)
+    summary['Min'] = result.min(axis=1)
+    summary['P5'], summary['P95'] = np.percentile(result, [5, 95], axis=1)
+    summary['Max'] = result.max(axis=1)
+    return summary
+
+
+if __name__ == '__main__':
+    import time
+    from repository import (get_config, get_directories, set_data)
+    from helper_exposition import exposition
+
+    config_file = get_config()
+    data = set_data(get_directories(config_file['files']['names'], config_file['discovery']))
+    scenarios = set_scenarios(config_file['scenarios'], config_file['rates']['names'])
+
+    start = time.perf_counter()
+    groups, result = run_scenarios(data, scenarios, 'Country', config_file['scenarios'])
+    print(f'{len(scenarios)} scenarios x {len(groups)} groups in {time.perf_counter() - start:.3f}s')
+
+    # Le scenario central redonne le Cash_Flow de exposition
+    central = exposition(d=data, i=config_file['rates']['names'])
+    print(np.allclose(np.sort(central['Cash_Flow'].to_numpy()), np.sort(result[:, 0])))
+    print(summarize(groups, result).head())
+    print('Test succesfully done !!!')
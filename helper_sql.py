@@ -0,0 +1,223 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+from helper_cache import to_columnar
+from helper_exposition import (KEYS, MEASURES)
+from helper_gleif import (get_lookup, is_golden_copy)
+from helper_profile import profiled
+from helper_uti import print_report
+from repository import read_source
+
+# Cle de tri de chaque ligne: position du fichier dans la concatenation puis numero de ligne dans le fichier
+ROWS_PER_SOURCE = 10 ** 12
+# Version du format des fichiers convertis: la changer ecarte les conversions faites par une version precedente
+STAGE_VERSION = 2
+
+
+def connect(config: dict):
+    """
+    Cette fonction ouvre la base DuckDB du backend SQL:
+    - Son but: Calculer les expositions hors memoire. DuckDB lit les fichiers Parquet en parallele et deborde
+               sur disque (temp_directory) quand les agregations ne tiennent plus dans memory_limit
+
+    - Parametres: il faut renseigne la config (section [sql])
+
+    -Resultat : une connexion DuckDB
+    """
+    import duckdb
+
+    settings = config['sql']
+    os.makedirs(settings['directory'], exist_ok=True)
+    connection = duckdb.connect(os.path.join(settings['directory'], settings['database']))
+    connection.execute(f"SET memory_limit = '{settings['memory_limit']}'")
+    connection.execute(f"SET temp_directory = '{os.path.join(settings['directory'], 'tmp')}'")
+    if settings['threads']:
+        connection.execute(f"SET threads = {int(settings['threads'])}")
+    return connection
+
+
+def quote(path: str):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def to_parquet(connection, path: str, directory: str):
+    # DuckDB lit le Parquet directement. Les CSV sont convertis par DuckDB et les excels par pandas, une seule fois
+    # par version du fichier, pour disposer partout du numero de ligne (file_row_number)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return path
+    name = f'{os.path.abspath(path)}:{STAGE_VERSION}'
+    staged = os.path.join(directory, hashlib.sha256(name.encode()).hexdigest()[:16] + '.parquet')
+    if os.path.exists(staged) and os.path.getmtime(staged) >= os.path.getmtime(path):
+        return staged
+    tmp_path = staged + '.tmp'
+    if extension == '.csv':
+        connection.execute(f"COPY (SELECT * FROM read_csv({quote(path)}, all_varchar = true)) "
+                           f"TO {quote(tmp_path)} (FORMAT parquet)")
+    else:
+        to_columnar(read_source(path)).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, staged)
+    return staged
+
+
+def set_sources(connection, directories: dict, directory: str, lookup: dict = None):
+    # Vue des Trade Repositories dans l'ordre de la concatenation de set_data, et vue GLEIF sans LEI en double
+    selects = []
+    for position, path in enumerate(directories['TR']):
+        staged = quote(to_parquet(connection, path, directory))
+        selects.append(f"""
+            SELECT {position} AS position,
+                   {position}::BIGINT * {ROWS_PER_SOURCE} + file_row_number AS sort_key,
+                   coalesce(CAST(uti AS VARCHAR), 'nan') AS uti_key,
+                   CAST(lei_rptg AS VARCHAR) AS lei_rptg,
+                   CAST(lei_othr AS VARCHAR) AS lei_othr,
+                   CAST(notional AS DOUBLE) AS notional,
+                   CAST(side AS VARCHAR) AS side,
+                   CAST(fxd AS DOUBLE) AS fxd,
+                   CAST(flt AS VARCHAR) AS flt,
+                   CAST(uti AS VARCHAR) AS uti
+            FROM read_parquet({staged}, file_row_number = true)""")
+    connection.execute('CREATE OR REPLACE VIEW trades AS ' + ' UNION ALL '.join(selects))
+
+    # La golden copy n'est pas chargee dans DuckDB: seule sa table de correspondance, limitee a nos LEI, est lue
+    gleif_path = directories['GLEIF'][0]
+    if is_golden_copy(gleif_path):
+        leis = connection.execute('SELECT lei_rptg AS lei FROM trades WHERE lei_rptg IS NOT NULL UNION '
+                                  'SELECT lei_othr FROM trades WHERE lei_othr IS NOT NULL').df()['lei']
+        gleif = quote(get_lookup(gleif_path, pd.Index(leis.astype(object)), lookup))
+    else:
+        gleif = quote(to_parquet(connection, gleif_path, directory))
+    connection.execute(f"""
+        CREATE OR REPLACE VIEW gleif AS
+        SELECT CAST(lei AS VARCHAR) AS lei, CAST(name AS VARCHAR) AS name, CAST(country AS VARCHAR) AS country
+        FROM read_parquet({gleif}, file_row_number = true)
+        QUALIFY row_number() OVER (PARTITION BY CAST(lei AS VARCHAR) ORDER BY file_row_number) = 1""")
+
+
+@profiled
+def set_data_sql(directories: dict, config: dict):
+    """
+    Cette fonction est la version SQL de set_data:
+    - Son but: Derouler le meme pipeline (dedoublonnage des UTI, nomenclature GLEIF, jambes buyer et seller,
+               cube Name/Country/Index) en tables DuckDB sur disque, sans jamais charger les transactions en pandas
+
+    - Parametres: il faut renseigne les chemins d'acces de nos fichiers et la config
+
+    -Resultat : la connexion DuckDB contenant les tables repository, cube, duplicates et unmatched
+    """
+    if len(directories['TR']) == 0:
+        raise ValueError('Aucun Trade Repository a été transmis')
+
+    connection = connect(config)
+    set_sources(connection, directories, config['sql']['directory'], config['gleif'])
+
+    # Premiere occurrence de chaque UTI: la plus petite cle de tri, comme drop_duplicates(keep='first')
+    connection.execute("""
+        CREATE OR REPLACE TABLE uti_first AS
+        SELECT uti_key, min(sort_key) AS sort_key FROM trades GROUP BY uti_key""")
+
+    connection.execute("""
+        CREATE OR REPLACE TABLE repository AS
+        SELECT t.uti AS Uti,
+               t.lei_rptg AS Lei_rptg, r.name AS Name_rptg, r.country AS Country_rptg,
+               t.lei_othr AS Lei_othr, o.name AS Name_othr, o.country AS Country_othr,
+               t.notional AS Notional, t.side AS Side, t.fxd AS Fxd, t.flt AS Flt
+        FROM trades t
+        SEMI JOIN uti_first f ON t.uti_key = f.uti_key AND t.sort_key = f.sort_key
+        LEFT JOIN gleif r ON t.lei_rptg = r.lei
+        LEFT JOIN gleif o ON t.lei_othr = o.lei""")
+
+    # Si le declarant achete, il est le buyer et son taux fixe est pris en valeur absolue. La jambe seller
+    # compte positivement dans l'exposition nette, la jambe buyer negativement
+    connection.execute("""
+        CREATE OR REPLACE TABLE cube AS
+        WITH trades AS (
+            SELECT *, coalesce(Side = 'B', false) AS is_buyer,
+                   CASE WHEN Side = 'B' AND Fxd < 0 THEN abs(Fxd) ELSE Fxd END AS fixed_rate,
+                   CASE WHEN Side = 'B' THEN 1 ELSE -1 END AS sign
+            FROM repository
+        ), legs AS (
+            SELECT CASE WHEN is_buyer THEN Name_rptg ELSE Name_othr END AS Name,
+                   CASE WHEN is_buyer THEN Country_rptg ELSE Country_othr END AS Country,
+                   Flt AS "Index", Notional AS gross, -Notional AS net, Notional * (sign * fixed_rate) AS cash_flow
+            FROM trades
+            UNION ALL
+            SELECT CASE WHEN is_buyer THEN Name_othr ELSE Name_rptg END,
+                   CASE WHEN is_buyer THEN Country_othr ELSE Country_rptg END,
+                   Flt, Notional, Notional, Notional * (-sign * fixed_rate)
+            FROM trades
+        )
+        SELECT Name, Country, "Index",
+               coalesce(sum(gross), 0) AS Gross_Exposure,
+               coalesce(sum(net), 0) AS Net_Exposure,
+               coalesce(sum(cash_flow), 0) AS Cash_Flow
+        FROM legs GROUP BY ALL""")
+
+    connection.execute(f"""
+        CREATE OR REPLACE TABLE duplicates AS
+        SELECT position, count(*) - (SELECT count(*) FROM uti_first
+                                     WHERE sort_key // {ROWS_PER_SOURCE} = t.position) AS duplicates,
+               count(*) AS rows
+        FROM trades t GROUP BY position ORDER BY position""")
+    counts = connection.execute('SELECT rows, duplicates FROM duplicates').fetchall()
+    print_report(pd.DataFrame({'Source': directories['TR'], 'Rows': [row for row, _ in counts],
+                               'Duplicates': [duplicates for _, duplicates in counts]}))
+
+    connection.execute("""
+        CREATE OR REPLACE TABLE unmatched AS
+        SELECT Lei, Role, count(*) AS Trades FROM (
+            SELECT Lei_rptg AS Lei, 'rptg' AS Role FROM repository
+            UNION ALL
+            SELECT Lei_othr, 'othr' FROM repository
+        ) legs
+        ANTI JOIN gleif ON legs.Lei = gleif.lei
+        WHERE Lei IS NOT NULL GROUP BY Lei, Role""")
+    missing = connection.execute('SELECT count(*) FROM unmatched').fetchone()[0]
+    if missing != 0:
+        print(f" We have {missing} LEIs that are missing from the GLEIF nomenclature\n\n")
+    return connection
+
+
+@profiled
+def exposition_sql(connection, index: list, scale: bool = False):
+    """
+    Cette fonction est la version SQL de exposition:
+    - Son but: Sommer le cube DuckDB pour l'indice ou les indices demandes, a l'echelle nationale ou des entreprises
+
+    - Parametres: il faut renseigne la connexion de set_data_sql, la liste des indices et un booleen pour
+                  l'echelle individuelle
+
+    -Resultat : la meme dataframe que exposition (cles categorielles, expositions brute, net, cash flow et ratio)
+    """
+    keys = KEYS if scale else KEYS[1:]
+    columns = ', '.join(f'"{key}"' for key in keys)
+    measures = ', '.join(f'{measure}' if scale else f'sum({measure}) AS {measure}' for measure in MEASURES)
+    not_null = ' AND '.join(f'"{key}" IS NOT NULL' for key in keys)
+    group_by = '' if scale else f'GROUP BY {columns}'
+    result = connection.execute(f"""
+        SELECT {columns}, {measures} FROM cube
+        WHERE list_contains(?, "Index") AND {not_null}
+        {group_by} ORDER BY {columns}""", [list(index)]).df()
+
+    for key in keys:
+        result[key] = pd.Categorical(result[key].astype(object))
+    gross = result['Gross_Exposure'].to_numpy(dtype=float)
+    net = result['Net_Exposure'].to_numpy(dtype=float)
+    result['Ratio'] = np.divide(net, gross, out=np.zeros_like(net), where=gross != 0)
+    return result
+
+
+if __name__ == '__main__':
+    from repository import (get_config, get_directories)
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    base = set_data_sql(directoires, config_file)
+
+    country_expo = exposition_sql(base, config_file['rates']['names'])
+    firm_expo = exposition_sql(base, config_file['rates']['names'], scale=True)
+    print(f'{country_expo.head()}\n')
+    print(f'{firm_expo.head()}\n')
+    print('Test succesfully done !!!')
@@ -0,0 +1,125 @@
+import os
+import shutil
+import threading
+
+from helper_cache import (get_cache_key, load_data, to_columnar)
+from helper_consolidation import (get_relationships_path, load_parent_cube)
+from helper_exposition import (exposition, set_cube)
+from repository import get_directories
+
+FRAMES = ['Country', 'Company', 'Parent']
+# Jambes et entites gardees avec les expositions: les vues bilaterales et les scenarios en repartent
+LEGS = ['Buyer', 'Seller', 'Repository', 'Entities']
+# Un seul jeu d'expositions par processus serveur, partage par toutes les sessions Streamlit
+STORE = {'key': None, 'version': 0, 'frames': None, 'files': None}
+LOCK = threading.Lock()
+
+
+def set_frames(directories: dict, config: dict):
+    # Calcule les expositions par pays, par entreprise et par groupe pour tous les indices, avec le backend choisi.
+    # Le backend SQL ne garde pas les LEI dans son cube: pas d'expositions par groupe, ni de jambes
+    if config['sql']['enabled']:
+        from helper_sql import (exposition_sql, set_data_sql)
+
+        connection = set_data_sql(directories, config)
+        return {'Country': exposition_sql(connection, config['rates']['names']),
+                'Company': exposition_sql(connection, config['rates']['names'], scale=True)}
+    # Le cache disque de set_data ne depend pas des relations (RR): sa cle reste celle du mode batch, seule la cle
+    # du store les prend en compte
+    resultat = load_data({key: paths for key, paths in directories.items() if key != 'RR'}, config)
+    resultat['Cube'] = set_cube(resultat, config['aggregation']['workers'], config['aggregation']['partition'])
+    resultat['Parent_Cube'] = load_parent_cube(resultat, directories, config)
+    return {'Country': exposition(data=resultat, indice=config['rates']['names']),
+            'Company': exposition(data=resultat, indice=config['rates']['names'], scale=[True]),
+            'Parent': exposition(data=resultat, indice=config['rates']['names'], scale=['Parent']),
+            **{name: resultat[name] for name in LEGS}}
+
+
+def write_arrow(frames: dict, directory: str):
+    # Ecrit les expositions en Arrow IPC non compresse, lisible en memory-map par les autres processus
+    import pyarrow.feather as feather
+
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, df in frames.items():
+        feather.write_feather(to_columnar(df), os.path.join(tmp_dir, f'{name}.arrow'), compression='uncompressed')
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def read_arrow(directory: str):
+    # Les colonnes numeriques sans valeur manquante restent des vues sur le fichier memory-mappe
+    import pyarrow.feather as feather
+
+    # Le backend SQL n'ecrit pas les expositions par groupe ni les jambes
+    paths = {name: os.path.join(directory, f'{name}.arrow') for name in FRAMES + LEGS}
+    return {name: feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+            for name, path in paths.items() if os.path.exists(path)}
+
+
+def get_frames(config: dict):
+    """
+    Cette fonction rend les expositions partagees par toutes les sessions:
+    - Son but: Calculer les expositions une seule fois par processus (ou une seule fois par serveur en mode
+               mmap, via un fichier Arrow memory-mappe) au lieu d'une copie picklee par session et par acces.
+               La cle est celle du cache disque: un fichier source ou une config modifie declenche le recalcul
+
+    - Parametres: il faut renseigne la config (section [store])
+
+    -Resultat : un tuple avec la version du store et un dictionnaire de vues (Country, Company, Parent et les
+                jambes Buyer, Seller, Repository, Entities avec le backend pandas). Les vues partagent les donnees
+                du store: avec le copy-on-write de pandas, les modifications d'une session restent locales
+    """
+    directories = get_directories(config['files']['names'], config['discovery'])
+    relationships = get_relationships_path(directories, config['consolidation'])
+    if relationships:
+        directories = dict(directories, RR=[relationships])
+    # Les expositions dependent aussi des indices, du backend choisi et de la consolidation par groupe
+    sections = config['cache']['sections'] + ['rates', 'sql', 'aggregation', 'consolidation']
+    with LOCK:
+        key, files = get_cache_key(directories, dict(config, cache=dict(config['cache'], sections=sections)),
+                                   STORE['files'])
+        if STORE['key'] != key:
+            settings = config['store']
+            directory = os.path.join(settings['directory'], key)
+            if settings['mode'] == 'mmap' and os.path.exists(directory):
+                frames = read_arrow(directory)
+            else:
+                frames = set_frames(directories, config)
+                if settings['mode'] == 'mmap':
+                    write_arrow(frames, directory)
+                    frames = read_arrow(directory)
+            STORE.update({'key': key, 'version': STORE['version'] + 1, 'frames': frames, 'files': files})
+        return STORE['version'], {name: df.copy(deep=False) for name, df in STORE['frames'].items()}
+
+
+def invalidate(config: dict = None):
+    """
+    Cette fonction vide le store, par exemple apres un rechargement des donnees:
+    - Son but: Forcer le recalcul des expositions au prochain acces. Les caches construits a partir du store
+               (index des rangs...) sont indexes sur sa version et sont donc invalides avec lui
+
+    - Parametres: eventuellement la config, pour supprimer aussi les fichiers Arrow du mode mmap
+
+    -Resultat : la nouvelle version du store
+    """
+    with LOCK:
+        STORE.update({'key': None, 'version': STORE['version'] + 1, 'frames': None})
+        if config is not None:
+            shutil.rmtree(config['store']['directory'], ignore_errors=True)
+        return STORE['version']
+
+
+if __name__ == '__main__':
+    import time
+    from repository import get_config
+
+    config_file = get_config()
+    for attempt in ['cold', 'warm']:
+        start = time.perf_counter()
+        store_version, store_frames = get_frames(config_file)
+        print(f'{attempt}: version {store_version}, {time.perf_counter() - start:.3f}s')
+
+    print(store_frames['Country'].head())
+    print('Test succesfully done !!!')
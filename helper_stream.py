@@ -0,0 +1,167 @@
+import os
+import shutil
+import pandas as pd
+
+from helper_quality import (print_quality, validate)
+from helper_gleif import (collect_leis, is_golden_copy)
+from repository import (FRAMES, TR_COLUMNS, read_gleif, set_gleif, set_legs, set_lei_index)
+from helper_cache import to_columnar
+from helper_uti import (drop_duplicates, print_report, set_uti_index)
+
+# Une ligne brute occupe en memoire: le chunk, sa version enrichie par GLEIF et ses deux jambes
+EXPANSION = 4
+
+
+def iter_excel(path: str, next_size):
+    # openpyxl en mode read_only lit les lignes une a une sans charger le classeur entier
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = list(next(rows))
+        chunk = []
+        for row in rows:
+            # Comme pd.read_excel, les nombres entiers stockés en flottant (LEI numériques) redeviennent des int
+            chunk.append([int(value) if isinstance(value, float) and value.is_integer() else value for value in row])
+            if len(chunk) >= next_size():
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def iter_csv(path: str, next_size):
+    with pd.read_csv(path, iterator=True) as reader:
+        while True:
+            try:
+                yield reader.get_chunk(next_size())
+            except StopIteration:
+                return
+
+
+def iter_parquet(path: str, next_size):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    batches = []
+    rows = 0
+    for batch in parquet_file.iter_batches(batch_size=min(next_size(), 65536)):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= next_size():
+            yield pd.concat([b.to_pandas() for b in batches], ignore_index=True)
+            batches, rows = [], 0
+    if batches:
+        yield pd.concat([b.to_pandas() for b in batches], ignore_index=True)
+
+
+def iter_chunks(path: str, next_size):
+    """
+    Cette fonction lit un Trade Repository morceau par morceau:
+    - Son but: Ne jamais charger un fichier entier en memoire, quel que soit son format (xlsx, csv ou parquet)
+
+    - Parametres: il faut renseigne le chemin d'acces du fichier et une fonction donnant la taille du prochain chunk
+
+    -Resultat : un generateur de dataframes d'au plus next_size() lignes
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return iter_csv(path, next_size)
+    elif extension == '.parquet':
+        return iter_parquet(path, next_size)
+    return iter_excel(path, next_size)
+
+
+def stream_data(directories: dict, config: dict):
+    """
+    Cette fonction est la version en streaming de set_data:
+    - Son but: Dedoublonner, enrichir avec GLEIF et separer en jambes chaque chunk avant de lire le suivant,
+               avec une taille de chunk bornee par le plafond memoire de la config
+
+    - Parametres: il faut renseigne les chemins d'acces de nos fichiers et la config
+
+    -Resultat : un generateur de dictionnaires au meme format que set_data, un par chunk
+    """
+    if len(directories['TR']) == 0:
+        raise ValueError('Aucun Trade Repository a été transmis')
+
+    settings = config['ingestion']
+    memory_limit = settings['memory_limit_mb'] * 2 ** 20
+    chunk_rows = [settings['chunk_rows']]
+
+    # La golden copy est filtree sur les LEI des Trade Repositories: une premiere passe, chunk par chunk, ne garde
+    # que les LEI distincts
+    gleif_path = directories['GLEIF'][0]
+    leis = collect_leis(chunk for path in directories['TR'] for chunk in iter_chunks(path, lambda: chunk_rows[0])) \
+        if is_golden_copy(gleif_path) else None
+    lei_index = set_lei_index(read_gleif(gleif_path, [], config['gleif'], leis))
+    uti_index = set_uti_index()
+    reports, qualities = [], []
+
+    for path in directories['TR']:
+        for chunk in iter_chunks(path, lambda: chunk_rows[0]):
+            # On ajuste la taille des prochains chunks a partir du poids reel d'une ligne
+            row_bytes = chunk.memory_usage(deep=True).sum() / max(len(chunk), 1)
+            chunk_rows[0] = max(1, min(settings['chunk_rows'], int(memory_limit / (row_bytes * EXPANSION))))
+
+            # Garde la premiere occurrence de chaque UTI, y compris par rapport aux chunks deja traites
+            chunk, duplicates = drop_duplicates(chunk[TR_COLUMNS], uti_index, [path], [len(chunk)])
+            reports.append(duplicates)
+
+            quarantine, quality, flagged = validate(chunk, lei_index)
+            qualities.append(quality)
+            if config['quality']['quarantine']:
+                chunk = chunk[~flagged].reset_index(drop=True)
+
+            gleif_trade, unmatched, entities = set_gleif(chunk, lei_index)
+            buyer, seller = set_legs(gleif_trade)
+            yield {"Buyer": buyer, "Seller": seller, "Repository": gleif_trade, "Entities": entities,
+                   "Unmatched": unmatched, "Duplicates": duplicates, "Quarantine": quarantine, "Quality": quality}
+
+    print_report(pd.concat(reports).groupby('Source', sort=False, as_index=False).sum())
+    print_quality(pd.concat(qualities).groupby(['Check', 'Column'], sort=False, as_index=False).sum())
+
+
+def write_stream(directories: dict, config: dict):
+    """
+    Cette fonction persiste le resultat de stream_data sur disque:
+    - Son but: Traiter des repositories plus gros que la RAM en ecrivant chaque chunk en Parquet
+
+    - Parametres: il faut renseigne les chemins d'acces de nos fichiers et la config
+
+    -Resultat : le dossier contenant un sous-dossier Parquet par dataframe (Buyer, Seller, Repository, Entities,
+                Unmatched, Duplicates, Quarantine, Quality)
+    """
+    output = config['ingestion']['output']
+    shutil.rmtree(output, ignore_errors=True)
+    for frame in FRAMES:
+        os.makedirs(os.path.join(output, frame))
+
+    for part, result in enumerate(stream_data(directories, config)):
+        for frame, df in result.items():
+            to_columnar(df).to_parquet(os.path.join(output, frame, f'part-{part:05d}.parquet'))
+    return output
+
+
+def read_stream(output: str):
+    # Relit l'ensemble des chunks ecrits par write_stream, un meme LEI inconnu pouvant apparaitre dans plusieurs chunks
+    result = {frame: pd.read_parquet(os.path.join(output, frame)) for frame in FRAMES}
+    result['Entities'] = result['Entities'].drop_duplicates(subset='Lei', ignore_index=True)
+    result['Unmatched'] = result['Unmatched'].groupby(['Lei', 'Role'], as_index=False)['Trades'].sum()
+    result['Duplicates'] = result['Duplicates'].groupby('Source', sort=False, as_index=False).sum()
+    result['Quality'] = result['Quality'].groupby(['Check', 'Column'], sort=False, as_index=False).sum()
+    return result
+
+
+if __name__ == '__main__':
+    from repository import (get_config, get_directories)
+
+    config_file = get_config()
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
+    data = read_stream(write_stream(directoires, config_file))
+
+    print(data['Buyer'])
+    print('Test succesfully done !!!')
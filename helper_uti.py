@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pandas as pd
+
+from helper_profile import profiled
+
+
+def hash_uti(uti):
+    # Chaque UTI est remplace par un hash de 64 bits: un tableau d'entiers au lieu d'une colonne de chaines
+    uti = pd.Series(np.asarray(uti, dtype=object)).astype(str).to_numpy(dtype=object)
+    return pd.util.hash_array(uti, categorize=False)
+
+
+def set_uti_index(path: str = None):
+    """
+    Cette fonction initialise l'index des UTI deja integres:
+    - Son but: Garder les UTI des livraisons precedentes sous forme de tableaux tries de hash 64 bits.
+               Un index persiste est relu en memory-map, sans le charger en memoire
+
+    - Parametres: eventuellement le chemin du fichier .npy de l'index persiste
+
+    -Resultat : un dictionnaire avec la liste des tableaux tries (runs) de l'index
+    """
+    runs = []
+    if path is not None and os.path.exists(path):
+        runs.append(np.load(path, mmap_mode='r'))
+    return {'runs': runs}
+
+
+def contains(uti_index: dict, keys: np.ndarray):
+    # Recherche dichotomique vectorisee dans chaque tableau trie
+    found = np.zeros(len(keys), dtype=bool)
+    for run in uti_index['runs']:
+        if len(run) == 0:
+            continue
+        position = np.searchsorted(run, keys).clip(max=len(run) - 1)
+        found |= run[position] == keys
+    return found
+
+
+def add(uti_index: dict, keys: np.ndarray):
+    # Ajout facon LSM: un nouveau tableau trie, fusionne avec les precedents tant qu'ils sont plus petits
+    run = np.sort(keys)
+    runs = uti_index['runs']
+    while runs and len(runs[-1]) <= len(run):
+        run = np.sort(np.concatenate([runs.pop(), run]))
+    runs.append(run)
+
+
+def save(uti_index: dict, path: str):
+    # Persiste l'index en un seul tableau trie
+    runs = [np.asarray(run) for run in uti_index['runs']]
+    keys = np.sort(np.concatenate(runs)) if runs else np.array([], dtype=np.uint64)
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, keys)
+    os.replace(tmp_path, path)
+    uti_index['runs'] = [np.load(path, mmap_mode='r')]
+
+
+@profiled
+def drop_duplicates(trade_repository: pd.DataFrame, uti_index: dict, sources: list = None, lengths: list = None):
+    """
+    Cette fonction dedoublonne les transactions sur l'UTI:
+    - Son but: En une seule passe sur les hash, garder la premiere occurrence de chaque UTI et ecarter a la fois
+               les doublons du chargement et les UTI deja vus dans les livraisons precedentes
+
+    - Parametres: il faut renseigne le trade repository, l'index des UTI, et eventuellement le nom des fichiers
+                  sources avec leur nombre de lignes (dans l'ordre de la concatenation)
+
+    -Resultat : un tuple avec le trade repository dedoublonne et le nombre de doublons par fichier source
+    """
+    keys = hash_uti(trade_repository['uti'])
+    first = ~pd.Index(keys).duplicated(keep='first') & ~contains(uti_index, keys)
+    add(uti_index, keys[first])
+
+    sources = sources or ['']
+    lengths = lengths or [len(trade_repository)]
+    source = np.repeat(np.arange(len(sources)), lengths)
+    report = pd.DataFrame({
+        'Source': sources,
+        'Rows': lengths,
+        'Duplicates': np.bincount(source, weights=~first, minlength=len(sources)).astype(int)
+    })
+    return trade_repository[first], report
+
+
+def print_report(report: pd.DataFrame):
+    for row in report[report['Duplicates'] != 0].itertuples():
+        print(f" We have {row.Duplicates} transactions from {row.Source} that have been registered twice on our data base\n\n")
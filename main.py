@@ -1,10 +1,30 @@
+import argparse
+import os
+
 import repository
 import view
 
 
+def get_arguments():
+    # Streamlit transmet a main.py les arguments places apres "--"
+    parser = argparse.ArgumentParser(description='GLEIF Trade Data Analysis')
+    parser.add_argument('--config', help='chemin du fichier config.toml')
+    parser.add_argument('--data-dir', help='dossier contenant les Trade Repositories et la nomenclature GLEIF')
+    parser.add_argument('--profile', action='store_true', help='afficher le panneau de diagnostic des performances')
+    parser.add_argument('--profile-memory', action='store_true', help='mesurer aussi le pic memoire de chaque etape')
+    arguments, _ = parser.parse_known_args()
+    return arguments
+
 
 def main():
-    config = repository.get_config()
+    arguments = get_arguments()
+    if arguments.data_dir:
+        # L'argument de ligne de commande passe avant la variable d'environnement et la config
+        os.environ[repository.DATA_DIR_ENV] = arguments.data_dir
+    config = repository.get_config(arguments.config)
+    if arguments.profile or arguments.profile_memory:
+        config['profile']['enabled'] = True
+        config['profile']['memory'] = config['profile']['memory'] or arguments.profile_memory
     view.to_streamlit(config)
 
 if __name__ == '__main__':
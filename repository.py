@@ -1,34 +1,160 @@
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import toml
 
+from helper_gleif import (is_golden_copy, read_lookup)
+from helper_profile import (profiled, stage)
+from helper_quality import (print_quality, validate)
+from helper_uti import (drop_duplicates, print_report, set_uti_index)
 
-def get_config():
-    toml_file = None
-    for root, dirs, files in os.walk('.'):
-        for file in files:
-            if file == 'config.toml':
-                toml_file = toml.load(os.path.join(root, file))
-    return toml_file
+TR_COLUMNS = ['lei_rptg', 'lei_othr', 'notional', 'side', 'fxd', 'flt', 'uti']
+FRAMES = ['Buyer', 'Seller', 'Repository', 'Entities', 'Unmatched', 'Duplicates', 'Quarantine', 'Quality']
+POSITIONS = ['Buyer', 'Seller']
 
 
-def get_directories(file_names: list):
+CONFIG_ENV = 'GLEIF_CONFIG'
+DATA_DIR_ENV = 'GLEIF_DATA_DIR'
+# Les dossiers generes par le projet (caches, benchmark, batch) ne sont jamais parcourus
+DISCOVERY = {'max_depth': 4, 'ignore': ['.git', '.venv', 'venv', 'node_modules', '__pycache__', '.gleif_cache',
+                                       '.gleif_stream', '.gleif_lookup', '.gleif_bench', '.gleif_sql', '.gleif_state',
+                                       '.gleif_store', 'output'],
+             'manifest': '.gleif_discovery.json'}
+
+
+def get_depth(start: str, root: str):
+    return 0 if root == start else os.path.relpath(root, start).count(os.sep) + 1
+
+
+def walk(start: str, max_depth: int, ignore: list):
+    # os.walk borne en profondeur et qui saute les dossiers ignores
+    start = os.path.normpath(start)
+    for root, dirs, files in os.walk(start):
+        dirs[:] = [] if get_depth(start, root) >= max_depth else [d for d in dirs if d not in ignore]
+        yield root, dirs, files
+
+
+def get_config(path: str = None):
+    """
+    Cette fonction charge le fichier config:
+    - Son but: Trouver config.toml sans parcourir tout le disque. On regarde dans l'ordre le chemin transmis
+               (argument de ligne de commande), la variable d'environnement GLEIF_CONFIG, le dossier courant et
+               le dossier du projet, puis en dernier recours un os.walk borne qui s'arrete au premier fichier trouve
+
+    - Parametres: eventuellement le chemin du fichier config
+
+    -Resultat : le dictionnaire de la config
+    """
+    candidates = [path, os.environ.get(CONFIG_ENV), 'config.toml',
+                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.toml')]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return toml.load(candidate)
+
+    for root, dirs, files in walk('.', DISCOVERY['max_depth'], DISCOVERY['ignore']):
+        if 'config.toml' in files:
+            return toml.load(os.path.join(root, 'config.toml'))
+    return None
+
+
+def add_directory(directories: dict, path: str):
+    # La nomenclature GLEIF (ou la golden copy officielle) est rangee a part, les autres sont des Trade Repositories
+    if os.path.basename(path) != 'GLEIF.xlsx' and not is_golden_copy(path):
+        directories['TR'].append(path)
+    else:
+        directories["GLEIF"].append(path)
+
+
+def list_entries(path: str, file_names: list, ignore: list, subdirs: bool):
+    # Ce qui compte pour la recherche dans un dossier: les fichiers recherches et les sous-dossiers parcourus
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries
+                      if (entry.name in file_names and not entry.is_dir())
+                      or (subdirs and entry.is_dir() and entry.name not in ignore))
+
+
+def read_manifest(manifest_path: str, root: str, file_names: list, discovery: dict):
+    # Le manifest n'est reutilise que s'il correspond a la meme recherche et que les fichiers existent encore. Un
+    # fichier ajoute, supprime ou renomme change la date de son dossier: seul un dossier dont la date a change est
+    # relu, et le manifest est ecarte si les fichiers recherches ou les sous-dossiers y ont change
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        paths = manifest['directories']['TR'] + manifest['directories']['GLEIF']
+        if manifest['root'] != root or manifest['names'] != list(file_names) or not all(map(os.path.isfile, paths)):
+            return None
+        for path, (mtime, subdirs, entries) in manifest['folders'].items():
+            if os.stat(path).st_mtime_ns != mtime and \
+                    list_entries(path, file_names, discovery['ignore'], subdirs) != entries:
+                return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return manifest['directories']
+
+
+def discover_directories(file_names: list, discovery: dict):
+    """
+    Cette fonction retrouve nos fichiers quand aucun dossier n'a ete renseigne:
+    - Son but: Parcourir l'arborescence avec une profondeur maximale et des dossiers ignores, puis garder le
+               resultat dans un manifest pour que les lancements suivants ne reparcourent pas le disque. Le
+               manifest garde la date de chaque dossier parcouru: un nouveau fichier relance la recherche. Son
+               ecriture est facultative (dossier en lecture seule par exemple)
+
+    - Parametres: il faut renseigne le nom de nos fichiers et la section discovery de la config
+
+    -Resultat : un dictionnaire contenant les clé d'acces de nos fichiers
+    """
+    root = os.path.abspath('.')
+    manifest_path = discovery['manifest']
+    directories = read_manifest(manifest_path, root, file_names, discovery)
+    if directories is not None:
+        return directories
+
+    directories, folders = {key: [] for key in ['TR', 'GLEIF']}, {}
+    for root_dir, dirs, files in walk('.', discovery['max_depth'], discovery['ignore']):
+        found = [file_name for file_name in file_names if file_name in files]
+        subdirs = get_depth('.', root_dir) < discovery['max_depth']
+        folders[root_dir] = [os.stat(root_dir).st_mtime_ns, subdirs, sorted(found + dirs)]
+        for file_name in found:
+            add_directory(directories, os.path.join(root_dir, file_name))
+
+    # Le manifest n'est qu'un raccourci: s'il ne peut pas etre ecrit, la recherche sera refaite au prochain lancement
+    try:
+        with open(manifest_path, 'w') as file:
+            json.dump({'root': root, 'names': list(file_names), 'directories': directories, 'folders': folders},
+                      file, indent=2)
+    except OSError:
+        pass
+    return directories
+
+
+@profiled
+def get_directories(file_names: list, discovery: dict = None, data_dir: str = None):
     """
     Cette fonction permet d'avoir les chemins d'acces de nos fichiers:
-        - Son but: Grâce au fichier toml, on a le nom des nos excels servent à initialiser notre data
+        - Son but: Grâce au fichier toml, on a le nom des nos excels servent à initialiser notre data.
+                   Le dossier des fichiers est pris dans l'ordre dans l'argument data_dir, la variable
+                   d'environnement GLEIF_DATA_DIR puis la clé data_dir de la config. Sans dossier renseigné,
+                   on retombe sur une recherche bornée dans l'arborescence
 
-        - Parametres: il faut renseigne le dictionnaire file avec la clé de names
+        - Parametres: il faut renseigne le dictionnaire file avec la clé de names, eventuellement la section
+                      discovery de la config et le dossier des fichiers
 
         - Resultat : un dictionnaire contenant les clé d'acces de nos fichiers
     """
-    directories = {key: [] for key in ['TR', 'GLEIF']}
-    for root, dirs, files in os.walk('.'):
+    discovery = {**DISCOVERY, **(discovery or {})}
+    data_dir = data_dir or os.environ.get(DATA_DIR_ENV) or discovery.get('data_dir')
+
+    if data_dir:
+        directories = {key: [] for key in ['TR', 'GLEIF']}
         for file_name in file_names:
-            if file_name in files:
-                if file_name != 'GLEIF.xlsx':
-                    directories['TR'].append(os.path.join(root, file_name))
-                else:
-                    directories["GLEIF"].append(os.path.join(root, file_name))
+            path = os.path.join(data_dir, file_name)
+            if os.path.isfile(path):
+                add_directory(directories, path)
+    else:
+        directories = discover_directories(file_names, discovery)
 
     if len(directories["GLEIF"]) == 0:
         raise ValueError('Aucune nomenclature GLEIF a été retrouvée')
@@ -38,134 +164,289 @@ def get_directories(file_names: list):
         return directories
 
 
-def set_data(directories: dict):
+def read_source(path: str):
     """
-    Cette fonction est celle qui initialise notre data:
-    - Son but: Nettoyage nos differents Trade repositories en fonction de leur nombre et rajoute
-               des informations de la nomenclature GLEIF
+    Cette fonction lit un Trade Repository ou une nomenclature selon son extension:
+    - Son but: Accepter en plus des excels des fichiers CSV et Parquet
 
-    - Parametres: il faut renseigne un dictionnaire contenant les chemins d'acces de nos fichiers
+    - Parametres: il faut renseigne le chemin d'acces du fichier
 
-    -Resultat : un dictionnaire contenant des dataframes pour le buyer et seller side et une df recapitulative
+    -Resultat : une dataframe avec le contenu du fichier
     """
-    trade_repositories = []
-    gleif = None
-    # On verifie avoir biend des directories
-    if len(directories['TR']) == 0:
-        raise ValueError('Aucun Trade Repository a été transmis')
-    # Settings nos DataFrames"
-    for key, directory in directories.items():
-        if key != "GLEIF":
-            trade_repositories = [pd.read_excel(file) for file in directory]
-        else:
-            gleif = pd.read_excel(directory[0])
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return pd.read_csv(path)
+    elif extension == '.parquet':
+        return pd.read_parquet(path)
+    return pd.read_excel(path)
 
-    # Voici nos différents Trade repositories et la nomenclature GLEIF convertit en Data Frames
 
-    # Nettoyage des doublons nettoyage des doublons
-    trade_repository = pd.concat(trade_repositories, ignore_index=True)
+def read_gleif(path: str, trade_repositories: list, settings: dict = None, leis: pd.Index = None):
+    """
+    Cette fonction lit la nomenclature GLEIF:
+    - Son but: Lire en entier la nomenclature reduite (GLEIF.xlsx), et passer par la table de correspondance
+               compacte pour la golden copy officielle, trop grosse pour etre chargee
+
+    - Parametres: il faut renseigne le chemin de la nomenclature, les Trade Repositories charges (pour ne garder
+                  que leurs LEI), la section [gleif] de la config et eventuellement les LEI deja collectes
 
-    duplicates = trade_repository[trade_repository.duplicated(subset="uti", keep=False)]
-    duplicates = duplicates['uti'].value_counts()
+    -Resultat : une dataframe lei, name, country
+    """
+    if is_golden_copy(path):
+        return read_lookup(path, trade_repositories, settings, leis)
+    return read_source(path)
 
-    # On regarde si on a des doublons
-    if duplicates.shape[0] != 0:
-        trade_repository = trade_repository.drop_duplicates(subset=['uti'], keep='first')
-        print(f" We have {duplicates.shape[0]} transactions that have been registered twice on our data base\n\n")
 
-    # Rajout de la nomeclature GLEIF sur le trade repository
+def read_trade_repository(path: str):
+    # Lecture et normalisation d'un Trade Repository: on ne garde que les colonnes attendues, dans l'ordre
+    return read_source(path)[TR_COLUMNS]
+
+
+@profiled
+def read_trade_repositories(paths: list, workers: int = 1):
+    """
+    Cette fonction lit plusieurs Trade Repositories en parallele:
+    - Son but: Repartir la lecture des fichiers sur plusieurs processus pour que le temps de chargement
+               depende du nombre de coeurs et non du nombre de fichiers
+
+    - Parametres: il faut renseigne la liste des chemins d'acces et le nombre de processus (0 pour tous les coeurs)
+
+    -Resultat : la liste des dataframes, dans le meme ordre que les chemins
+    """
+    if workers == 0:
+        workers = os.cpu_count()
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        return [read_trade_repository(path) for path in paths]
+
+    # L'ordre des fichiers est conserve pour que le dedoublonnage garde toujours la meme premiere occurrence
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_trade_repository, paths))
+
+
+@profiled
+def set_lei_index(gleif: pd.DataFrame):
+    """
+    Cette fonction construit l'index des LEI de la nomenclature GLEIF, une seule fois:
+    - Son but: Encoder chaque LEI par sa position (un code entier) pour que les deux contreparties
+               retrouvent leur nom et leur pays par une simple lecture de tableau au lieu de deux merges
+
+    - Parametres: il faut renseigne la nomenclature GLEIF
+
+    -Resultat : un dictionnaire avec l'index des LEI et les colonnes name et country (categorielles) alignees
+                sur les codes
+    """
+    # Un LEI present plusieurs fois dans la nomenclature dupliquerait les transactions: on garde le premier
+    gleif = gleif.drop_duplicates(subset='lei', keep='first')
+    return {'lei': pd.Index(gleif['lei']), 'name': pd.Categorical(gleif['name']),
+            'country': pd.Categorical(gleif['country'])}
 
-    # On isole les LEI respectif pour chaque déclarant"
-    lei_rptg = trade_repository.drop('lei_othr', axis=1)
-    lei_othr = trade_repository.drop('lei_rptg', axis=1)
 
-    # On merge chaque LEI avec la Nomeclature GLEIF
-    df_rptg = pd.merge(lei_rptg, gleif, left_on="lei_rptg", right_on="lei")
-    df_othr = pd.merge(lei_othr, gleif, left_on="lei_othr", right_on="lei")
+def categorical(codes: np.ndarray, values: pd.Categorical):
+    # Colonne categorielle qui partage les categories (et donc les chaines) de values
+    return pd.Categorical.from_codes(codes, dtype=values.dtype)
 
-    # On drop les colonnes poour chaque doublon de lei et on rename certaines colonnes pour plus de clarté
-    df_rptg = df_rptg.drop(["lei"], axis=1)
-    df_othr = df_othr.drop(["lei"], axis=1)
 
-    df_rptg = df_rptg[["lei_rptg", "name", "country", "notional", "side", "fxd", "flt", "uti"]]
-    df_othr = df_othr[["lei_othr", "name", "country", "notional", "side", "fxd", "flt", "uti"]]
+@profiled
+def set_gleif(trade_repository: pd.DataFrame, lei_index: dict):
+    """
+    Cette fonction rajoute la nomenclature GLEIF sur un trade repository deja dedoublonne:
+    - Son but: Associer a chaque LEI (declarant et contrepartie) son nom et son pays en une seule passe
+               vectorisee sur l'index des LEI. Les LEI absents de GLEIF ne font plus disparaitre la transaction:
+               ses nom et pays restent vides et le LEI est remonte dans la table des LEI inconnus.
+               Les LEI, noms et pays sont stockes en colonnes categorielles qui renvoient a une table des entites
 
-    df_rptg = df_rptg.rename(columns={"name": "name_rptg", "country": "country_rptg"})
-    df_othr = df_othr.rename(columns={"name": "name_othr", "country": "country_othr"})
+    - Parametres: il faut renseigne le trade repository et l'index construit par set_lei_index
 
-    # Finalement, on reagroupe tout sur une nouvelle Data Frame
+    -Resultat : un tuple avec la Data Frame recapitulative indexee sur l'UTI, la table des LEI inconnus et
+                la table des entites (Lei, Name, Country) dont la position est le code des colonnes Lei
+    """
+    size = len(trade_repository)
+    leis = np.concatenate([trade_repository['lei_rptg'].to_numpy(dtype=object),
+                           trade_repository['lei_othr'].to_numpy(dtype=object)])
+    positions = lei_index['lei'].get_indexer(leis)  # -1 quand le LEI est inconnu
+
+    # Les LEI inconnus recoivent chacun une position negative distincte. Un LEI manquant n'est pas un LEI inconnu:
+    # il reste vide (code -1) et n'entre ni dans la table des entites ni dans celle des LEI inconnus (il est deja
+    # en quarantaine, comme dans le backend SQL)
+    null = pd.isna(leis)
+    missing = (positions == -1) & ~null
+    extra_codes, extra = pd.factorize(leis[missing])
+    positions[missing] = -1 - extra_codes
+
+    # Table des entites: uniquement les LEI presents dans les transactions
+    codes = np.full(len(leis), -1, dtype=np.int64)
+    codes[~null], entity_positions = pd.factorize(positions[~null])
+    known = entity_positions >= 0
+    entity_lei = np.empty(len(entity_positions), dtype=object)
+    entity_lei[known] = lei_index['lei'].to_numpy()[entity_positions[known]]
+    entity_lei[~known] = np.asarray(extra, dtype=object)[-1 - entity_positions[~known]]
+    gleif_positions = np.where(known, entity_positions, -1)
+    entities = pd.DataFrame({
+        'Lei': entity_lei,
+        'Name': lei_index['name'].take(gleif_positions, allow_fill=True).remove_unused_categories(),
+        'Country': lei_index['country'].take(gleif_positions, allow_fill=True).remove_unused_categories()
+    })
+
+    lei = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(entities['Lei']))
+    name = categorical(np.where(null, -1, entities['Name'].cat.codes.to_numpy()[codes]), entities['Name'].array)
+    country = categorical(np.where(null, -1, entities['Country'].cat.codes.to_numpy()[codes]),
+                          entities['Country'].array)
 
     gleif_trade = pd.DataFrame({
-        "Lei_rptg": df_rptg["lei_rptg"],
-        "Name_rptg": df_rptg["name_rptg"],
-        "Country_rptg": df_rptg["country_rptg"],
-        "Lei_othr": df_othr["lei_othr"],
-        "Name_othr": df_othr["name_othr"],
-        "Country_othr": df_othr["country_othr"],
-        "Notional": df_rptg["notional"],
-        "Side": df_rptg["side"],
-        "Fxd": df_rptg["fxd"],
-        "Flt": df_rptg["flt"],
-        "Uti": df_rptg["uti"]
+        "Lei_rptg": lei[:size],
+        "Name_rptg": name[:size],
+        "Country_rptg": country[:size],
+        "Lei_othr": lei[size:],
+        "Name_othr": name[size:],
+        "Country_othr": country[size:],
+        "Notional": trade_repository["notional"].to_numpy(),
+        "Side": pd.Categorical(trade_repository["side"]),
+        "Fxd": trade_repository["fxd"].to_numpy(),
+        "Flt": pd.Categorical(trade_repository["flt"]),
+        "Uti": trade_repository["uti"].to_numpy()
     })
 
     gleif_trade.set_index("Uti", inplace=True)  # On set l'index sur UTI car ID unique par transaction
 
+    # Table des LEI inconnus: un LEI par role avec le nombre de transactions concernees
+    unmatched = pd.DataFrame({'Lei': leis[missing], 'Role': np.repeat(['rptg', 'othr'], size)[missing]})
+    unmatched = unmatched.value_counts(sort=False).rename('Trades').reset_index()
+    return gleif_trade, unmatched, entities
+
+
+@profiled
+def set_legs(gleif_trade: pd.DataFrame):
+    """
+    Cette fonction construit les deux jambes (buyer et seller) de chaque transaction:
+    - Son but: Inverser les contreparties selon le side et calculer le Cash_Flow de chaque jambe
+               par des operations vectorisees sur des colonnes entieres plutot que ligne par ligne.
+               Les colonnes texte sont des categories: seuls les codes entiers sont choisis par jambe,
+               et l'UTI renvoie a l'index de la Data Frame recapitulative au lieu d'etre copie deux fois
+
+    - Parametres: il faut renseigne la Data Frame recapitulative indexee sur l'UTI
+
+    -Resultat : un tuple contenant la dataframe buyer et la dataframe seller
+    """
+    uti = pd.Categorical.from_codes(np.arange(len(gleif_trade)), dtype=pd.CategoricalDtype(gleif_trade.index))
+    notional = gleif_trade["Notional"].to_numpy()
+    fxd = gleif_trade["Fxd"].to_numpy()
+    index = gleif_trade["Flt"].array
+
+    # Si le declarant achete, il est le buyer et son taux fixe est pris en valeur absolue
+    is_buyer = (gleif_trade["Side"] == 'B').to_numpy()
+    fxd = np.where(is_buyer & (fxd < 0), np.abs(fxd), fxd)
+    sign = np.where(is_buyer, 1, -1)
+
+    def pick(mask, column: str):
+        rptg = gleif_trade[f"{column}_rptg"].array
+        return categorical(np.where(mask, rptg.codes, gleif_trade[f"{column}_othr"].array.codes), rptg)
+
+    def leg(rptg_side: bool, position: str, cash_flow):
+        # Le declarant occupe la jambe quand son side correspond, sinon c'est l'autre contrepartie
+        mask = is_buyer if rptg_side else ~is_buyer
+        return pd.DataFrame({
+            "Uti": uti,
+            "Lei": pick(mask, "Lei"),
+            "Country": pick(mask, "Country"),
+            "Name": pick(mask, "Name"),
+            "Position": categorical(np.full(len(mask), POSITIONS.index(position), dtype=np.int8),
+                                    pd.Categorical([], categories=POSITIONS)),
+            "Notional": notional,
+            "Cash_Flow": cash_flow,
+            "Index": index
+        })
+
+    buyer = leg(True, "Buyer", notional * (sign * fxd))
+    seller = leg(False, "Seller", notional * (-sign * fxd))
+    return buyer, seller
+
+
+def memory_report(data: dict):
+    """
+    Cette fonction mesure la memoire occupee par nos dataframes:
+    - Son but: Suivre le gain des colonnes categorielles. Les dictionnaires partages entre dataframes
+               (UTI, LEI, noms, pays) ne sont comptes qu'une fois, dans la premiere dataframe qui les utilise
+
+    - Parametres: il faut renseigne le dictionnaire renvoye par set_data
+
+    -Resultat : une dataframe avec le nombre de lignes et de Mo par dataframe
+    """
+    seen = set()
+
+    def shared(values):
+        # Taille d'un dictionnaire ou d'un index s'il n'a pas deja ete compte
+        if id(values) in seen:
+            return 0
+        seen.add(id(values))
+        return values.memory_usage(deep=True)
+
+    frames, rows, sizes = [], [], []
+    for frame, df in data.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        size = shared(df.index)
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                size += df[column].cat.codes.nbytes + shared(df[column].cat.categories)
+            else:
+                size += df[column].memory_usage(index=False, deep=True)
+        frames.append(frame)
+        rows.append(len(df))
+        sizes.append(size / 2 ** 20)
+    return pd.DataFrame({'Frame': frames, 'Rows': rows, 'MB': sizes})
+
+
+@profiled
+def set_data(directories: dict, workers: int = 1, quarantine: bool = False, lookup: dict = None):
+    """
+    Cette fonction est celle qui initialise notre data:
+    - Son but: Nettoyage nos differents Trade repositories en fonction de leur nombre et rajoute
+               des informations de la nomenclature GLEIF
+
+    - Parametres: il faut renseigne un dictionnaire contenant les chemins d'acces de nos fichiers, le nombre
+                  de processus pour lire les Trade Repositories, s'il faut ecarter les transactions en quarantaine
+                  et la section [gleif] de la config (table de correspondance de la golden copy)
+
+    -Resultat : un dictionnaire contenant des dataframes pour le buyer et seller side et une df recapitulative
+    """
+    # On verifie avoir biend des directories
+    if len(directories['TR']) == 0:
+        raise ValueError('Aucun Trade Repository a été transmis')
+    # Settings nos DataFrames: GLEIF est lu apres les Trade Repositories pour n'en garder que les LEI utiles
+    trade_repositories = read_trade_repositories(directories['TR'], workers)
+    with stage('read_gleif') as section:
+        gleif = read_gleif(directories['GLEIF'][0], trade_repositories, lookup)
+        section['rows'] = len(gleif)
+
+    # Voici nos différents Trade repositories et la nomenclature GLEIF convertit en Data Frames
+
+    # Nettoyage des doublons nettoyage des doublons
+    with stage('concat') as section:
+        trade_repository = pd.concat(trade_repositories, ignore_index=True)
+        section['rows'] = len(trade_repository)
+
+    trade_repository, duplicates = drop_duplicates(trade_repository, set_uti_index(), directories['TR'],
+                                                   [len(df) for df in trade_repositories])
+    print_report(duplicates)
+
+    # Controle qualite: les anomalies sont mises en quarantaine, les transactions ne sont ecartees que sur demande
+    lei_index = set_lei_index(gleif)
+    quarantined, quality, flagged = validate(trade_repository, lei_index)
+    print_quality(quality)
+    if quarantine:
+        trade_repository = trade_repository[~flagged].reset_index(drop=True)
+
+    # Rajout de la nomeclature GLEIF sur le trade repository
+    gleif_trade, unmatched, entities = set_gleif(trade_repository, lei_index)
+    if unmatched.shape[0] != 0:
+        print(f" We have {unmatched.shape[0]} LEIs that are missing from the GLEIF nomenclature\n\n")
+
     # Creation des dataframes, buyer et seller qui nous permetront de faire des calculs
-    b_rows = []
-    s_rows = []
-
-    for i in gleif_trade.index:
-
-        row = gleif_trade.loc[i]
-        fxd = abs(row['Fxd']) if row['Side'] == 'B' and row['Fxd'] < 0 else row['Fxd']
-
-        if row['Side'] == 'B':
-            b_row = {
-                "Uti": i,
-                "Lei": row["Lei_rptg"],
-                "Country": row["Country_rptg"],
-                "Name": row["Name_rptg"],
-                "Position": "Buyer",
-                "Notional": row["Notional"],
-                "Cash_Flow": row["Notional"] * fxd,
-                "Index": row["Flt"]
-            }
-            s_row = {
-                "Uti": i,
-                "Lei": row["Lei_othr"],
-                "Country": row["Country_othr"],
-                "Name": row["Name_othr"],
-                "Position": "Seller",
-                "Notional": row["Notional"],
-                "Cash_Flow": row["Notional"] * -fxd,
-                "Index": row["Flt"]
-            }
-        else:
-            b_row = {
-                "Uti": i,
-                "Lei": row["Lei_othr"],
-                "Country": row["Country_othr"],
-                "Name": row["Name_othr"],
-                "Position": "Buyer",
-                "Notional": row["Notional"],
-                "Cash_Flow": row["Notional"] * -fxd,
-                "Index": row["Flt"]
-            }
-            s_row = {
-                "Uti": i,
-                "Lei": row["Lei_rptg"],
-                "Country": row["Country_rptg"],
-                "Name": row["Name_rptg"],
-                "Position": "Seller",
-                "Notional": row["Notional"],
-                "Cash_Flow": row["Notional"] * fxd,
-                "Index": row["Flt"]
-            }
-        b_rows.append(b_row)
-        s_rows.append(s_row)
-
-    result = {"Buyer": pd.DataFrame(b_rows), "Seller": pd.DataFrame(s_rows), "Repository": gleif_trade}
+    buyer, seller = set_legs(gleif_trade)
+
+    result = {"Buyer": buyer, "Seller": seller, "Repository": gleif_trade, "Entities": entities,
+              "Unmatched": unmatched, "Duplicates": duplicates, "Quarantine": quarantined, "Quality": quality}
 
     return result
 
@@ -173,8 +454,11 @@ def set_data(directories: dict):
 if __name__ == '__main__':
 
     config_file = get_config()
-    directoires = get_directories(config_file['files']['names'])
+    directoires = get_directories(config_file['files']['names'], config_file['discovery'])
     data = set_data(directoires)
 
     print(data['Buyer'])
+    # Memoire des dataframes, chaque dictionnaire partage compte une fois (2.02 Mo sur les fichiers d'exemple)
+    report = memory_report(data)
+    print(f"{report.to_string(index=False)}\nTotal: {report['MB'].sum():.2f} MB")
     print('Test succesfully done !!!')
\ No newline at end of file
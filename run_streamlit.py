@@ -1,8 +1,12 @@
 import os
+import shlex
+import sys
 
 APP_ENTRY_POINT = 'main.py'
 
 dir_path = os.path.dirname(__file__)
 path = os.path.join(dir_path, APP_ENTRY_POINT)
 
-os.system('streamlit run "{}"'.format(path))
+# Les arguments (--config, --data-dir) sont transmis a main.py apres "--"
+arguments = ' '.join(shlex.quote(argument) for argument in sys.argv[1:])
+os.system('streamlit run "{}" -- {}'.format(path, arguments))
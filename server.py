@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+from urllib.parse import (parse_qs, urlparse)
+import pandas as pd
+
+import repository
+from helper_exposition import (get_countries, get_top_bottom, set_rank_index)
+from helper_store import (get_frames, invalidate)
+
+# Ce module n'importe ni streamlit ni plotly: les autres equipes interrogent les expositions en JSON
+SCALES = {'country': 'Country', 'company': 'Company', 'parent': 'Parent'}
+TOP_BOTTOM = ['Top', 'Bottom']
+
+
+class ExposureServer(ThreadingHTTPServer):
+    # Une file d'attente de 5 connexions (la valeur par defaut) fait attendre d'une seconde les clients en rafale
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class ResultCache:
+    # Cache LRU des reponses deja serialisees, partage par les threads du serveur
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ExposureService:
+    """
+    Cette classe sert les expositions deja calculees a des scripts, sans Streamlit:
+    - Son but: Charger une seule fois les expositions (le store partage du processus), construire une fois par
+               version l'index des rangs de chaque echelle, puis repondre aux requetes (indice, Top/Bottom N,
+               liste de pays) par des tranches de l'index, les reponses deja calculees sortant du cache LRU
+
+    - Parametres: il faut renseigne la config (sections [service], [rates] et [columns])
+
+    -Resultat : un service dont la methode query rend le corps JSON d'une requete
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.cache = ResultCache(config['service']['cache_size'])
+        self.lock = threading.Lock()
+        self.ranks = {'version': None}
+        self.checked = 0.0
+
+    def get_rank_indexes(self):
+        # Le store verifie les fichiers sources au plus toutes les refresh_seconds: entre deux verifications, une
+        # requete ne touche pas au disque. Une nouvelle version reconstruit les index, une seule fois
+        fresh = time.monotonic() - self.checked < self.config['service']['refresh_seconds']
+        if self.ranks['version'] is not None and fresh:
+            return self.ranks
+        version, frames = get_frames(self.config)
+        self.checked = time.monotonic()
+        with self.lock:
+            if self.ranks['version'] != version:
+                columns = [self.config['columns'][column] for column in ['ratio', 'cash_flow', 'gross_exposure',
+                                                                         'net_exposure']]
+                self.ranks = {'version': version}
+                self.ranks.update({scale: set_rank_index(frames[frame], columns)
+                                   for scale, frame in SCALES.items() if frame in frames})
+            return self.ranks
+
+    def parse(self, parameters: dict):
+        # Normalise la requete: deux requetes equivalentes partagent la meme entree du cache
+        def values(name: str):
+            return [value for item in parameters.get(name, []) for value in item.split(',') if value]
+
+        scale = (parameters.get('scale') or ['country'])[0]
+        if scale not in SCALES:
+            raise ValueError(f"Echelle inconnue: {scale} ({', '.join(SCALES)})")
+        indices = values('index')
+        unknown = set(indices).difference(self.config['rates']['names'])
+        if unknown:
+            raise ValueError(f"Indices inconnus: {', '.join(sorted(unknown))}")
+        top_bottom = (parameters.get('top_bottom') or [None])[0]
+        if top_bottom is not None and top_bottom not in TOP_BOTTOM:
+            raise ValueError('top_bottom doit valoir Top ou Bottom')
+        column = (parameters.get('column') or [self.config['columns']['ratio']])[0]
+        try:
+            num = int((parameters.get('num') or [10])[0])
+        except ValueError:
+            raise ValueError('num doit etre un entier')
+        if num < 1:
+            raise ValueError('num doit etre positif')
+        if top_bottom is None:
+            num = None
+        return scale, tuple(sorted(indices)), top_bottom, num, column, tuple(sorted(set(values('countries'))))
+
+    def select(self, rank_index: dict, scale: str, indices: tuple, top_bottom: str, num: int, column: str,
+               countries: tuple):
+        # Memes filtres que la vue: par pays, les Top/Bottom N d'un indice elargis aux pays demandes. Par entreprise
+        # ou par groupe, les Top/Bottom N parmi les pays demandes
+        if (None, column, 'Top') not in rank_index['rank']:
+            raise ValueError(f'Colonne non classee: {column}')
+        parts = []
+        for index in indices or [None]:
+            if top_bottom is None:
+                selected = get_countries(rank_index, countries or rank_index['countries'], index)
+            elif not countries:
+                selected = get_top_bottom(rank_index, index, top_bottom, num, column)
+            elif scale == 'country':
+                top = get_top_bottom(rank_index, index, top_bottom, num, column)
+                selected = get_countries(rank_index, set(countries).union(top.get('Country', [])), index)
+            else:
+                selected = get_countries(rank_index, countries, index)
+                selected = selected.sort_values(column, ascending=top_bottom == 'Bottom', kind='stable',
+                                                na_position='last').dropna(subset=[column]).head(num)
+            parts.append(selected)
+        parts = [part for part in parts if not part.empty]
+        return pd.concat(parts, ignore_index=True) if parts else rank_index['data'].iloc[:0]
+
+    def query(self, parameters: dict):
+        """
+        Cette methode repond a une requete d'expositions:
+        - Son but: Servir depuis le cache les requetes deja vues pour cette version des donnees, et sinon
+                   filtrer puis serialiser une seule fois
+
+        - Parametres: il faut renseigne les parametres de la requete (scale, index, top_bottom, num, column,
+                      countries), chacun sous forme de liste comme les rend parse_qs
+
+        -Resultat : le corps JSON de la reponse (bytes)
+        """
+        key = self.parse(parameters)
+        ranks = self.get_rank_indexes()
+        body = self.cache.get((ranks['version'],) + key)
+        if body is not None:
+            return body
+
+        scale, indices, top_bottom, num, column, countries = key
+        if scale not in ranks:
+            raise ValueError(f"Echelle {scale} indisponible avec ce backend")
+        # Un rechargement concurrent peut remplacer les index: la requete garde ceux de sa version
+        result = self.select(ranks[scale], scale, indices, top_bottom, num, column, countries)
+        body = (f'{{"version": {ranks["version"]}, "rows": {len(result)}, "data": '.encode()
+                + result.to_json(orient='records').encode() + b'}')
+        self.cache.put((ranks['version'],) + key, body)
+        return body
+
+    def describe(self):
+        # Valeurs possibles des filtres et statistiques du cache
+        ranks = self.get_rank_indexes()
+        return json.dumps({
+            'version': ranks['version'],
+            'scales': [scale for scale in SCALES if scale in ranks],
+            'indices': self.config['rates']['names'],
+            'countries': [str(country) for country in ranks['country']['countries']],
+            'columns': [column for index, column, top_bottom in ranks['country']['rank']
+                        if index is None and top_bottom == 'Top'],
+            'cache': {'entries': len(self.cache.entries), 'hits': self.cache.hits, 'misses': self.cache.misses}
+        }).encode()
+
+    def reload(self):
+        # Rechargement explicite: la nouvelle version du store rend les reponses en cache obsoletes
+        invalidate(self.config)
+        self.cache.clear()
+        self.checked = 0.0
+        return json.dumps({'version': self.get_rank_indexes()['version']}).encode()
+
+
+def get_handler(service: ExposureService):
+    class Handler(BaseHTTPRequestHandler):
+        def send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def route(self, routes: dict):
+            url = urlparse(self.path)
+            action = routes.get(url.path)
+            if action is None:
+                return self.send(404, json.dumps({'error': f'Route inconnue: {url.path}'}).encode())
+            try:
+                self.send(200, action(parse_qs(url.query)))
+            except ValueError as error:
+                self.send(400, json.dumps({'error': str(error)}).encode())
+            except Exception as error:
+                # Source manquante ou corrompue, colonne inconnue...: le client recoit une reponse plutot qu'une
+                # connexion fermee
+                self.send(500, json.dumps({'error': f'{type(error).__name__}: {error}'}).encode())
+
+        def do_GET(self):
+            self.route({'/exposures': service.query, '/describe': lambda _: service.describe(),
+                        '/health': lambda _: b'{"status": "ok"}'})
+
+        def do_POST(self):
+            self.route({'/reload': lambda _: service.reload()})
+
+        def log_message(self, format, *args):
+            if service.config['service']['log']:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def serve(config: dict):
+    """
+    Cette fonction demarre le service de requetes:
+    - Son but: Charger les expositions avant d'accepter les connexions, puis traiter chaque requete dans son
+               propre thread
+
+    - Parametres: il faut renseigne la config (section [service])
+
+    -Resultat : le serveur HTTP, a demarrer avec serve_forever
+    """
+    service = ExposureService(config)
+    service.get_rank_indexes()
+    settings = config['service']
+    return ExposureServer((settings['host'], settings['port']), get_handler(service))
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Service JSON des expositions GLEIF')
+    parser.add_argument('--config', help='chemin du fichier config.toml')
+    parser.add_argument('--data-dir', help='dossier contenant les Trade Repositories et la nomenclature GLEIF')
+    parser.add_argument('--host', help='adresse d\'ecoute (par defaut [service].host du config)')
+    parser.add_argument('--port', type=int, help='port d\'ecoute (par defaut [service].port du config)')
+    return parser.parse_args()
+
+
+def main():
+    arguments = get_arguments()
+    if arguments.data_dir:
+        os.environ[repository.DATA_DIR_ENV] = arguments.data_dir
+    config = repository.get_config(arguments.config)
+    for key in ['host', 'port']:
+        if getattr(arguments, key) is not None:
+            config['service'][key] = getattr(arguments, key)
+
+    server = serve(config)
+    print(f"Serving exposures on http://{config['service']['host']}:{config['service']['port']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
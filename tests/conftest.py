@@ -0,0 +1,38 @@
+import copy
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository import (get_config, get_directories, set_data)  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def base_config():
+    return get_config(os.path.join(ROOT, 'config.toml'))
+
+
+@pytest.fixture
+def config(base_config, tmp_path):
+    # Chaque test ecrit ses caches et ses manifests dans son propre dossier temporaire
+    config = copy.deepcopy(base_config)
+    config['cache']['directory'] = str(tmp_path / 'cache')
+    config['store']['directory'] = str(tmp_path / 'store')
+    config['gleif']['directory'] = str(tmp_path / 'lookup')
+    config['incremental']['directory'] = str(tmp_path / 'state')
+    config['ingestion']['output'] = str(tmp_path / 'stream')
+    config['discovery']['manifest'] = str(tmp_path / 'discovery.json')
+    return config
+
+
+@pytest.fixture(scope='session')
+def directories(base_config):
+    # Les fichiers d'exemple (TR1, TR2 et GLEIF) sont a la racine du depot
+    return get_directories(base_config['files']['names'], base_config['discovery'], ROOT)
+
+
+@pytest.fixture(scope='session')
+def data(directories):
+    return set_data(directories)
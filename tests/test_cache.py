@@ -0,0 +1,29 @@
+import pandas as pd
+
+from helper_cache import (load_data, to_columnar)
+from repository import (FRAMES, memory_report)
+
+
+def test_warm_load_matches_cold_load(directories, config):
+    cold = load_data(directories, config)
+    warm = load_data(directories, config)
+
+    for frame in FRAMES:
+        pd.testing.assert_frame_equal(warm[frame], cold[frame], check_exact=True)
+        pd.testing.assert_series_equal(warm[frame].dtypes, cold[frame].dtypes)
+
+    # Les jambes et la Data Frame recapitulative partagent les memes dictionnaires, comme apres set_data
+    for column in ['Lei', 'Name', 'Country', 'Index']:
+        assert warm['Buyer'][column].cat.categories is warm['Seller'][column].cat.categories
+    assert warm['Buyer']['Lei'].cat.categories is warm['Repository']['Lei_rptg'].cat.categories
+    assert warm['Buyer']['Name'].cat.categories is warm['Entities']['Name'].cat.categories
+    assert warm['Buyer']['Index'].cat.categories is warm['Repository']['Flt'].cat.categories
+    assert warm['Buyer']['Uti'].cat.categories is warm['Repository'].index
+    # Au stockage des chaines pres, un chargement a chaud occupe autant de memoire qu'un calcul a froid
+    pd.testing.assert_frame_equal(memory_report(warm), memory_report(cold), rtol=1e-2)
+
+
+def test_to_columnar_keeps_missing_values():
+    df = pd.DataFrame({'lei': pd.Series(['A', 12, None, float('nan')], dtype=object)})
+    assert to_columnar(df)['lei'].isna().tolist() == [False, False, True, True]
+    assert to_columnar(df)['lei'].tolist()[:2] == ['A', '12']
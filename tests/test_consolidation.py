@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from helper_consolidation import (get_ancestors, get_parents, set_closure, set_parent_cube)
+
+
+def get_chains(relationships: pd.DataFrame):
+    # Reference naive: on suit les parents un par un. Un cycle est rompu sur son plus petit LEI, sans parent ensuite
+    relationships = relationships[relationships['child'] != relationships['parent']]
+    parent = dict(relationships.drop_duplicates(subset='child').itertuples(index=False))
+    for lei in list(parent):
+        seen = [lei]
+        while seen[-1] in parent and parent[seen[-1]] not in seen:
+            seen.append(parent[seen[-1]])
+        if seen[-1] in parent:
+            del parent[min(seen[seen.index(parent[seen[-1]]):])]
+    chains = {}
+    for lei in set(relationships['child']) | set(relationships['parent']):
+        chain = [lei]
+        while chain[-1] in parent:
+            chain.append(parent[chain[-1]])
+        chains[lei] = chain[1:]
+    return chains
+
+
+def set_relationships(seed: int, size: int):
+    # Une foret aleatoire (chaque LEI pointe vers un LEI plus petit), des doublons, une boucle et deux cycles
+    rng = np.random.default_rng(seed)
+    leis = np.array([f'LEI{i:05d}' for i in range(size)], dtype=object)
+    children = rng.permutation(np.arange(1, size))[:size * 2 // 3]
+    parents = (rng.random(len(children)) * children).astype(int)
+    relationships = pd.DataFrame({'child': leis[children], 'parent': leis[parents]})
+    cycles = pd.DataFrame({'child': ['C3', 'C1', 'C2', 'D2', 'D1', 'E1', 'X'],
+                           'parent': ['C1', 'C2', 'C3', 'D1', 'D2', 'E1', 'C2']})
+    return pd.concat([relationships, relationships.head(5).assign(parent='LEI00000'), cycles], ignore_index=True)
+
+
+def test_closure_matches_parent_walk():
+    for seed in range(5):
+        relationships = set_relationships(seed, 300)
+        closure = set_closure(relationships)
+        chains = get_chains(relationships)
+
+        # Memes ancetres, du parent direct au parent ultime, et meme nombre de cycles rompus
+        assert {lei: get_ancestors(closure, lei) for lei in chains} == chains
+        assert closure['cycles'] == 2
+        assert get_ancestors(closure, 'UNKNOWN') == []
+
+        # Avec une nomenclature, le parent est l'ancetre le plus haut qu'elle connait, sinon le LEI lui-meme
+        leis = pd.Index(sorted(chains) + ['UNKNOWN'])
+        known = pd.Index(leis[::3])
+        expected = [next((ancestor for ancestor in reversed(chains.get(lei, [])) if ancestor in known), lei)
+                    for lei in leis]
+        assert list(get_parents(closure, leis, known)) == expected
+        assert list(get_parents(closure, leis)) == [(chains.get(lei) or [lei])[-1] for lei in leis]
+
+
+def test_parent_cube_matches_groupby(data):
+    # Chaque entite des transactions est rattachee a une autre entite de la nomenclature d'exemple
+    leis = pd.Index(data['Entities']['Lei'].astype(str))
+    rng = np.random.default_rng(0)
+    children = rng.permutation(len(leis))[:len(leis) // 2]
+    parents = (rng.random(len(children)) * children).astype(int)
+    relationships = pd.DataFrame({'child': leis[children], 'parent': leis[parents]})
+    nomenclature = data['Entities'].rename(columns=str.lower)
+    closure = set_closure(relationships)
+    cube = set_parent_cube(data, closure, nomenclature)
+
+    # Reference: chaque jambe prend le LEI de sa tete de groupe, puis un groupby par (groupe, indice)
+    parent = dict(zip(leis, get_parents(closure, leis, leis)))
+    legs = pd.concat([data['Buyer'].assign(Net_Exposure=-data['Buyer']['Notional']),
+                      data['Seller'].assign(Net_Exposure=data['Seller']['Notional'])], ignore_index=True)
+    legs = legs.assign(Lei=legs['Lei'].astype(str).map(parent), Entity=legs['Lei'].astype(str),
+                       Gross_Exposure=legs['Notional'], Index=legs['Index'].astype(object))
+    groups = legs.dropna(subset=['Lei', 'Index']).groupby(['Lei', 'Index'])
+    reference = groups[['Gross_Exposure', 'Net_Exposure', 'Cash_Flow']].sum().join(groups['Entity'].nunique())
+
+    result = cube.astype({'Lei': str, 'Index': str}).set_index(['Lei', 'Index'])
+    reference = reference.reindex(result.index)
+    np.testing.assert_allclose(result[['Gross_Exposure', 'Net_Exposure', 'Cash_Flow']], reference.iloc[:, :3])
+    assert (result['Entities'] == reference['Entity']).all()
+    assert len(cube) == len(groups)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helper_counterparty import (get_block, get_exposures, get_labels, set_counterparty)
+
+
+def to_series(matrix: dict):
+    # Matrice CSR remise sous forme de serie (ligne, colonne) -> valeur
+    rows = np.repeat(np.arange(matrix['size']), np.diff(matrix['indptr']))
+    return pd.Series(matrix['data'], index=pd.MultiIndex.from_arrays([rows, matrix['indices']]))
+
+
+def set_pairs(data: dict, level: str):
+    # Reference naive: une ligne par transaction entre deux LEI connus, avec la ligne du buyer et celle du seller
+    codes, _ = get_labels(data, level)
+    buyer = data['Buyer']['Lei'].astype(object)
+    seller = data['Seller']['Lei'].astype(object)
+    position = pd.Index(data['Buyer']['Lei'].cat.categories)
+    known = (buyer.notna() & seller.notna()).to_numpy()
+    return pd.DataFrame({'Buyer': codes[position.get_indexer(buyer[known])],
+                         'Seller': codes[position.get_indexer(seller[known])],
+                         'Index': data['Buyer']['Index'].astype(object).to_numpy()[known],
+                         'Notional': data['Buyer']['Notional'].to_numpy(dtype=float)[known]}).dropna(subset='Index')
+
+
+def assert_same(matrix: dict, reference: pd.DataFrame):
+    reference = reference.groupby(['Row', 'Column'])['Value'].sum()
+    matrix = to_series(matrix)
+    keys = matrix.index.union(reference.index)
+    np.testing.assert_allclose(matrix.reindex(keys, fill_value=0), reference.reindex(keys, fill_value=0), atol=1e-6)
+
+
+@pytest.mark.parametrize('level', ['Lei', 'Country'])
+def test_set_counterparty_matches_groupby(data, level):
+    counterparty = set_counterparty(data, level)
+    pairs = set_pairs(data, level)
+    assert set(pairs['Index']) <= set(counterparty)
+
+    for index, trades in pairs.groupby('Index'):
+        b, s, n = trades['Buyer'], trades['Seller'], trades['Notional']
+        # Brute: chaque contrepartie est exposee au notionnel, une seule fois pour une transaction sur la diagonale
+        other = b != s
+        assert_same(counterparty[index]['Gross'], pd.DataFrame({'Row': pd.concat([b, s[other]]),
+                                                                'Column': pd.concat([s, b[other]]),
+                                                                'Value': pd.concat([n, n[other]])}))
+        # Nette: le seller est expose positivement au buyer, le buyer negativement au seller
+        assert_same(counterparty[index]['Net'], pd.DataFrame({'Row': pd.concat([s, b]), 'Column': pd.concat([b, s]),
+                                                              'Value': pd.concat([n, -n])}))
+
+        # Les lectures d'une ligne et d'un bloc sont des tranches des memes matrices
+        label = counterparty['labels'][b.iloc[0]]
+        exposures = get_exposures(counterparty, index, label)
+        block = get_block(counterparty, index, [label], list(exposures['Counterparty']))
+        np.testing.assert_allclose(block.iloc[0].to_numpy(), exposures['Gross'].to_numpy())
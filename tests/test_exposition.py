@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from helper_exposition import (exposition, get_countries, get_top_bottom, set_cube, set_rank_index)
+from repository import (set_gleif, set_legs, set_lei_index)
+
+
+@pytest.mark.parametrize('partition', ['Lei', 'Country'])
+def test_set_cube_partitioned_matches_groupby(data, partition):
+    # Deux processus et quatre partitions: une meme cle peut etre sommee dans plusieurs partitions
+    cube = set_cube(data, workers=2, partition=partition)
+    reference = set_cube(data)
+
+    # Memes cles, dans le meme ordre, memes categories et memes sommes que le groupby en un seul processus
+    pd.testing.assert_frame_equal(cube, reference, check_exact=False)
+
+
+def test_set_cube_partitioned_keeps_missing_keys():
+    gleif = pd.DataFrame({'lei': ['L1', 'L2', 'L3'], 'name': ['First', 'Second', 'Third'], 'country': ['FR', 'DE', 'FR']})
+    trades = pd.DataFrame({'lei_rptg': ['L1', 'X9', 'L3', None, 'L2'], 'lei_othr': ['L2', 'L1', 'X9', 'L3', 'L1'],
+                           'notional': [1, 2, 3, 4, 5], 'side': ['B', 'S', 'B', 'S', 'B'],
+                           'fxd': [0.1, 0.2, 0.3, 0.4, 0.5], 'flt': ['EONIA', 'LIBOR', None, 'EONIA', 'EONIA'],
+                           'uti': ['U1', 'U2', 'U3', 'U4', 'U5']})
+    gleif_trade, _, _ = set_gleif(trades, set_lei_index(gleif))
+    buyer, seller = set_legs(gleif_trade)
+    data = {'Buyer': buyer, 'Seller': seller}
+
+    # Les LEI inconnus ou manquants et l'indice manquant forment leurs propres groupes, classes en fin
+    for partition in ['Lei', 'Country']:
+        pd.testing.assert_frame_equal(set_cube(data, workers=2, partition=partition), set_cube(data),
+                                      check_exact=False)
+
+
+@pytest.mark.parametrize('index', [None, 'EONIA', 'LIBOR'])
+def test_rank_index_matches_sort(data, index):
+    expo = exposition(d=data, i=['EONIA', 'LIBOR'])
+    rank_index = set_rank_index(expo, ['Ratio', 'Cash_Flow'])
+    rows = expo if index is None else expo[expo['Index'] == index]
+
+    # Les tranches de l'index sont les nlargest / nsmallest de la dataframe filtree, ex aequo compris
+    for column in ['Ratio', 'Cash_Flow']:
+        for num in [1, 5, len(expo) + 1]:
+            pd.testing.assert_frame_equal(get_top_bottom(rank_index, index, 'Top', num, column),
+                                          rows.nlargest(num, column, keep='first'))
+            pd.testing.assert_frame_equal(get_top_bottom(rank_index, index, 'Bottom', num, column),
+                                          rows.nsmallest(num, column, keep='first'))
+
+    # La selection de pays est celle de isin, dans l'ordre des lignes, et ignore un pays absent
+    countries = ['FR', 'DE', 'Atlantis']
+    pd.testing.assert_frame_equal(get_countries(rank_index, countries, index), rows[rows['Country'].isin(countries)])
+    assert get_top_bottom(rank_index, 'SOFR', 'Top', 5, 'Ratio').empty
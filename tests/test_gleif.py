@@ -0,0 +1,66 @@
+import os
+import zipfile
+import pandas as pd
+import pytest
+from xml.sax.saxutils import escape
+
+from helper_gleif import (CSV_FIELDS, get_trade_leis)
+from repository import (read_gleif, read_source, read_trade_repositories)
+
+NAMESPACE = 'http://www.gleif.org/data/schema/leidata/2016'
+
+
+@pytest.fixture(scope='module')
+def nomenclature(directories):
+    # La nomenclature d'exemple, en texte comme dans la golden copy, plus des LEI qu'aucune transaction ne cite
+    gleif = read_source(directories['GLEIF'][0]).astype(str)
+    others = pd.DataFrame({'lei': [f'OTHER{i:015d}' for i in range(500)], 'name': 'Other & Co', 'country': 'ZZ'})
+    return pd.concat([others.iloc[:250], gleif, others.iloc[250:]], ignore_index=True)
+
+
+def write_csv(nomenclature: pd.DataFrame, path: str):
+    # Golden copy CSV zippee: les champs LEI-CDF et d'autres colonnes que la lecture doit ignorer
+    golden_copy = nomenclature.rename(columns={column: field for field, column in CSV_FIELDS.items()})
+    golden_copy.insert(1, 'Entity.LegalForm.EntityLegalFormCode', '8888')
+    golden_copy['Entity.HeadquartersAddress.Country'] = 'XX'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(os.path.basename(path)[:-4], golden_copy.to_csv(index=False))
+
+
+def write_xml(nomenclature: pd.DataFrame, path: str):
+    # Golden copy XML: le pays du siege (HeadquartersAddress) ne doit pas remplacer celui de l'adresse legale
+    records = ''.join(f'<lei:LEIRecord><lei:LEI>{row.lei}</lei:LEI><lei:Entity>'
+                      f'<lei:LegalName>{escape(row.name)}</lei:LegalName>'
+                      f'<lei:LegalAddress><lei:Country>{row.country}</lei:Country></lei:LegalAddress>'
+                      f'<lei:HeadquartersAddress><lei:Country>XX</lei:Country></lei:HeadquartersAddress>'
+                      f'</lei:Entity></lei:LEIRecord>' for row in nomenclature.itertuples())
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(f'<?xml version="1.0" encoding="UTF-8"?><lei:LEIData xmlns:lei="{NAMESPACE}">'
+                   f'<lei:LEIRecords>{records}</lei:LEIRecords></lei:LEIData>')
+
+
+@pytest.mark.parametrize('name, write', [('20240101-gleif-goldencopy-lei2-golden-copy.csv.zip', write_csv),
+                                         ('20240101-gleif-goldencopy-lei2-golden-copy.xml', write_xml)])
+def test_golden_copy_matches_nomenclature(directories, config, nomenclature, tmp_path, name, write):
+    path = str(tmp_path / name)
+    write(nomenclature, path)
+    trade_repositories = read_trade_repositories(directories['TR'])
+    # Des blocs de 100 lignes: la golden copy est lue en plusieurs morceaux
+    config['gleif']['batch_rows'] = 100
+
+    # La table de correspondance est la nomenclature limitee aux LEI des Trade Repositories, dans l'ordre du fichier
+    reference = nomenclature[nomenclature['lei'].isin(get_trade_leis(trade_repositories))].reset_index(drop=True)
+    lookup = read_gleif(path, trade_repositories, config['gleif'])
+    pd.testing.assert_frame_equal(lookup.astype(str), reference)
+
+    # Tant que la golden copy ne change pas, la table est relue sans reparcourir le fichier
+    files = sorted(os.listdir(config['gleif']['directory']))
+    modified = [os.path.getmtime(os.path.join(config['gleif']['directory'], file)) for file in files]
+    pd.testing.assert_frame_equal(read_gleif(path, trade_repositories, config['gleif']), lookup)
+    assert [os.path.getmtime(os.path.join(config['gleif']['directory'], file)) for file in files] == modified
+
+    # Une nouvelle contrepartie fait grossir la table sans perdre les LEI deja recherches
+    new = pd.DataFrame({'lei_rptg': ['OTHER000000000000007'], 'lei_othr': [None]})
+    grown = read_gleif(path, trade_repositories + [new], config['gleif'])
+    assert len(grown) == len(lookup) + 1
+    assert grown['lei'].isin(lookup['lei']).sum() == len(lookup)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from helper_exposition import (KEYS, MEASURES, set_cube)
+from helper_incremental import (append_repository, get_state, set_state, to_cube, update)
+from repository import (read_source, set_lei_index)
+
+
+def sort_cube(cube: pd.DataFrame):
+    # Meme ordre et memes types des deux cotes: les cles en texte (manquantes comprises), les mesures en float
+    cube = cube.astype({key: object for key in KEYS}).astype({measure: float for measure in MEASURES})
+    return cube.sort_values(KEYS, na_position='last', ignore_index=True)[KEYS + MEASURES]
+
+
+def test_update_matches_set_data(directories, config, data):
+    for path in directories['TR']:
+        state = update([path], directories['GLEIF'][0], config)
+
+    # Livraison par livraison, le cube incremental est celui de set_data sur l'ensemble des fichiers
+    pd.testing.assert_frame_equal(sort_cube(to_cube(state)), sort_cube(set_cube(data)), check_exact=False)
+
+    # Relivrer un fichier deja integre ne change ni les sources ni les agregats
+    again = update(directories['TR'][:1], directories['GLEIF'][0], config)
+    assert again['Sources'] == state['Sources']
+    pd.testing.assert_frame_equal(get_state(config)['Aggregates'], again['Aggregates'])
+
+
+def test_append_keeps_missing_keys(config):
+    gleif = pd.DataFrame({'lei': ['L1', 'L2'], 'name': ['First', 'Second'], 'country': ['FR', 'DE']})
+    trades = pd.DataFrame({'lei_rptg': ['L1', None, 'L1'], 'lei_othr': ['L2', 'L2', 'L2'], 'notional': [1, 2, 3],
+                           'side': ['B', 'S', 'B'], 'fxd': [0.1, 0.2, 0.3], 'flt': ['EONIA', 'EONIA', None],
+                           'uti': ['U1', 'U2', 'U3']})
+    lei_index = set_lei_index(gleif)
+    state, _ = append_repository(get_state(config), 'TR1.csv', lei_index, trades)
+    set_state(state, config)
+
+    # Un LEI ou un indice manquant reste manquant, il ne devient pas un groupe 'nan'
+    groups = state['Aggregates'].index.to_frame(index=False)
+    assert not (groups == 'nan').any().any()
+    assert groups['Lei'].isna().sum() == 1 and groups['Index'].isna().sum() == 2
+
+    # Relu depuis le disque, un groupe sans LEI ou sans indice est incremente par la livraison suivante
+    state, _ = append_repository(get_state(config), 'TR2.csv', lei_index, trades.assign(uti=['U4', 'U5', 'U6']))
+    assert len(state['Aggregates']) == len(groups)
+    assert np.isclose(state['Aggregates']['Gross_Exposure'].sum(), 2 * 2 * (1 + 2 + 3))
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from helper_quality import (check_lei, validate)
+from repository import set_lei_index
+
+
+def test_check_lei():
+    # Un LEI valide, une cle de controle fausse, un format invalide, un manquant et un LEI numerique lu par Excel
+    missing, bad_format, bad_checksum = check_lei(np.array(['5493001KJTIIGC8Y1R12', '5493001KJTIIGC8Y1R13',
+                                                            '5493001kjtiigc8y1r12', None, 12345], dtype=object))
+    assert missing.tolist() == [False, False, False, True, False]
+    assert bad_format.tolist() == [False, False, True, False, True]
+    assert bad_checksum.tolist() == [False, True, False, False, False]
+
+
+def test_validate_empty_lei_column():
+    lei_index = set_lei_index(pd.DataFrame({'lei': ['5493001KJTIIGC8Y1R12'], 'name': ['First'], 'country': ['FR']}))
+    trades = pd.DataFrame({'lei_rptg': ['5493001KJTIIGC8Y1R12', '5493001KJTIIGC8Y1R13'], 'lei_othr': [None, None],
+                           'notional': [1, 2], 'side': ['B', 'X'], 'fxd': [0.1, None], 'flt': ['EONIA', 'EONIA'],
+                           'uti': ['U1', 'U2']})
+    quarantine, summary, flagged = validate(trades, lei_index)
+
+    # Une colonne de LEI entierement vide ne compte que des LEI manquants
+    rows = summary.set_index(['Check', 'Column'])['Rows']
+    assert rows[('lei_missing', 'lei_othr')] == 2
+    assert rows[('lei_format', 'lei_othr')] == rows[('lei_unknown', 'lei_othr')] == 0
+    assert rows[('lei_checksum', 'lei_rptg')] == rows[('lei_unknown', 'lei_rptg')] == 1
+    assert rows[('side_invalid', 'side')] == rows[('fxd_missing', 'fxd')] == 1
+    assert flagged.tolist() == [True, True]
+    assert set(quarantine.loc[quarantine['Check'] == 'side_invalid', 'Uti']) == {'U2'}
@@ -0,0 +1,112 @@
+import os
+import pandas as pd
+
+import repository
+from repository import (discover_directories, set_gleif, set_legs, set_lei_index)
+
+
+def set_legs_loop(gleif_trade: pd.DataFrame):
+    # Version d'origine de set_legs, ligne par ligne: elle sert de reference a la version vectorisee
+    b_rows = []
+    s_rows = []
+
+    for i in gleif_trade.index:
+
+        row = gleif_trade.loc[i]
+        fxd = abs(row['Fxd']) if row['Side'] == 'B' and row['Fxd'] < 0 else row['Fxd']
+
+        if row['Side'] == 'B':
+            b_row = {"Uti": i, "Lei": row["Lei_rptg"], "Country": row["Country_rptg"], "Name": row["Name_rptg"],
+                     "Position": "Buyer", "Notional": row["Notional"], "Cash_Flow": row["Notional"] * fxd,
+                     "Index": row["Flt"]}
+            s_row = {"Uti": i, "Lei": row["Lei_othr"], "Country": row["Country_othr"], "Name": row["Name_othr"],
+                     "Position": "Seller", "Notional": row["Notional"], "Cash_Flow": row["Notional"] * -fxd,
+                     "Index": row["Flt"]}
+        else:
+            b_row = {"Uti": i, "Lei": row["Lei_othr"], "Country": row["Country_othr"], "Name": row["Name_othr"],
+                     "Position": "Buyer", "Notional": row["Notional"], "Cash_Flow": row["Notional"] * -fxd,
+                     "Index": row["Flt"]}
+            s_row = {"Uti": i, "Lei": row["Lei_rptg"], "Country": row["Country_rptg"], "Name": row["Name_rptg"],
+                     "Position": "Seller", "Notional": row["Notional"], "Cash_Flow": row["Notional"] * fxd,
+                     "Index": row["Flt"]}
+        b_rows.append(b_row)
+        s_rows.append(s_row)
+
+    return pd.DataFrame(b_rows), pd.DataFrame(s_rows)
+
+
+def to_values(df: pd.DataFrame):
+    # Les colonnes categorielles de la version vectorisee sont comparees sur leurs valeurs
+    return df.astype({column: object for column in df.columns if df[column].dtype != float})
+
+
+def test_set_legs_matches_row_loop(data):
+    buyer, seller = set_legs(data['Repository'])
+    reference_buyer, reference_seller = set_legs_loop(data['Repository'])
+
+    assert len(buyer) == len(data['Repository'])
+    pd.testing.assert_frame_equal(to_values(buyer), to_values(reference_buyer), check_dtype=False)
+    pd.testing.assert_frame_equal(to_values(seller), to_values(reference_seller), check_dtype=False)
+
+
+def test_set_gleif_keeps_missing_leis_empty():
+    gleif = pd.DataFrame({'lei': ['L1', 'L2'], 'name': ['First', 'Second'], 'country': ['FR', 'DE']})
+    trades = pd.DataFrame({'lei_rptg': [None, 'L2', 'X9'], 'lei_othr': ['L1', 'L1', None], 'notional': [1, 2, 3],
+                           'side': ['B', 'S', 'B'], 'fxd': [0.1, 0.2, 0.3], 'flt': ['EONIA'] * 3,
+                           'uti': ['U1', 'U2', 'U3']})
+    gleif_trade, unmatched, entities = set_gleif(trades, set_lei_index(gleif))
+
+    # Un LEI manquant ne prend pas le nom ni le pays d'une entite de la nomenclature
+    assert gleif_trade[['Lei_rptg', 'Name_rptg', 'Country_rptg']].loc['U1'].isna().all()
+    assert gleif_trade[['Lei_othr', 'Name_othr', 'Country_othr']].loc['U3'].isna().all()
+    assert gleif_trade.loc['U2', 'Name_rptg'] == 'Second' and gleif_trade.loc['U1', 'Country_othr'] == 'FR'
+    # Seul le LEI inconnu est remonte, son nom et son pays restent vides
+    assert unmatched.to_dict('records') == [{'Lei': 'X9', 'Role': 'rptg', 'Trades': 1}]
+    assert sorted(entities['Lei']) == ['L1', 'L2', 'X9']
+    assert entities.set_index('Lei').loc['X9'].isna().all()
+
+
+def test_discovery_manifest_sees_new_files(base_config, tmp_path, monkeypatch):
+    names = base_config['files']['names']
+    discovery = dict(base_config['discovery'], manifest=str(tmp_path / 'discovery.json'))
+    monkeypatch.chdir(tmp_path)
+    walks = []
+    walk = repository.walk
+    monkeypatch.setattr(repository, 'walk', lambda *args: walks.append(args) or walk(*args))
+    for name in ['TR1.xlsx', 'GLEIF.xlsx']:
+        (tmp_path / name).touch()
+    assert discover_directories(names, discovery) == {'TR': ['./TR1.xlsx'], 'GLEIF': ['./GLEIF.xlsx']}
+
+    # Un fichier sans rapport ne relance pas la recherche, un nouveau Trade Repository dans un sous-dossier oui
+    (tmp_path / 'notes.txt').touch()
+    assert discover_directories(names, discovery)['TR'] == ['./TR1.xlsx']
+    assert len(walks) == 1
+
+    (tmp_path / 'delivery').mkdir()
+    (tmp_path / 'delivery' / 'TR2.xlsx').touch()
+    assert sorted(discover_directories(names, discovery)['TR']) == ['./TR1.xlsx', os.path.join('.', 'delivery',
+                                                                                              'TR2.xlsx')]
+    assert len(walks) == 2
+
+
+def test_discovery_skips_generated_folders(base_config, tmp_path, monkeypatch):
+    # Les fichiers du benchmark et des sorties du projet ne sont pas pris pour des donnees
+    discovery = dict(base_config['discovery'], manifest=str(tmp_path / 'discovery.json'))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'GLEIF.xlsx').touch()
+    for folder in ['.gleif_bench', 'output']:
+        (tmp_path / folder / 'run').mkdir(parents=True)
+        (tmp_path / folder / 'run' / 'GLEIF.xlsx').touch()
+        (tmp_path / folder / 'run' / 'TR1.xlsx').touch()
+    assert discover_directories(base_config['files']['names'], discovery) == {'TR': [], 'GLEIF': ['./GLEIF.xlsx']}
+    # Les valeurs par defaut, sans section discovery, ignorent les memes dossiers
+    defaults = {'manifest': str(tmp_path / 'defaults.json')}
+    assert repository.get_directories(base_config['files']['names'], defaults)['GLEIF'] == ['./GLEIF.xlsx']
+
+
+def test_discovery_manifest_is_optional(base_config, tmp_path, monkeypatch):
+    # Un manifest impossible a ecrire ne bloque pas la recherche
+    discovery = dict(base_config['discovery'], manifest=str(tmp_path / 'missing' / 'discovery.json'))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'GLEIF.xlsx').touch()
+    assert discover_directories(base_config['files']['names'], discovery) == {'TR': [], 'GLEIF': ['./GLEIF.xlsx']}
@@ -0,0 +1,96 @@
+import copy
+import json
+import threading
+import pytest
+from urllib.error import HTTPError
+from urllib.request import (Request, urlopen)
+
+import repository
+from conftest import ROOT
+from server import serve
+
+
+@pytest.fixture(scope='module')
+def config(base_config, tmp_path_factory):
+    # Un seul serveur pour le module: il ecrit ses caches et son store dans un dossier temporaire
+    config = copy.deepcopy(base_config)
+    directory = tmp_path_factory.mktemp('server')
+    for section, name in [('cache', 'cache'), ('store', 'store'), ('gleif', 'lookup')]:
+        config[section]['directory'] = str(directory / name)
+    config['discovery']['manifest'] = str(directory / 'discovery.json')
+    config['service']['port'] = 0
+    return config
+
+
+@pytest.fixture(scope='module')
+def server(config):
+    # Port 0: le systeme choisit un port libre, le serveur tourne dans son propre thread
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv(repository.DATA_DIR_ENV, ROOT)
+        server = serve(config)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f'http://{server.server_address[0]}:{server.server_address[1]}'
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def request(url: str, method: str = 'GET'):
+    try:
+        with urlopen(Request(url, method=method), timeout=60) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_routes(server, config):
+    assert request(server + '/health') == (200, {'status': 'ok'})
+
+    status, describe = request(server + '/describe')
+    assert status == 200
+    assert describe['indices'] == config['rates']['names']
+    assert describe['scales'] == ['country', 'company', 'parent']
+    assert 'FR' in describe['countries']
+
+    status, exposures = request(server + '/exposures?index=EONIA&top_bottom=Top&num=5')
+    assert status == 200
+    assert exposures['version'] == describe['version']
+    assert exposures['rows'] == len(exposures['data']) == 5
+    assert {row['Index'] for row in exposures['data']} == {'EONIA'}
+    ratios = [row[config['columns']['ratio']] for row in exposures['data']]
+    assert ratios == sorted(ratios, reverse=True)
+
+    # Une requete equivalente sort du cache
+    assert request(server + '/exposures?top_bottom=Top&num=5&index=EONIA') == (200, exposures)
+    assert request(server + '/describe')[1]['cache']['hits'] >= 1
+
+    status, reloaded = request(server + '/reload', 'POST')
+    assert status == 200 and reloaded['version'] > describe['version']
+    assert request(server + '/describe')[1]['cache']['entries'] == 0
+
+
+@pytest.mark.parametrize('path, method, status', [
+    ('/exposures?scale=planet', 'GET', 400),
+    ('/exposures?index=SOFR', 'GET', 400),
+    ('/exposures?top_bottom=Top&num=zero', 'GET', 400),
+    ('/exposures?top_bottom=Middle', 'GET', 400),
+    ('/unknown', 'GET', 404),
+    ('/exposures', 'POST', 404),
+    ('/reload', 'GET', 404)
+])
+def test_errors(server, path, method, status):
+    code, body = request(server + path, method)
+    assert code == status
+    assert 'error' in body
+
+
+def test_unexpected_error(server, monkeypatch):
+    # Une erreur imprevue (source illisible...) rend une reponse JSON 500 au lieu de fermer la connexion
+    def get_frames(config):
+        raise KeyError('Lei_rptg')
+
+    monkeypatch.setattr('server.get_frames', get_frames)
+    status, body = request(server + '/reload', 'POST')
+    assert status == 500
+    assert body == {'error': "KeyError: 'Lei_rptg'"}
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from helper_exposition import exposition
+from helper_sql import (exposition_sql, set_data_sql)
+
+duckdb = pytest.importorskip('duckdb')
+
+
+def to_rows(expo: pd.DataFrame, keys: list):
+    # Les deux versions sont comparees sur les valeurs des cles, dans le meme ordre
+    expo = expo.astype({key: object for key in keys})
+    return expo.sort_values(keys, ignore_index=True)[keys + ['Gross_Exposure', 'Net_Exposure', 'Cash_Flow', 'Ratio']]
+
+
+@pytest.mark.parametrize('index', [['EONIA'], ['LIBOR'], ['EONIA', 'LIBOR']])
+def test_exposition_sql_matches_pandas(directories, config, data, tmp_path, index):
+    config['sql']['directory'] = str(tmp_path / 'sql')
+    connection = set_data_sql(directories, config)
+    try:
+        # Echelle nationale puis echelle des entreprises
+        pd.testing.assert_frame_equal(to_rows(exposition_sql(connection, index), ['Country', 'Index']),
+                                      to_rows(exposition(d=data, i=index), ['Country', 'Index']),
+                                      check_dtype=False, check_exact=False)
+        keys = ['Name', 'Country', 'Index']
+        pd.testing.assert_frame_equal(to_rows(exposition_sql(connection, index, scale=True), keys),
+                                      to_rows(exposition(d=data, i=index, scl=[True]), keys),
+                                      check_dtype=False, check_exact=False)
+    finally:
+        connection.close()
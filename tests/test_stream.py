@@ -0,0 +1,21 @@
+import pandas as pd
+
+from helper_exposition import set_cube
+from helper_stream import (read_stream, write_stream)
+from test_incremental import sort_cube
+
+
+def test_stream_matches_set_data(directories, config, data):
+    # Des chunks de 1000 lignes: chaque fichier est traite en plusieurs morceaux
+    config['ingestion']['chunk_rows'] = 1000
+    stream = read_stream(write_stream(directories, config))
+
+    # Les doublons ecartes d'un chunk a l'autre sont ceux de set_data
+    assert len(stream['Repository']) == len(data['Repository'])
+    assert set(stream['Repository'].index) == set(data['Repository'].index)
+    assert stream['Duplicates']['Duplicates'].sum() == data['Duplicates']['Duplicates'].sum()
+    # Les LEI numeriques sont relus en texte depuis le Parquet
+    assert set(stream['Entities']['Lei'].astype(str)) == set(data['Entities']['Lei'].astype(str))
+
+    # Le cube des expositions calcule chunk par chunk est celui de set_data
+    pd.testing.assert_frame_equal(sort_cube(set_cube(stream)), sort_cube(set_cube(data)), check_exact=False)
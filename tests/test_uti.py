@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from helper_uti import (drop_duplicates, save, set_uti_index)
+
+
+def test_drop_duplicates_matches_pandas(tmp_path):
+    rng = np.random.default_rng(0)
+    uti = pd.Series(rng.integers(0, 3000, 10000)).map('UTI{:05d}'.format)
+    trades = pd.DataFrame({'uti': uti, 'notional': np.arange(len(uti))})
+
+    # Trois livraisons dedoublonnees l'une apres l'autre avec le meme index: l'index fusionne plusieurs tableaux tries
+    uti_index = set_uti_index()
+    kept, reports = [], []
+    for delivery in np.array_split(np.arange(len(trades)), 3):
+        delivery = trades.iloc[delivery]
+        result, report = drop_duplicates(delivery, uti_index, ['TR'], [len(delivery)])
+        kept.append(result)
+        reports.append(report)
+
+    # Comme drop_duplicates de pandas sur l'ensemble: la premiere occurrence de chaque UTI, dans l'ordre
+    reference = trades.drop_duplicates(subset='uti', keep='first')
+    pd.testing.assert_frame_equal(pd.concat(kept), reference)
+    assert sum(report['Duplicates'].sum() for report in reports) == len(trades) - len(reference)
+
+    # L'index persiste puis relu en memory-map ecarte tous les UTI deja integres
+    path = str(tmp_path / 'uti.npy')
+    save(uti_index, path)
+    result, report = drop_duplicates(trades, set_uti_index(path), ['TR1', 'TR2'], [4000, 6000])
+    assert result.empty
+    assert report['Duplicates'].tolist() == [4000, 6000]
@@ -1,9 +1,22 @@
+import hashlib
+import json
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 
-from repository import (get_directories, set_data, get_config)
-from helper_exposition import exposition
+from repository import get_config
+from helper_counterparty import (get_block, get_concentration, get_top_counterparties, set_counterparty)
+from helper_exposition import (get_countries, get_top_bottom, set_rank_index)
+from helper_store import (get_frames, invalidate)
+from helper_plot import (downsample, get_render_mode)
+from helper_scenario import (run_scenarios, set_scenarios, summarize)
+from helper_profile import (enable, get_report, reset, stage, to_json)
+
+# Nombre de figures Plotly gardees en memoire, toutes sections et toutes sessions confondues
+FIGURES = 128
+# Sections de la config lues par les figures: libelles, colonnes, titres, couleurs, indices et scenarios
+FIGURE_SECTIONS = ['streamlit', 'plots', 'columns', 'axis_labels', 'plot_titles', 'hover_templates', 'colors',
+                   'rates', 'scenarios']
 
 
 def to_streamlit(config: dict):
@@ -11,31 +24,58 @@ def to_streamlit(config: dict):
                        layout=config['streamlit']['layout'])
     st.title(config['streamlit']['page_title'])
 
-    # Met en cache certaines data
-    @st.cache_data
-    def get_processed_data():
-        directories = get_directories(config['files']['names'])
-        resultat = set_data(directories)
-        GLEIF_Country = exposition(data=resultat, indice=config['rates']['names'])
-        GLEIF_Company = exposition(data=resultat, indice=config['rates']['names'], scale=[True])
-        return GLEIF_Country, GLEIF_Company
-
-    # Met en cache certaines data
-    @st.cache_data
-    def get_filtered_data(data, exposition_type, top_bottom, num_countries, ratio_col):
-        filtered_data = data[data['Index'] == exposition_type]
-        if filtered_data.empty:
-            return pd.DataFrame()
-        if top_bottom == "Top":
-            filtered_data = filtered_data.nlargest(num_countries, ratio_col)
-        else:
-            filtered_data = filtered_data.nsmallest(num_countries, ratio_col)
-        return filtered_data
+    profile = config.get('profile', {})
+    if profile.get('enabled', False):
+        enable(profile.get('memory', False))
+        reset()
 
-    # Charge et traite les données
-    GLEIF_Country, GLEIF_Company = get_processed_data()
+    show_expositions(config)
 
-    st.header(config['streamlit']['sub_title'])
+    if profile.get('enabled', False):
+        show_diagnostics(config)
+
+
+def show_diagnostics(config: dict):
+    # Panneau de diagnostic: temps, lignes et pic memoire de chaque etape du dernier affichage
+    with st.expander('Diagnostics', expanded=False):
+        st.caption('Les etapes mises en cache par Streamlit ne sont mesurees que lors de leur premier calcul. '
+                   'Un widget ne reexecute que sa section: seules les etapes de cette section sont alors mesurees')
+        st.dataframe(get_report(), hide_index=True)
+        st.download_button('Export JSON', to_json(), file_name=config['profile']['output'],
+                           mime='application/json')
+
+
+def get_settings_key(config: dict):
+    # Empreinte des sections de la config lues par les figures: un libelle ou un seuil modifie change la cle
+    settings = {section: config.get(section) for section in FIGURE_SECTIONS}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@st.cache_resource(max_entries=FIGURES, show_spinner=False)
+def get_figure(name: str, version: int, settings: str, selection: tuple, _build):
+    """
+    Cette fonction garde les figures deja construites:
+    - Son but: Ne construire une figure Plotly qu'une fois par section, version du store, config d'affichage et
+               selection des widgets. Revenir a une selection deja vue, ou la meme selection dans une autre
+               session, ne refait ni le filtrage ni la figure
+
+    - Parametres: il faut renseigne le nom de la section, la version du store, l'empreinte de la config
+                  (get_settings_key), la selection (hashable) et la fonction qui construit la figure (ignoree par la
+                  cle du cache)
+
+    -Resultat : ce que rend la fonction de construction, en general la figure et les donnees affichees avec elle
+    """
+    return _build()
+
+
+def open_section(label: str, key: str):
+    # Section sous la ligne de flottaison: repliee par defaut, son contenu n'est calcule qu'une fois ouverte
+    section = st.expander(label, key=key, on_change='rerun')
+    return section if section.open else None
+
+
+@st.fragment
+def show_countries(config: dict, version: int, country_rank: dict):
     st.header(config['streamlit']['scatter_plot_title'])
 
     # Choisir l'exposition
@@ -63,292 +103,613 @@ def to_streamlit(config: dict):
     size_col = config['columns']['gross_exposure']
     ratio_col = config['columns']['ratio']
 
-    filtered_data = get_filtered_data(GLEIF_Country, exposition_type, top_bottom, num_countries, ratio_col)
-    if filtered_data.empty:
-        st.error(f"No data available for {exposition_type}.")
-        return
-
-    additional_countries = st.multiselect(
-        config['streamlit']['add_more_countries_label'],
-        options=GLEIF_Country['Country'].unique(),
-        default=filtered_data['Country'].tolist()
-    )
-
-    # Vérification des critères de séléctions
-    selected_countries = set(filtered_data['Country']).union(additional_countries)
-    final_filtered_data = GLEIF_Country[
-        GLEIF_Country['Country'].isin(selected_countries) & (GLEIF_Country['Index'] == exposition_type)
-        ]
-
-    if final_filtered_data.empty:
-        st.error(f"No data available for the selected options.")
-        return
-
-    # Scatter plot : one country and one index
-    fig = px.scatter(
-        final_filtered_data,
-        x=x_col,
-        y=y_col,
-        size=size_col,
-        color='Country',
-        hover_name='Country',
-        title=config['plot_titles']['scatter'],
-        labels={
-            x_col: config['axis_labels']['gross_exposure'],
-            y_col: config['axis_labels']['net_exposure'],
-            size_col: config['axis_labels']['gross_exposure']
-        }
-    )
-
-    fig.update_layout(
-        title=f"{top_bottom} {num_countries} Countries by {exposition_type} Exposition Ratio",
-        legend_title_text=config['axis_labels']['legend_countries'],
-        margin=dict(l=0, r=0, t=50, b=0),
-        xaxis_title=config['axis_labels']['gross_exposure'],
-        yaxis_title=config['axis_labels']['net_exposure']
-    )
-
-    fig.update_traces(
-        hovertemplate=config['hover_templates']['scatter'],
-        customdata=final_filtered_data[[ratio_col]].to_numpy()
-    )
-
-    st.plotly_chart(fig)
+    with stage('view.scatter_countries') as section:
+        filtered_data = get_top_bottom(country_rank, exposition_type, top_bottom, num_countries, ratio_col)
+        if filtered_data.empty:
+            st.error(f"No data available for {exposition_type}.")
+            return
 
-    st.subheader(config['streamlit']['final_filtered_data_subheader'])
-    st.dataframe(final_filtered_data)
+        additional_countries = st.multiselect(
+            config['streamlit']['add_more_countries_label'],
+            options=country_rank['countries'],
+            default=filtered_data['Country'].tolist()
+        )
 
+        # Vérification des critères de séléctions
+        selected_countries = set(filtered_data['Country']).union(additional_countries)
+
+        def build():
+            final_filtered_data = get_countries(country_rank, selected_countries, exposition_type)
+            if final_filtered_data.empty:
+                return None, final_filtered_data
+
+            # Scatter plot : one country and one index
+            fig = px.scatter(
+                final_filtered_data,
+                x=x_col,
+                y=y_col,
+                size=size_col,
+                color='Country',
+                hover_name='Country',
+                title=config['plot_titles']['scatter'],
+                labels={
+                    x_col: config['axis_labels']['gross_exposure'],
+                    y_col: config['axis_labels']['net_exposure'],
+                    size_col: config['axis_labels']['gross_exposure']
+                }
+            )
+
+            fig.update_layout(
+                title=f"{top_bottom} {num_countries} Countries by {exposition_type} Exposition Ratio",
+                legend_title_text=config['axis_labels']['legend_countries'],
+                margin=dict(l=0, r=0, t=50, b=0),
+                xaxis_title=config['axis_labels']['gross_exposure'],
+                yaxis_title=config['axis_labels']['net_exposure']
+            )
+
+            fig.update_traces(
+                hovertemplate=config['hover_templates']['scatter'],
+                customdata=final_filtered_data[[ratio_col]].to_numpy()
+            )
+            return fig, final_filtered_data
+
+        fig, final_filtered_data = get_figure('scatter_countries', version, get_settings_key(config), (
+            exposition_type, top_bottom, num_countries, tuple(sorted(map(str, selected_countries)))), build)
+        if fig is None:
+            st.error(f"No data available for the selected options.")
+            return
+
+        st.plotly_chart(fig)
+
+        st.subheader(config['streamlit']['final_filtered_data_subheader'])
+        st.dataframe(final_filtered_data)
+        section['rows'] = len(final_filtered_data)
+
+
+def show_tables(config: dict, country_rank: dict):
     # Display les data pour toutes les expositions
-    for rate in config['rates']['names']:
-        rate_data = GLEIF_Country[GLEIF_Country['Index'] == rate]
-
-        if not rate_data.empty:
-            st.header(f"{config['streamlit']['highest_exposition_label']} {rate}")
-            top_exposition = rate_data.nlargest(5, ratio_col)
-            st.dataframe(top_exposition.loc[:, ["Country", x_col, y_col, ratio_col]])
-
-            st.header(f"{config['streamlit']['lowest_exposition_label']} {rate}")
-            lowest_exposition = rate_data.nsmallest(5, ratio_col)
-            st.dataframe(lowest_exposition.loc[:, ["Country", x_col, y_col, ratio_col]])
+    x_col = config['columns']['gross_exposure']
+    y_col = config['columns']['net_exposure']
+    ratio_col = config['columns']['ratio']
 
-    st.header(config['streamlit']['company_analysis_title'])
+    with stage('view.tables_by_index'):
+        for rate in config['rates']['names']:
+            top_exposition = get_top_bottom(country_rank, rate, "Top", 5, ratio_col)
 
-    # Histogramme: one country and one index
-    st.subheader(config['streamlit']['histogram_plot_title'])
-    selected_country = st.selectbox(config['streamlit']['select_country_label'], GLEIF_Company['Country'].unique())
-    selected_index = st.selectbox(config['streamlit']['select_index_label'], config['rates']['names'])
-
-    company_data = GLEIF_Company[(GLEIF_Company['Country'] == selected_country) &
-                                 (GLEIF_Company['Index'] == selected_index)]
-
-    if company_data.empty:
-        st.error(f"No data available for {selected_country} and {selected_index}.")
-    else:
-        # Classe par ratio
-        company_data = company_data.sort_values(by=ratio_col, ascending=False)
-        fig_company_hist = px.histogram(
-            company_data,
-            x="Name",
-            y=ratio_col,
-            color='Name',
-            title=f"{selected_country} - {selected_index} Exposition Ratios by Company",
-            labels={
-                ratio_col: config['axis_labels']['ratio'],
-                "Name": "Company"
-            }
-        )
+            if not top_exposition.empty:
+                st.header(f"{config['streamlit']['highest_exposition_label']} {rate}")
+                st.dataframe(top_exposition.loc[:, ["Country", x_col, y_col, ratio_col]])
 
-        fig_company_hist.update_layout(
-            title=f"{selected_country} - {selected_index} Exposition Ratios by Company",
-            legend_title_text=config['axis_labels']['legend_companies'],
-            margin=dict(l=0, r=0, t=50, b=0),
-            xaxis_title="Company",
-            yaxis_title=config['axis_labels']['ratio'],
-            autosize=True,
-            width=None,
-            height=None,
-            xaxis_tickvals=[],
-        )
+                st.header(f"{config['streamlit']['lowest_exposition_label']} {rate}")
+                lowest_exposition = get_top_bottom(country_rank, rate, "Bottom", 5, ratio_col)
+                st.dataframe(lowest_exposition.loc[:, ["Country", x_col, y_col, ratio_col]])
 
-        fig_company_hist.update_traces(
-            hovertemplate=config['hover_templates']['histogram']
-        )
 
-        st.plotly_chart(fig_company_hist)
+@st.fragment
+def show_company_histogram(config: dict, version: int, GLEIF_Company: pd.DataFrame):
+    # Histogramme: one country and one index
+    container = open_section(config['streamlit']['histogram_plot_title'], 'section_company_histogram')
+    if container is None:
+        return
 
+    x_col = config['columns']['gross_exposure']
+    ratio_col = config['columns']['ratio']
+    plots = config['plots']
+    with container:
+        selected_country = st.selectbox(config['streamlit']['select_country_label'],
+                                        GLEIF_Company['Country'].unique())
+        selected_index = st.selectbox(config['streamlit']['select_index_label'], config['rates']['names'])
+
+        with stage('view.histogram_companies') as section:
+            def build():
+                company_data = GLEIF_Company[(GLEIF_Company['Country'] == selected_country) &
+                                             (GLEIF_Company['Index'] == selected_index)]
+                if company_data.empty:
+                    return None, 0
+
+                # Seules les plus grosses expositions gardent leur barre, la traine est regroupee. Classe par ratio
+                company_data = downsample(company_data, plots['max_bars'], x_col, label=plots['others_label'])
+                company_data = company_data.sort_values(by=ratio_col, ascending=False)
+                fig_company_hist = px.histogram(
+                    company_data,
+                    x="Name",
+                    y=ratio_col,
+                    color='Name',
+                    title=f"{selected_country} - {selected_index} Exposition Ratios by Company",
+                    labels={
+                        ratio_col: config['axis_labels']['ratio'],
+                        "Name": "Company"
+                    }
+                )
+
+                fig_company_hist.update_layout(
+                    title=f"{selected_country} - {selected_index} Exposition Ratios by Company",
+                    legend_title_text=config['axis_labels']['legend_companies'],
+                    margin=dict(l=0, r=0, t=50, b=0),
+                    xaxis_title="Company",
+                    yaxis_title=config['axis_labels']['ratio'],
+                    autosize=True,
+                    width=None,
+                    height=None,
+                    xaxis_tickvals=[],
+                )
+
+                fig_company_hist.update_traces(
+                    hovertemplate=config['hover_templates']['histogram']
+                )
+                return fig_company_hist, len(company_data)
+
+            fig_company_hist, rows = get_figure('histogram_companies', version, get_settings_key(config),
+                                                (str(selected_country), selected_index), build)
+            if fig_company_hist is None:
+                st.error(f"No data available for {selected_country} and {selected_index}.")
+            else:
+                st.plotly_chart(fig_company_hist)
+            section['rows'] = rows
+
+
+@st.fragment
+def show_company_scatter(config: dict, version: int, GLEIF_Company: pd.DataFrame):
     # Deuxième scatter plot: multiple countries for one index
-    st.subheader(config['streamlit']['scatter_plot_multiple_title'])
-    selected_countries_multi = st.multiselect(config['streamlit']['select_countries_label'],
-                                              GLEIF_Company['Country'].unique())
-    selected_index_multi = st.selectbox(config['streamlit']['select_index_multiple_label'], config['rates']['names'],
-                                        key='multi')
-
-    company_data_multi = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_multi)) &
-                                       (GLEIF_Company['Index'] == selected_index_multi)]
-
-    if company_data_multi.empty:
-        st.error(f"No data available for the selected countries and {selected_index_multi}.")
-    else:
-        fig_company_multi = px.scatter(
-            company_data_multi,
-            x=x_col,
-            y=y_col,
-            size=size_col,
-            color='Country',
-            hover_name='Name',
-            title=config['plot_titles']['scatter_multiple'],
-            labels={
-                x_col: config['axis_labels']['gross_exposure'],
-                y_col: config['axis_labels']['net_exposure'],
-                size_col: config['axis_labels']['gross_exposure']
-            }
-        )
-
-        fig_company_multi.update_layout(
-            title=f"{selected_index_multi} Exposition Ratios by Company",
-            legend_title_text=config['axis_labels']['legend_countries'],
-            margin=dict(l=0, r=0, t=50, b=0),
-            xaxis_title=config['axis_labels']['gross_exposure'],
-            yaxis_title=config['axis_labels']['net_exposure']
-        )
-
-        fig_company_multi.update_traces(
-            hovertemplate=config['hover_templates']['scatter'],
-            customdata=company_data_multi[[ratio_col]].to_numpy()
-        )
-
-        st.plotly_chart(fig_company_multi)
+    container = open_section(config['streamlit']['scatter_plot_multiple_title'], 'section_company_scatter')
+    if container is None:
+        return
 
+    x_col = config['columns']['gross_exposure']
+    y_col = config['columns']['net_exposure']
+    size_col = config['columns']['gross_exposure']
+    ratio_col = config['columns']['ratio']
+    plots = config['plots']
+    with container:
+        selected_countries_multi = st.multiselect(config['streamlit']['select_countries_label'],
+                                                  GLEIF_Company['Country'].unique())
+        selected_index_multi = st.selectbox(config['streamlit']['select_index_multiple_label'],
+                                            config['rates']['names'], key='multi')
+
+        with stage('view.scatter_companies') as section:
+            def build():
+                company_data_multi = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_multi)) &
+                                                   (GLEIF_Company['Index'] == selected_index_multi)]
+                if company_data_multi.empty:
+                    return None, 0
+
+                # Les plus grosses expositions restent exactes, la traine est regroupee par pays
+                company_data_multi = downsample(company_data_multi, plots['max_points'], x_col, 'Country',
+                                                plots['others_label'])
+                fig_company_multi = px.scatter(
+                    company_data_multi,
+                    render_mode=get_render_mode(company_data_multi, plots),
+                    x=x_col,
+                    y=y_col,
+                    size=size_col,
+                    color='Country',
+                    hover_name='Name',
+                    title=config['plot_titles']['scatter_multiple'],
+                    labels={
+                        x_col: config['axis_labels']['gross_exposure'],
+                        y_col: config['axis_labels']['net_exposure'],
+                        size_col: config['axis_labels']['gross_exposure']
+                    }
+                )
+
+                fig_company_multi.update_layout(
+                    title=f"{selected_index_multi} Exposition Ratios by Company",
+                    legend_title_text=config['axis_labels']['legend_countries'],
+                    margin=dict(l=0, r=0, t=50, b=0),
+                    xaxis_title=config['axis_labels']['gross_exposure'],
+                    yaxis_title=config['axis_labels']['net_exposure']
+                )
+
+                fig_company_multi.update_traces(
+                    hovertemplate=config['hover_templates']['scatter'],
+                    customdata=company_data_multi[[ratio_col]].to_numpy()
+                )
+                return fig_company_multi, len(company_data_multi)
+
+            fig_company_multi, rows = get_figure('scatter_companies', version, get_settings_key(config), (
+                tuple(sorted(map(str, selected_countries_multi))), selected_index_multi), build)
+            if fig_company_multi is None:
+                st.error(f"No data available for the selected countries and {selected_index_multi}.")
+            else:
+                st.plotly_chart(fig_company_multi)
+            section['rows'] = rows
+
+
+@st.fragment
+def show_two_indices(config: dict, version: int, GLEIF_Company: pd.DataFrame):
     # Troisième Scatter Plot: one or multiple countries, two indices
-    st.subheader(config['streamlit']['scatter_plot_two_indices_title'])
-    selected_countries_two_indices = st.multiselect(config['streamlit']['select_countries_two_label'],
-                                                    GLEIF_Company['Country'].unique(), key='two')
-    index1 = st.selectbox(config['streamlit']['select_first_index_label'], config['rates']['names'], key='index1')
-    index2 = st.selectbox(config['streamlit']['select_second_index_label'], config['rates']['names'], key='index2')
-
-    company_data_index1 = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_two_indices)) &
-                                        (GLEIF_Company['Index'] == index1)]
-    company_data_index2 = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_two_indices)) &
-                                        (GLEIF_Company['Index'] == index2)]
-
-    if company_data_index1.empty or company_data_index2.empty:
-        st.error(f"No data available for the selected countries and indices.")
-    else:
-        company_data_index1['Index_Color'] = index1
-        company_data_index2['Index_Color'] = index2
-
-        combined_data = pd.concat([company_data_index1, company_data_index2])
-
-        fig_two_indices = px.scatter(
-            combined_data,
-            x=x_col,
-            y=y_col,
-            size=size_col,
-            color='Index_Color',
-            hover_name='Name',
-            title=f"{index1} vs {index2} Exposition Ratios by Company",
-            labels={
-                x_col: config['axis_labels']['gross_exposure'],
-                y_col: config['axis_labels']['net_exposure'],
-                size_col: config['axis_labels']['gross_exposure'],
-                'Index_Color': 'Index'
-            },
-            color_discrete_map={
-                index1: config['colors']['index1'],
-                index2: config['colors']['index2']
-            }
-        )
+    container = open_section(config['streamlit']['scatter_plot_two_indices_title'], 'section_two_indices')
+    if container is None:
+        return
 
-        fig_two_indices.update_layout(
-            title=f"{index1} vs {index2} Exposition Ratios by Company",
-            legend_title_text=config['axis_labels']['legend_index'],
-            margin=dict(l=0, r=0, t=50, b=0),
-            xaxis_title=config['axis_labels']['gross_exposure'],
-            yaxis_title=config['axis_labels']['net_exposure']
-        )
+    x_col = config['columns']['gross_exposure']
+    y_col = config['columns']['net_exposure']
+    size_col = config['columns']['gross_exposure']
+    ratio_col = config['columns']['ratio']
+    plots = config['plots']
+    with container:
+        selected_countries_two_indices = st.multiselect(config['streamlit']['select_countries_two_label'],
+                                                        GLEIF_Company['Country'].unique(), key='two')
+        index1 = st.selectbox(config['streamlit']['select_first_index_label'], config['rates']['names'],
+                              key='index1')
+        index2 = st.selectbox(config['streamlit']['select_second_index_label'], config['rates']['names'],
+                              key='index2')
+
+        with stage('view.scatter_two_indices') as section:
+            def build():
+                company_data_index1 = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_two_indices)) &
+                                                    (GLEIF_Company['Index'] == index1)]
+                company_data_index2 = GLEIF_Company[(GLEIF_Company['Country'].isin(selected_countries_two_indices)) &
+                                                    (GLEIF_Company['Index'] == index2)]
+                if company_data_index1.empty or company_data_index2.empty:
+                    return None, 0
+
+                # Chaque indice dispose de la moitie des points, la traine est regroupee par pays
+                company_data_index1 = downsample(company_data_index1, plots['max_points'] // 2, x_col, 'Country',
+                                                 plots['others_label'])
+                company_data_index2 = downsample(company_data_index2, plots['max_points'] // 2, x_col, 'Country',
+                                                 plots['others_label'])
+                company_data_index1['Index_Color'] = index1
+                company_data_index2['Index_Color'] = index2
+
+                combined_data = pd.concat([company_data_index1, company_data_index2])
+
+                fig_two_indices = px.scatter(
+                    combined_data,
+                    render_mode=get_render_mode(combined_data, plots),
+                    x=x_col,
+                    y=y_col,
+                    size=size_col,
+                    color='Index_Color',
+                    hover_name='Name',
+                    title=f"{index1} vs {index2} Exposition Ratios by Company",
+                    labels={
+                        x_col: config['axis_labels']['gross_exposure'],
+                        y_col: config['axis_labels']['net_exposure'],
+                        size_col: config['axis_labels']['gross_exposure'],
+                        'Index_Color': 'Index'
+                    },
+                    color_discrete_map={
+                        index1: config['colors']['index1'],
+                        index2: config['colors']['index2']
+                    }
+                )
+
+                fig_two_indices.update_layout(
+                    title=f"{index1} vs {index2} Exposition Ratios by Company",
+                    legend_title_text=config['axis_labels']['legend_index'],
+                    margin=dict(l=0, r=0, t=50, b=0),
+                    xaxis_title=config['axis_labels']['gross_exposure'],
+                    yaxis_title=config['axis_labels']['net_exposure']
+                )
+
+                fig_two_indices.update_traces(
+                    hovertemplate=config['hover_templates']['scatter'],
+                    customdata=combined_data[[ratio_col]].to_numpy()
+                )
+                return fig_two_indices, len(company_data_index1)
+
+            fig_two_indices, rows = get_figure('scatter_two_indices', version, get_settings_key(config), (
+                tuple(sorted(map(str, selected_countries_two_indices))), index1, index2), build)
+            if fig_two_indices is None:
+                st.error(f"No data available for the selected countries and indices.")
+            else:
+                st.plotly_chart(fig_two_indices)
+            section['rows'] = rows
+
+
+@st.fragment
+def show_counterparty(config: dict, version: int, frames: dict):
+    # Matrices bilaterales construites une fois par version du store et par niveau, partagees entre les sessions.
+    # Les jambes sont celles du store: un rechargement ou un fichier modifie change la version et la cle
+    @st.cache_resource(max_entries=2)
+    def get_counterparty(version: int, level: str, _frames: dict):
+        return set_counterparty(_frames, level)
+
+    labels = config['streamlit']
+    container = open_section(labels['counterparty_title'], 'section_counterparty')
+    if container is None:
+        return
 
-        fig_two_indices.update_traces(
-            hovertemplate=config['hover_templates']['scatter'],
-            customdata=combined_data[[ratio_col]].to_numpy()
-        )
+    with container:
+        if 'Buyer' not in frames:
+            st.info("Counterparty exposures are not available with the SQL backend.")
+            return
+
+        level = st.radio(labels['counterparty_level_label'], ('Country', 'Lei'), key='counterparty_level')
+        selected_index = st.selectbox(labels['select_index_label'], config['rates']['names'],
+                                      key='counterparty_index')
+        measure = st.radio(labels['counterparty_measure_label'], ('Gross', 'Net'), key='counterparty_measure')
+        size = st.slider(labels['counterparty_size_label'], min_value=2, max_value=50, value=15,
+                         key='counterparty_size')
+
+        with stage('view.heatmap_counterparty') as section:
+            counterparty = get_counterparty(version, level, frames)
+            if selected_index not in counterparty:
+                st.error(f"No data available for {selected_index}.")
+                return
+
+            # Lignes: par defaut les plus grosses expositions, colonnes: leurs principales contreparties. La
+            # selection repart des valeurs par defaut quand le niveau, l'indice ou la mesure change
+            concentration = get_concentration(counterparty, selected_index, measure)
+            rows = st.multiselect(labels['counterparty_rows_label'], concentration['Entity'].head(500).tolist(),
+                                  default=concentration['Entity'].head(size).tolist(),
+                                  key=f'counterparty_rows_{level}_{selected_index}_{measure}')
+            if not rows:
+                st.error("No data available for the selected options.")
+                return
+
+            def build():
+                top = pd.concat([get_top_counterparties(counterparty, selected_index, row, size, measure)
+                                 for row in rows])
+                columns = top.groupby('Counterparty', sort=False)[measure].apply(lambda values: values.abs().sum())
+                columns = columns.nlargest(size).index.tolist()
+
+                # Seul le bloc demande est densifie et envoye au navigateur
+                block = get_block(counterparty, selected_index, rows, columns, measure)
+                fig_counterparty = px.imshow(
+                    block,
+                    aspect='auto',
+                    color_continuous_scale='RdBu' if measure == 'Net' else 'Blues',
+                    color_continuous_midpoint=0 if measure == 'Net' else None,
+                    labels={'x': labels['counterparty_columns_label'], 'y': labels['counterparty_rows_label'],
+                            'color': measure},
+                    title=f"{selected_index} {measure} Exposure by Counterparty"
+                )
+                fig_counterparty.update_layout(margin=dict(l=0, r=0, t=50, b=0))
+                return fig_counterparty, block.size
+
+            fig_counterparty, cells = get_figure('heatmap_counterparty', version, get_settings_key(config), (
+                level, selected_index, measure, size, tuple(map(str, rows))), build)
+            st.plotly_chart(fig_counterparty)
+
+            st.subheader(labels['counterparty_concentration_label'])
+            st.dataframe(concentration[concentration['Entity'].isin(rows)], hide_index=True)
+            section['rows'] = cells
+
+
+@st.fragment
+def show_groups(config: dict, version: int, frames: dict):
+    # Expositions consolidees par tete de groupe: une simple lecture de l'exposition precalculee dans le store
+    labels = config['streamlit']
+    container = open_section(labels['group_title'], 'section_groups')
+    if container is None:
+        return
 
-        st.plotly_chart(fig_two_indices)
+    with container:
+        if 'Parent' not in frames:
+            st.info("Group-level exposures are not available with the SQL backend.")
+            return
+
+        selected_index = st.selectbox(labels['select_index_label'], config['rates']['names'], key='group_index')
+        size = st.slider(labels['group_size_label'], min_value=1, max_value=50, value=10, key='group_size')
+        x_col = config['columns']['gross_exposure']
+        y_col = config['columns']['net_exposure']
+
+        with stage('view.bar_groups') as section:
+            def build():
+                groups = frames['Parent']
+                groups = groups[groups['Index'] == selected_index].nlargest(size, x_col)
+                if groups.empty:
+                    return None, groups
+
+                fig_groups = px.bar(
+                    groups,
+                    x='Name',
+                    y=[x_col, y_col],
+                    barmode='group',
+                    hover_data=['Lei', 'Country', 'Entities'],
+                    title=f"Top {size} Groups by {selected_index} Gross Exposure",
+                    labels={'value': config['axis_labels']['gross_exposure'], 'Name': 'Group'}
+                )
+                fig_groups.update_layout(margin=dict(l=0, r=0, t=50, b=0))
+                return fig_groups, groups
+
+            fig_groups, groups = get_figure('bar_groups', version, get_settings_key(config), (selected_index, size),
+                                            build)
+            if fig_groups is None:
+                st.error(f"No data available for {selected_index}.")
+                return
+
+            st.plotly_chart(fig_groups)
+            st.dataframe(groups, hide_index=True)
+            section['rows'] = len(groups)
+
+
+@st.fragment
+def show_scenarios(config: dict, version: int, frames: dict):
+    # Tous les scenarios sont evalues en une passe sur les jambes du store, une fois par version, par echelle et par
+    # parametrage: la section [scenarios] et les indices font partie de la cle du cache
+    @st.cache_resource(max_entries=2)
+    def get_scenarios(version: int, scale: str, settings: dict, indices: tuple, _frames: dict):
+        scenarios = set_scenarios(settings, list(indices))
+        groups, result = run_scenarios(_frames, scenarios, scale, settings)
+        return scenarios, result, summarize(groups, result)
+
+    labels = config['streamlit']
+    container = open_section(labels['scenario_title'], 'section_scenarios')
+    if container is None:
+        return
 
+    with container:
+        if 'Buyer' not in frames:
+            st.info("Rate-shock scenarios are not available with the SQL backend.")
+            return
+
+        scale = st.radio(labels['scenario_scale_label'], ('Country', 'Company'), key='scenario_scale')
+        selected_index = st.selectbox(labels['select_index_label'], config['rates']['names'], key='scenario_index')
+
+        with stage('view.box_scenarios') as section:
+            scenarios, result, summary = get_scenarios(version, scale, config['scenarios'],
+                                                       tuple(config['rates']['names']), frames)
+            st.caption(f"{len(scenarios)} scenarios ({config['scenarios']['mode']}), the first one without shock")
+            summary = summary[summary['Index'] == selected_index]
+            if summary.empty:
+                st.error(f"No data available for {selected_index}.")
+                return
+
+            # Par defaut, les groupes dont le Cash_Flow varie le plus d'un scenario a l'autre
+            names = summary['Country'] if scale == 'Country' else summary['Name'] + ' (' + summary['Country'] + ')'
+            names = pd.Series(names.astype(str).to_numpy(), index=summary.index)
+            options = names.loc[summary['Std'].sort_values(ascending=False).index].tolist()
+            selected = st.multiselect(labels['scenario_groups_label'], options[:500], default=options[:5],
+                                      key=f'scenario_groups_{scale}_{selected_index}')
+            if not selected:
+                st.error("No data available for the selected options.")
+                return
+
+            rows = names[names.isin(selected)].index
+
+            def build():
+                distribution = pd.DataFrame(result[rows].T, columns=names[rows].tolist()).melt(
+                    var_name='Group', value_name='Cash_Flow')
+                fig_scenarios = px.box(
+                    distribution,
+                    x='Group',
+                    y='Cash_Flow',
+                    points=False,
+                    title=f"{selected_index} Cash Flow Distribution across Scenarios",
+                    labels={'Cash_Flow': config['axis_labels']['cash_flow']}
+                )
+                fig_scenarios.update_layout(margin=dict(l=0, r=0, t=50, b=0))
+                return fig_scenarios, len(distribution)
+
+            fig_scenarios, cells = get_figure('box_scenarios', version, get_settings_key(config),
+                                              (scale, selected_index, tuple(sorted(selected))), build)
+            st.plotly_chart(fig_scenarios)
+            st.dataframe(summary.loc[rows], hide_index=True)
+            section['rows'] = cells
+
+
+@st.fragment
+def show_cash_flow(config: dict, version: int, country_rank: dict):
     #  Deuxième histogramme plot for Cash_Flow
-    st.header(config['streamlit']['cash_flow_analysis_title'])
-    st.subheader(config['streamlit']['cash_flow_histogram_title'])
-
-    # Selectionner le nombre de Top/Bottom
-    top_bottom_cash = st.radio(
-        config['streamlit']['show_top_bottom_label'],
-        ("Top", "Bottom"),
-        key='cash_flow'
-    )
-
-    num_countries_cash = st.slider(
-        config['streamlit']['select_num_countries_label'],
-        min_value=1,
-        max_value=50,
-        value=10,
-        key='cash_flow_slider'
-    )
-
-    # Filtrer les data en fonction des séléctions
-    cash_flow_col = config['columns']['cash_flow']
-
-    filtered_data_cash = GLEIF_Country.copy()
-    if top_bottom_cash == "Top":
-        filtered_data_cash = filtered_data_cash.nlargest(num_countries_cash, cash_flow_col)
-    else:
-        filtered_data_cash = filtered_data_cash.nsmallest(num_countries_cash, cash_flow_col)
+    container = open_section(config['streamlit']['cash_flow_histogram_title'], 'section_cash_flow')
+    if container is None:
+        return
 
-    additional_countries_cash = st.multiselect(
-        config['streamlit']['add_more_countries_label'],
-        options=GLEIF_Country['Country'].unique(),
-        default=filtered_data_cash['Country'].tolist(),
-        key='cash_flow_multiselect'
-    )
+    with container:
+        # Selectionner le nombre de Top/Bottom
+        top_bottom_cash = st.radio(
+            config['streamlit']['show_top_bottom_label'],
+            ("Top", "Bottom"),
+            key='cash_flow'
+        )
 
-    # Vérification de la séléction
-    selected_countries_cash = set(filtered_data_cash['Country']).union(additional_countries_cash)
-    final_filtered_data_cash = GLEIF_Country[
-        GLEIF_Country['Country'].isin(selected_countries_cash)
-    ]
+        num_countries_cash = st.slider(
+            config['streamlit']['select_num_countries_label'],
+            min_value=1,
+            max_value=50,
+            value=10,
+            key='cash_flow_slider'
+        )
 
-    if final_filtered_data_cash.empty:
-        st.error(f"No data available for the selected options.")
-        return
+        # Filtrer les data en fonction des séléctions
+        cash_flow_col = config['columns']['cash_flow']
+
+        with stage('view.histogram_cash_flow') as section:
+            filtered_data_cash = get_top_bottom(country_rank, None, top_bottom_cash, num_countries_cash,
+                                                cash_flow_col)
+
+            additional_countries_cash = st.multiselect(
+                config['streamlit']['add_more_countries_label'],
+                options=country_rank['countries'],
+                default=filtered_data_cash['Country'].tolist(),
+                key='cash_flow_multiselect'
+            )
+
+            # Vérification de la séléction
+            selected_countries_cash = set(filtered_data_cash['Country']).union(additional_countries_cash)
+
+            def build():
+                final_filtered_data_cash = get_countries(country_rank, selected_countries_cash)
+                if final_filtered_data_cash.empty:
+                    return None, 0
+
+                # Tri par niveau de Cash Flow
+                final_filtered_data_cash = final_filtered_data_cash.sort_values(
+                    by=cash_flow_col, ascending=(top_bottom_cash == "Bottom"))
+
+                # Histogramme
+                fig_cash_flow = px.histogram(
+                    final_filtered_data_cash,
+                    x='Country',
+                    y=cash_flow_col,
+                    color='Country',
+                    title=f"{top_bottom_cash} {num_countries_cash} Countries by Cash Flow",
+                    labels={
+                        'Country': "Country",
+                        cash_flow_col: config['axis_labels']['cash_flow']
+                    }
+                )
+
+                fig_cash_flow.update_layout(
+                    title=f"{top_bottom_cash} {num_countries_cash} Countries by Cash Flow",
+                    legend_title_text=config['axis_labels']['legend_countries'],
+                    margin=dict(l=0, r=0, t=50, b=0),
+                    xaxis_title="Country",
+                    yaxis_title=config['axis_labels']['cash_flow']
+                )
+
+                fig_cash_flow.update_traces(
+                    hovertemplate=config['hover_templates']['histogram_cash_flow']
+                )
+                return fig_cash_flow, len(final_filtered_data_cash)
+
+            fig_cash_flow, rows = get_figure('histogram_cash_flow', version, get_settings_key(config), (
+                top_bottom_cash, num_countries_cash, tuple(sorted(map(str, selected_countries_cash)))), build)
+            if fig_cash_flow is None:
+                st.error(f"No data available for the selected options.")
+                return
+
+            st.plotly_chart(fig_cash_flow)
+            section['rows'] = rows
+
+
+def show_expositions(config: dict):
+    """
+    Cette fonction affiche le dashboard des expositions:
+    - Son but: Charger les donnees une fois, puis decouper la page en sections independantes (st.fragment): un
+               widget ne reexecute que sa section, dont la figure sort du cache tant que la selection est deja
+               connue. Les sections sous la ligne de flottaison sont repliees et ne sont calculees qu'une fois
+               ouvertes
+
+    - Parametres: il faut renseigne la config
+
+    -Resultat : rien, la page Streamlit est construite
+    """
+    # Index des rangs construit une seule fois par version du store et partage sans copie entre les sessions:
+    # les Top/Bottom N et les selections de pays ne sont plus que des tranches
+    @st.cache_resource(max_entries=1)
+    def get_rank_index(version: int, _country):
+        return set_rank_index(_country, [config['columns']['ratio'], config['columns']['cash_flow']])
+
+    # Rechargement explicite: vide le store partage et les caches indexes sur sa version
+    if st.sidebar.button('Reload data'):
+        invalidate(config)
+
+    # Charge et traite les données, une seule fois pour toutes les sessions du serveur
+    with stage('view.get_processed_data') as section:
+        version, frames = get_frames(config)
+        country_rank = get_rank_index(version, frames['Country'])
+        GLEIF_Company = frames['Company']
+        section['rows'] = len(country_rank['data'])
 
-    # Tri par niveau de Cash Flow
-    final_filtered_data_cash = final_filtered_data_cash.sort_values(by=cash_flow_col,
-                                                                    ascending=(top_bottom_cash == "Bottom"))
-
-    # Histogramme
-    fig_cash_flow = px.histogram(
-        final_filtered_data_cash,
-        x='Country',
-        y=cash_flow_col,
-        color='Country',
-        title=f"{top_bottom_cash} {num_countries_cash} Countries by Cash Flow",
-        labels={
-            'Country': "Country",
-            cash_flow_col: config['axis_labels']['cash_flow']
-        }
-    )
+    st.header(config['streamlit']['sub_title'])
+    show_countries(config, version, country_rank)
+    show_tables(config, country_rank)
 
-    fig_cash_flow.update_layout(
-        title=f"{top_bottom_cash} {num_countries_cash} Countries by Cash Flow",
-        legend_title_text=config['axis_labels']['legend_countries'],
-        margin=dict(l=0, r=0, t=50, b=0),
-        xaxis_title="Country",
-        yaxis_title=config['axis_labels']['cash_flow']
-    )
+    st.header(config['streamlit']['company_analysis_title'])
+    show_company_histogram(config, version, GLEIF_Company)
+    show_company_scatter(config, version, GLEIF_Company)
+    show_two_indices(config, version, GLEIF_Company)
 
-    fig_cash_flow.update_traces(
-        hovertemplate=config['hover_templates']['histogram_cash_flow']
-    )
+    show_counterparty(config, version, frames)
+    show_groups(config, version, frames)
+    show_scenarios(config, version, frames)
 
-    st.plotly_chart(fig_cash_flow)
+    st.header(config['streamlit']['cash_flow_analysis_title'])
+    show_cash_flow(config, version, country_rank)
 
 # Chargement Streamlit
 if __name__ == "__main__":